@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Micro-batching for the local model
+Concurrent callers submit single items; a collector thread groups whatever
+arrives within a short window and runs one batched call for all of them
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """Groups concurrent single-item calls into one batch call"""
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], window: float = 0.005, max_batch: int = 64):
+        self.batch_fn = batch_fn
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.stats = {'batches': 0, 'items': 0, 'max_batch_seen': 0}
+
+    @classmethod
+    def from_env(cls, batch_fn: Callable[[List[Any]], List[Any]]) -> Optional['MicroBatcher']:
+        """Build a batcher if MICRO_BATCH_WINDOW_MS is set above zero"""
+        window_ms = float(os.getenv('MICRO_BATCH_WINDOW_MS', '0'))
+        if window_ms <= 0:
+            return None
+        return cls(batch_fn, window=window_ms / 1000.0, max_batch=int(os.getenv('MICRO_BATCH_MAX_SIZE', '64')))
+
+    def _ensure_started(self):
+        """Start the collector thread in the current process (threads do not survive fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            threading.Thread(target=self._run, name='micro-batcher', daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, item: Any) -> Any:
+        """Run item through the next batch and wait for its result"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                results = self.batch_fn([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"Micro-batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+
+            self.stats['batches'] += 1
+            self.stats['items'] += len(batch)
+            self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(batch))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Batch counters for the health endpoint"""
+        stats = dict(self.stats)
+        stats['mean_batch_size'] = round(stats['items'] / stats['batches'], 2) if stats['batches'] else 0.0
+        stats['window_ms'] = self.window * 1000.0
+        return stats
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Load-test the Flask app end to end, fully offline
+Starts local stand-ins for Twilio and the LLM providers (with configurable
+latency and error injection), runs the app in a child process pointed at them,
+drives /webhook and /test at a fixed concurrency and reports RPS and latency
+percentiles. Results are saved as JSON and can be compared with a baseline run
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SERVICES = ('openai', 'anthropic', 'huggingface', 'ollama', 'twilio')
+LLM_SERVICES = SERVICES[:-1]
+DEFAULT_LATENCY_MS = {'openai': 300, 'anthropic': 300, 'huggingface': 500, 'ollama': 800, 'twilio': 100}
+
+TWILIO_API = 'https://api.twilio.com'
+STUB_ANSWER = ("Rest, drink plenty of fluids and monitor your temperature. "
+               "See a doctor if symptoms last more than three days.")
+
+SAMPLE_MESSAGES = [
+    "I have a fever and headache", "My stomach hurts after eating", "I have a sore throat and cough",
+    "I feel dizzy when I stand up", "I have back pain since yesterday", "My skin is itchy with a red rash",
+    "I have chest pain when breathing", "I can't sleep at night", "My knee is swollen and stiff",
+    "I have diarrhea and nausea", "I have a runny nose and sneezing", "My tooth hurts when I drink cold water"
+]
+
+# Real credentials must never reach the app under test
+CREDENTIAL_VARS = ('OPENAI_API_KEY', 'ANTHROPIC_API_KEY', 'HUGGINGFACE_API_KEY',
+                   'TWILIO_ACCOUNT_SID', 'TWILIO_AUTH_TOKEN', 'TWILIO_PHONE_NUMBER')
+
+class StubServer:
+    """One HTTP server that answers like OpenAI, Anthropic, HuggingFace, Ollama and Twilio"""
+
+    def __init__(self, latency_ms, error_rates, jitter=0.2, seed=0):
+        self.latency_ms = latency_ms
+        self.error_rates = error_rates
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.injected_errors = Counter()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self._send(200, b'')
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                service = stub.service_for(self.path)
+                if service is None:
+                    self._send(404, b'{"error": "unknown stub route"}')
+                    return
+                status, payload = stub.respond(service, self.path, body)
+                self._send(status, json.dumps(payload).encode())
+
+            def _send(self, status, data):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if data:
+                    self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='stub-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    @staticmethod
+    def service_for(path):
+        if path.startswith('/v1/chat/completions'):
+            return 'openai'
+        if path.startswith('/v1/messages'):
+            return 'anthropic'
+        if path.startswith('/api/generate'):
+            return 'ollama'
+        if path.startswith('/models/'):
+            return 'huggingface'
+        if path.startswith('/2010-04-01/Accounts/'):
+            return 'twilio'
+        return None
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.injected_errors.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'injected_errors': dict(self.injected_errors)}
+
+    def respond(self, service, path, body):
+        with self._lock:
+            self.calls[service] += 1
+            delay = self.latency_ms.get(service, 0) * (1 + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.error_rates.get(service, 0.0)
+            if fail:
+                self.injected_errors[service] += 1
+        time.sleep(max(0.0, delay) / 1000)
+        if fail:
+            return 500, {'error': {'message': 'injected error', 'type': 'server_error'}}
+
+        if service == 'openai':
+            return 200, {
+                'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': int(time.time()),
+                'model': 'bench', 'choices': [{'index': 0, 'finish_reason': 'stop',
+                                               'message': {'role': 'assistant', 'content': STUB_ANSWER}}],
+                'usage': {'prompt_tokens': 200, 'completion_tokens': 40, 'total_tokens': 240}
+            }
+        if service == 'anthropic':
+            return 200, {
+                'id': 'msg_bench', 'type': 'message', 'role': 'assistant', 'model': 'bench',
+                'content': [{'type': 'text', 'text': STUB_ANSWER}], 'stop_reason': 'end_turn',
+                'stop_sequence': None, 'usage': {'input_tokens': 200, 'output_tokens': 40}
+            }
+        if service == 'ollama':
+            return 200, {'model': 'bench', 'response': STUB_ANSWER, 'done': True, 'prompt_eval_count': 200}
+        if service == 'huggingface':
+            return 200, [{'generated_text': f"Assistant: {STUB_ANSWER}"}]
+        # Twilio Messages API
+        return 201, {'sid': 'SMbench', 'status': 'queued', 'body': body[:100].decode(errors='replace')}
+
+def parse_overrides(values, cast):
+    """NAME=VALUE options into a dict"""
+    overrides = {}
+    for value in values or []:
+        name, _, raw = value.partition('=')
+        if name not in SERVICES:
+            raise SystemExit(f"Unknown service '{name}', expected one of {', '.join(SERVICES)}")
+        overrides[name] = cast(raw)
+    return overrides
+
+def app_environment(args, stub_url):
+    """Environment for the app under test: every external service points at the stub server"""
+    env = {key: value for key, value in os.environ.items() if key not in CREDENTIAL_VARS}
+    providers = [name for name in args.providers.split(',') if name]
+    env.update({
+        'USE_LLM': 'true' if providers else 'false',
+        'USE_OLLAMA': 'true' if 'ollama' in providers else 'false',
+        'TWILIO_ACCOUNT_SID': 'ACbenchmark',
+        'TWILIO_AUTH_TOKEN': 'benchmark',
+        'TWILIO_PHONE_NUMBER': 'whatsapp:+10000000000',
+        # Warm-up runs after the providers are pointed at the stubs
+        'LLM_WARMUP': 'false',
+        'MODEL_WATCH': 'false',
+        'PYTHONUNBUFFERED': '1'
+    })
+    if 'openai' in providers:
+        env.update({'OPENAI_API_KEY': 'benchmark', 'OPENAI_BASE_URL': f"{stub_url}/v1"})
+    if 'anthropic' in providers:
+        env.update({'ANTHROPIC_API_KEY': 'benchmark', 'ANTHROPIC_BASE_URL': stub_url})
+    if 'huggingface' in providers:
+        env['HUGGINGFACE_API_KEY'] = 'benchmark'
+    for value in args.env or []:
+        key, _, raw = value.partition('=')
+        env[key] = raw
+    return env
+
+def serve_app(stub_url, port):
+    """Child process: import the app, point Twilio/Ollama/HuggingFace at the stubs and serve it"""
+    sys.path.insert(0, BACKEND_DIR)
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client
+    from werkzeug.serving import make_server
+
+    import whatsapp_bot
+    from llm_integration import HuggingFaceProvider, OllamaProvider
+
+    class StubTwilioHttpClient(TwilioHttpClient):
+        def request(self, method, url, *args, **kwargs):
+            return super().request(method, url.replace(TWILIO_API, stub_url, 1), *args, **kwargs)
+
+    # The app creates its Twilio client lazily per process; hand it one that talks to the stub
+    whatsapp_bot._twilio_client = Client(whatsapp_bot.TWILIO_ACCOUNT_SID, whatsapp_bot.TWILIO_AUTH_TOKEN,
+                                         http_client=StubTwilioHttpClient())
+    whatsapp_bot._twilio_client_pid = os.getpid()
+
+    for provider in whatsapp_bot.chatbot.llm_manager.providers:
+        if isinstance(provider, OllamaProvider):
+            provider.base_url = stub_url
+        elif isinstance(provider, HuggingFaceProvider):
+            provider.api_url = f"{stub_url}/models/{provider.model}"
+    if whatsapp_bot.chatbot.use_llm:
+        whatsapp_bot.chatbot.llm_manager.warm_up()
+
+    server = make_server('127.0.0.1', port, whatsapp_bot.app, threaded=True)
+    print(f"LISTENING {server.server_port}", flush=True)
+    server.serve_forever()
+
+def start_app(args, stub_url, log_file):
+    """Start the app in a child process and wait until /health answers"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve-app', '--stub-url', stub_url],
+        cwd=args.model_dir, env=app_environment(args, stub_url),
+        stdout=subprocess.PIPE, stderr=log_file, text=True
+    )
+    # Skip anything the app prints while importing
+    line = process.stdout.readline()
+    while line and not line.startswith('LISTENING'):
+        line = process.stdout.readline()
+    if not line:
+        process.kill()
+        raise SystemExit(f"App failed to start, see {log_file.name}")
+    app_url = f"http://127.0.0.1:{int(line.split()[1])}"
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{app_url}/health", timeout=2).status_code == 200:
+                return process, app_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise SystemExit(f"App did not become healthy, see {log_file.name}")
+
+def make_request_factory(endpoint, app_url, senders, repeat_ratio, seed):
+    """Returns a function building (url, request kwargs) for the next request"""
+    rng = random.Random(seed)
+    counter = iter(range(10 ** 12))
+    lock = threading.Lock()
+
+    def message():
+        with lock:
+            base = rng.choice(SAMPLE_MESSAGES)
+            # Repeated messages can be answered from the caches; the rest are unique
+            if rng.random() < repeat_ratio:
+                return base, rng.randrange(senders)
+            return f"{base} case {next(counter)}", rng.randrange(senders)
+
+    if endpoint == 'webhook':
+        def build():
+            body, sender = message()
+            return f"{app_url}/webhook", {'data': {'Body': body, 'From': f"whatsapp:+1555{sender:07d}"}}
+    else:
+        def build():
+            body, _ = message()
+            return f"{app_url}/test", {'json': {'message': body}}
+    return build
+
+def run_load(build_request, concurrency, duration, warmup):
+    """Keep `concurrency` requests in flight; return (latencies, status counts, measured seconds)"""
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        local_latencies = []
+        local_statuses = Counter()
+        while True:
+            url, kwargs = build_request()
+            begin = time.perf_counter()
+            if begin >= stop_at:
+                break
+            try:
+                status = session.post(url, timeout=120, **kwargs).status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            end = time.perf_counter()
+            if begin >= measure_from:
+                local_latencies.append(end - begin)
+                local_statuses[status] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    threads = [threading.Thread(target=worker, name=f"load-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # In-flight requests at the deadline still finish, so measure to the last completion
+    return latencies, statuses, max(duration, time.perf_counter() - measure_from)
+
+def summarize(latencies, statuses, seconds):
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    errors = sum(count for status, count in statuses.items() if not (isinstance(status, int) and status < 400))
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'rps': round(len(latencies) / seconds, 2),
+        'latency_ms': {
+            'mean': round(float(ms.mean()), 3),
+            'p50': round(float(np.percentile(ms, 50)), 3),
+            'p95': round(float(np.percentile(ms, 95)), 3),
+            'p99': round(float(np.percentile(ms, 99)), 3),
+            'max': round(float(ms.max()), 3)
+        }
+    }
+
+def git_revision():
+    """Commit the benchmark ran against, with a marker for uncommitted changes"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BACKEND_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, max_regression):
+    """Print changes against a baseline run; returns False if a regression exceeds max_regression percent"""
+    ok = True
+    print(f"\nCompared with {baseline.get('revision')} ({baseline.get('timestamp')})")
+    print("endpoint   metric     baseline      current   change")
+    for endpoint, current in results['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(endpoint)
+        if before is None:
+            continue
+        rows = [('rps', before['rps'], current['rps'], -1)]
+        rows += [(q, before['latency_ms'][q], current['latency_ms'][q], 1) for q in ('p50', 'p95', 'p99')]
+        for metric, old, new, direction in rows:
+            change = (new - old) / old * 100 if old else 0.0
+            regressed = max_regression is not None and metric in ('rps', 'p95') and change * direction > max_regression
+            ok = ok and not regressed
+            print(f"{endpoint:<10} {metric:<7} {old:>11.2f} {new:>12.2f} {change:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--endpoints', default='webhook,test', help='comma-separated: webhook, test')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per endpoint')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before each endpoint')
+    parser.add_argument('--providers', default='openai',
+                        help=f"comma-separated stubbed LLM providers ({', '.join(LLM_SERVICES)}); empty for none")
+    parser.add_argument('--latency-ms', action='append', metavar='SERVICE=MS',
+                        help=f"stub latency per service (defaults: {DEFAULT_LATENCY_MS})")
+    parser.add_argument('--error-rate', action='append', metavar='SERVICE=RATE',
+                        help='fraction of stub calls answered with HTTP 500')
+    parser.add_argument('--jitter', type=float, default=0.2, help='stub latency varies by +/- this fraction')
+    parser.add_argument('--repeat-ratio', type=float, default=0.5,
+                        help='fraction of messages repeated from a small set (cacheable)')
+    parser.add_argument('--senders', type=int, default=200, help='distinct WhatsApp numbers for /webhook')
+    parser.add_argument('--env', action='append', metavar='KEY=VALUE',
+                        help='extra environment for the app, e.g. TIERED_ROUTING=true')
+    parser.add_argument('--model-dir', default=BACKEND_DIR, help='directory with the model files')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark_results.json', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='earlier results JSON to compare against')
+    parser.add_argument('--max-regression', type=float,
+                        help='exit 1 if RPS drops or p95 grows by more than this percent vs the baseline')
+    parser.add_argument('--serve-app', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--stub-url', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_app:
+        serve_app(args.stub_url, args.port)
+        return
+
+    latency_ms = dict(DEFAULT_LATENCY_MS, **parse_overrides(args.latency_ms, float))
+    error_rates = parse_overrides(args.error_rate, float)
+    stub = StubServer(latency_ms, error_rates, jitter=args.jitter, seed=args.seed).start()
+
+    log_file = tempfile.NamedTemporaryFile('w', prefix='benchmark_app_', suffix='.log', delete=False)
+    process, app_url = start_app(args, stub.url, log_file)
+    print(f"🚀 App under test at {app_url} (log: {log_file.name}), stubs at {stub.url}")
+
+    results = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {
+            'concurrency': args.concurrency, 'duration': args.duration, 'warmup': args.warmup,
+            'providers': args.providers, 'latency_ms': latency_ms, 'error_rates': error_rates,
+            'jitter': args.jitter, 'repeat_ratio': args.repeat_ratio, 'senders': args.senders,
+            'env': args.env or []
+        },
+        'endpoints': {}
+    }
+    try:
+        for i, endpoint in enumerate(name for name in args.endpoints.split(',') if name):
+            if endpoint not in ('webhook', 'test'):
+                raise SystemExit(f"Unknown endpoint '{endpoint}'")
+            print(f"⏱️  /{endpoint}: {args.concurrency} concurrent for {args.duration:g}s")
+            stub.reset()
+            build = make_request_factory(endpoint, app_url, args.senders, args.repeat_ratio, args.seed + i)
+            latencies, statuses, seconds = run_load(build, args.concurrency, args.duration, args.warmup)
+            summary = summarize(latencies, statuses, seconds)
+            # Includes the warm-up period
+            summary['stub'] = stub.snapshot()
+            results['endpoints'][endpoint] = summary
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        stub.stop()
+
+    print("\nendpoint   requests  errors      rps   p50 ms   p95 ms   p99 ms")
+    for endpoint, row in results['endpoints'].items():
+        latency = row['latency_ms']
+        print(f"{endpoint:<10} {row['requests']:>8} {row['errors']:>7} {row['rps']:>8.1f} "
+              f"{latency['p50']:>8.2f} {latency['p95']:>8.2f} {latency['p99']:>8.2f}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
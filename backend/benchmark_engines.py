@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Benchmark the RandomForest engine against the nearest-neighbour retrieval engine
+Reports artifact size, memory, load time and single-query latency percentiles
+on synthetic corpora of increasing size
+"""
+
+import argparse
+import gc
+import json
+import os
+import pickle
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from retrieval import RetrievalIndex
+
+SYMPTOM_WORDS = [
+    "fever", "headache", "cough", "nausea", "vomiting", "rash", "itching", "pain",
+    "stomach", "back", "chest", "throat", "dizziness", "fatigue", "swelling", "tooth",
+    "breath", "stiffness", "joint", "knee", "burning", "urine", "bleeding", "cold",
+    "chills", "sweating", "diarrhea", "constipation", "anxiety", "insomnia", "weakness"
+]
+
+def make_corpus(n_records, n_answers, vocab_size=3000, seed=42):
+    """Synthetic symptom descriptions with a Zipf-like word distribution"""
+    rng = np.random.default_rng(seed)
+    vocab = SYMPTOM_WORDS + [f"term{i}" for i in range(vocab_size - len(SYMPTOM_WORDS))]
+    weights = 1.0 / np.arange(1, len(vocab) + 1)
+    weights /= weights.sum()
+
+    lengths = rng.integers(3, 9, size=n_records)
+    words = rng.choice(len(vocab), size=int(lengths.sum()), p=weights)
+    symptoms = []
+    offset = 0
+    for length in lengths:
+        symptoms.append(' '.join(vocab[w] for w in words[offset:offset + length]))
+        offset += length
+
+    answer_ids = rng.integers(0, n_answers, size=n_records)
+    advice = [f"Advice {i}: rest, stay hydrated and consult a doctor if symptoms persist." for i in answer_ids]
+    return symptoms, advice
+
+def rss_bytes():
+    """Resident set size of this process (Linux), or None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def measure(engine, X_queries, n_queries):
+    """Artifact size, memory after load, load time and single-query latency"""
+    blob = pickle.dumps(engine, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # sklearn trees allocate outside the Python allocator, so prefer the RSS delta
+    gc.collect()
+    rss_before = rss_bytes()
+    tracemalloc.start()
+    start = time.perf_counter()
+    loaded = pickle.loads(blob)
+    load_seconds = time.perf_counter() - start
+    memory_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    if rss_before is not None:
+        memory_bytes = max(memory_bytes, rss_bytes() - rss_before)
+
+    latencies = []
+    for i in range(n_queries):
+        query = X_queries[i % X_queries.shape[0]]
+        start = time.perf_counter()
+        loaded.predict(query)
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'artifact_bytes': len(blob),
+        'memory_bytes': memory_bytes,
+        'load_seconds': round(load_seconds, 4),
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+        'latency_ms_p99': round(float(np.percentile(latencies, 99)), 3)
+    }
+
+def run(sizes, n_answers, n_queries, forest_max_records, forest_estimators):
+    results = []
+    for size in sizes:
+        print(f"\n📊 {size:,} records")
+        symptoms, advice = make_corpus(size, min(n_answers, size))
+        vectorizer = TfidfVectorizer(max_features=5000, stop_words='english', ngram_range=(1, 2), min_df=1, max_df=0.95)
+        X = vectorizer.fit_transform(symptoms)
+        query_symptoms, _ = make_corpus(min(n_queries, 1000), 1, seed=7)
+        X_queries = vectorizer.transform(query_symptoms)
+
+        start = time.perf_counter()
+        index = RetrievalIndex().fit(X, advice)
+        row = {'records': size, 'engine': 'retrieval', 'build_seconds': round(time.perf_counter() - start, 3)}
+        row.update(measure(index, X_queries, n_queries))
+        results.append(row)
+        print(f"   retrieval: {row}")
+
+        if size > forest_max_records:
+            print(f"   forest: skipped (more than {forest_max_records:,} records)")
+            continue
+
+        start = time.perf_counter()
+        forest = RandomForestClassifier(n_estimators=forest_estimators, random_state=42, max_depth=10, n_jobs=-1)
+        forest.fit(X, advice)
+        forest.set_params(n_jobs=None)
+        row = {'records': size, 'engine': 'forest', 'build_seconds': round(time.perf_counter() - start, 3)}
+        row.update(measure(forest, X_queries, n_queries))
+        results.append(row)
+        print(f"   forest:    {row}")
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma-separated corpus sizes')
+    parser.add_argument('--answers', type=int, default=200,
+                        help='distinct advice texts (forest classes)')
+    parser.add_argument('--queries', type=int, default=1000,
+                        help='single-query predictions timed per engine')
+    parser.add_argument('--forest-max-records', type=int, default=100000,
+                        help='skip the forest above this size (training time and class arrays explode)')
+    parser.add_argument('--forest-estimators', type=int, default=100)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes, args.answers, args.queries, args.forest_max_records, args.forest_estimators)
+
+    print("\nrecords    engine     artifact MB  memory MB  load s   p50 ms   p99 ms")
+    for row in results:
+        print(f"{row['records']:<10} {row['engine']:<10} {row['artifact_bytes'] / 1e6:>11.2f} "
+              f"{row['memory_bytes'] / 1e6:>10.2f} {row['load_seconds']:>7.3f} "
+              f"{row['latency_ms_p50']:>8.3f} {row['latency_ms_p99']:>8.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
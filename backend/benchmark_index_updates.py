@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark and check incremental retrieval updates
+Trains retrieval artifacts on synthetic corpora of growing size, appends the
+same delta files to each with append_to_index and compares the result with a
+full retrain on the same rows and vocabulary. The appended index must return
+the same cosine scores, all within [0, 1], and the time of an append must not
+grow with the size of the base corpus
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from benchmark_engines import make_corpus
+from extract_model import DEFAULT_VECTORIZER_PARAMS
+from index_updates import append_to_index
+from model_artifacts import load_artifacts, save_artifacts
+from retrieval import RetrievalIndex
+from text_normalization import normalize_many
+
+TOLERANCE = 1e-4
+# Appends to the largest base may take at most this many times as long as to the smallest
+MAX_APPEND_GROWTH = 2.0
+
+def check_size(n_rows, symptoms, advice, texts, queries, args):
+    """Append the deltas to a base of n_rows rows and compare with a full retrain"""
+    delta_start = len(texts) - args.delta * args.appends
+    with tempfile.TemporaryDirectory(prefix='index_updates_') as base_dir:
+        vectorizer = TfidfVectorizer(**DEFAULT_VECTORIZER_PARAMS)
+        X = vectorizer.fit_transform(texts[:n_rows])
+        save_artifacts(vectorizer, retrieval_index=RetrievalIndex().fit(X, advice[:n_rows]), base_dir=base_dir)
+
+        append_seconds = []
+        for n in range(args.appends):
+            rows = slice(delta_start + n * args.delta, delta_start + (n + 1) * args.delta)
+            path = os.path.join(base_dir, f'delta{n}.csv')
+            pd.DataFrame({'symptoms': symptoms[rows], 'advice': advice[rows]}).to_csv(path, index=False)
+            start = time.perf_counter()
+            append_to_index(path, base_dir=base_dir)
+            append_seconds.append(time.perf_counter() - start)
+        model, served = load_artifacts('retrieval', base_dir=base_dir)
+        start = time.perf_counter()
+        appended_scores = model.kneighbors(served.transform(queries), 1)[1][:, 0]
+        query_seconds = time.perf_counter() - start
+
+    # Full retrain on the rows the appends indexed (rows without a vocabulary term are skipped there)
+    terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+    delta = texts[delta_start:]
+    kept = [text for text, nnz in zip(delta, np.diff(vectorizer.transform(delta).indptr)) if nnz]
+    start = time.perf_counter()
+    reference = TfidfVectorizer(vocabulary=terms, stop_words=vectorizer.stop_words,
+                                ngram_range=vectorizer.ngram_range)
+    X = reference.fit_transform(texts[:n_rows] + kept)
+    index = RetrievalIndex().fit(X, np.zeros(X.shape[0], dtype=np.int64))
+    retrain_seconds = time.perf_counter() - start
+    retrained_scores = index.kneighbors(reference.transform(queries), 1)[1][:, 0]
+
+    result = {
+        'base_rows': n_rows,
+        # Best of the appends, so a noisy neighbour does not decide the comparison
+        'append_seconds': round(min(append_seconds), 3),
+        'retrain_seconds': round(retrain_seconds, 2),
+        'query_ms': round(query_seconds / len(queries) * 1000, 3),
+        'max_score': float(appended_scores.max()),
+        'max_score_difference': float(np.abs(appended_scores - retrained_scores).max()),
+        'max_idf_difference': float(np.abs(served.idf_ - reference.idf_).max())
+    }
+    print(f"   {n_rows:>10,} {result['append_seconds']:>9.3f}s {result['retrain_seconds']:>9.2f}s "
+          f"{result['query_ms']:>9.3f} {result['max_score']:>10.6f} {result['max_score_difference']:>11.2e}")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='50000,200000', help='comma-separated base corpus sizes')
+    parser.add_argument('--delta', type=int, default=10000, help='rows per appended delta file')
+    parser.add_argument('--appends', type=int, default=2)
+    parser.add_argument('--answers', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    symptoms, advice = make_corpus(sizes[-1] + args.delta * args.appends, args.answers)
+    texts = normalize_many(symptoms)
+    queries = normalize_many(make_corpus(args.queries, 1, seed=7)[0])
+
+    print(f"📊 Appending {args.appends} x {args.delta:,} rows to bases of {', '.join(f'{n:,}' for n in sizes)} rows")
+    print(f"   {'base rows':>10} {'append':>10} {'retrain':>10} {'query ms':>9} {'max score':>10} {'vs retrain':>11}")
+    results = [check_size(n_rows, symptoms, advice, texts, queries, args) for n_rows in sizes]
+
+    if any(r['max_score'] > 1 + TOLERANCE or r['max_score_difference'] > TOLERANCE
+           or r['max_idf_difference'] > TOLERANCE for r in results):
+        raise SystemExit("❌ Appended index does not match a full retrain on the same rows")
+    growth = results[-1]['append_seconds'] / results[0]['append_seconds']
+    print(f"\n   append time grew {growth:.2f}x for a {sizes[-1] / sizes[0]:.0f}x larger base")
+    if growth > MAX_APPEND_GROWTH:
+        raise SystemExit("❌ Append time grows with the size of the base corpus")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'delta': args.delta, 'appends': args.appends, 'results': results}, f, indent=2)
+        print(f"\n💾 Results saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
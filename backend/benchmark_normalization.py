@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark text normalization on a large synthetic corpus
+Compares the shared normalizer (per message and in bulk) with the two
+implementations it replaced: the bot's regex and the trainer's row-by-row
+DataFrame.apply. Also counts the messages on which those two disagreed
+"""
+
+import argparse
+import json
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmark_engines import make_corpus
+from text_normalization import normalize_many, normalize_text
+
+# Punctuation, casing and non-ASCII text as users type it
+DECORATIONS = ['', '?', '!!', ', since yesterday.', ' (3 days)', " - it's getting worse", ' Ça fait mal', ' 😷']
+
+def make_messages(n_rows, seed=42):
+    symptoms, _ = make_corpus(n_rows, 1, seed=seed)
+    rng = np.random.default_rng(seed)
+    decorations = rng.integers(0, len(DECORATIONS), size=n_rows)
+    capitalize = rng.random(n_rows) < 0.3
+    return [(text.capitalize() if upper else text) + DECORATIONS[i]
+            for text, i, upper in zip(symptoms, decorations, capitalize)]
+
+def legacy_serving(text):
+    """MedicalChatbot.preprocess_text before the shared module"""
+    text = re.sub(r'[^a-zA-Z0-9\s]', '', text.lower())
+    return ' '.join(text.split())
+
+def legacy_training(text):
+    """extract_model.preprocess_text before the shared module"""
+    if pd.isna(text):
+        return ""
+    text = str(text).lower()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+def timed(name, fn, n_rows, repeat):
+    # Best of several runs, so a noisy neighbour does not decide the comparison
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn()
+        seconds = min(seconds, time.perf_counter() - start)
+    row = {'implementation': name, 'seconds': round(seconds, 3), 'rows_per_second': round(n_rows / seconds)}
+    print(f"   {name:<28} {seconds:>7.2f}s {row['rows_per_second']:>12,} rows/s")
+    return row, output
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per implementation; the fastest counts')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    print(f"📊 Normalizing {args.rows:,} messages")
+    messages = make_messages(args.rows)
+    series = pd.Series(messages)
+
+    implementations = [
+        ('legacy serving (regex)', lambda: [legacy_serving(text) for text in messages]),
+        ('legacy training (apply)', lambda: list(series.apply(legacy_training))),
+        ('normalize_text', lambda: [normalize_text(text) for text in messages]),
+        ('normalize_many (list)', lambda: normalize_many(messages)),
+        ('normalize_many (Series)', lambda: list(normalize_many(series)))
+    ]
+    results, outputs = [], {}
+    for name, fn in implementations:
+        row, outputs[name] = timed(name, fn, args.rows, args.repeat)
+        results.append(row)
+    serving, training = outputs['legacy serving (regex)'], outputs['legacy training (apply)']
+    single = outputs['normalize_text']
+
+    # The shared normalizer keeps the training behaviour, which the vectorizer was fitted on
+    mismatches = sum(a != b for a, b in zip(single, training))
+    skew = sum(a != b for a, b in zip(serving, training))
+    print(f"\n   normalize_text differs from training on {mismatches:,} messages")
+    print(f"   legacy serving differed from training on {skew:,} messages ({skew / args.rows:.1%})")
+    if mismatches or any(outputs[name] != single for name in ('normalize_many (list)', 'normalize_many (Series)')):
+        raise SystemExit("❌ Shared normalizer does not match the training normalization")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'rows': args.rows, 'legacy_skew_rows': skew, 'results': results}, f, indent=2)
+        print(f"\n💾 Results saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
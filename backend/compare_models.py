@@ -18,6 +18,7 @@ def compare_responses():
     
     # Initialize both systems
     chatbot = MedicalChatbot()
+    chatbot.response_cache = None  # Compare fresh answers, not cached ones
     llm_manager = LLMManager()
     
     # Test queries
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Per-sender conversation state for the WhatsApp Medical Chatbot
+Keeps a short ring buffer of recent turns for each sender (the Twilio From
+number) with TTL expiry and a cap on the number of conversations, in process
+or in a SQLite database shared between workers
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+from prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+def history_window(turns, token_budget: int) -> List[Dict[str, str]]:
+    """Most recent whole exchanges that fit in token_budget, oldest first"""
+    window = []
+    used = 0
+    # Walk back one (user, assistant) exchange at a time so the window never starts mid-exchange
+    turns = list(turns)
+    for end in range(len(turns), 1, -2):
+        user, assistant = turns[end - 2], turns[end - 1]
+        cost = user['tokens'] + assistant['tokens']
+        if used + cost > token_budget:
+            break
+        used += cost
+        window[:0] = [{'role': user['role'], 'content': user['content']},
+                      {'role': assistant['role'], 'content': assistant['content']}]
+    return window
+
+class ConversationStore:
+    """Base class: ring buffer of recent turns per sender with TTL and a global cap"""
+
+    backend_name = 'none'
+
+    def __init__(self, max_turns: int = 10, ttl: float = 1800, max_conversations: int = 10000,
+                 max_turn_chars: int = 2000):
+        # Turns are stored in (user, assistant) pairs, so keep an even number
+        self.max_turns = max(2, max_turns - max_turns % 2)
+        self.ttl = ttl
+        self.max_conversations = max(1, max_conversations)
+        self.max_turn_chars = max_turn_chars
+        self._stats_lock = threading.Lock()
+        self.stats = {'exchanges': 0, 'expired': 0, 'evicted': 0}
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _expired(self, updated_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - updated_at > self.ttl
+
+    def _turn(self, role: str, content: str) -> Dict[str, Any]:
+        # Token counts are computed once here, never per request
+        content = content[:self.max_turn_chars]
+        return {'role': role, 'content': content, 'tokens': estimate_tokens(content)}
+
+    def get_history(self, sender: str, token_budget: int) -> List[Dict[str, str]]:
+        """Recent messages for a sender as [{'role', 'content'}], trimmed to token_budget"""
+        raise NotImplementedError
+
+    def add_exchange(self, sender: str, user_message: str, response: str):
+        """Append a user message and the bot's answer to the sender's conversation"""
+        raise NotImplementedError
+
+    def clear(self, sender: str):
+        """Forget one sender's conversation"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and configuration for the health endpoint"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats.update({
+            'backend': self.backend_name,
+            'conversations': len(self),
+            'max_conversations': self.max_conversations,
+            'max_turns': self.max_turns,
+            'ttl': self.ttl
+        })
+        return stats
+
+class MemoryConversationStore(ConversationStore):
+    """In-process store (one per worker process); least recently active conversations are evicted first"""
+
+    backend_name = 'memory'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # sender -> (deque of turns, updated_at), in least-recently-active order
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_history(self, sender: str, token_budget: int) -> List[Dict[str, str]]:
+        now = time.time()
+        with self._lock:
+            entry = self._conversations.get(sender)
+            if entry is None:
+                return []
+            if self._expired(entry[1], now):
+                del self._conversations[sender]
+                self._count('expired')
+                return []
+            turns = list(entry[0])
+        return history_window(turns, token_budget)
+
+    def add_exchange(self, sender: str, user_message: str, response: str):
+        now = time.time()
+        with self._lock:
+            entry = self._conversations.get(sender)
+            if entry is None or self._expired(entry[1], now):
+                turns = deque(maxlen=self.max_turns)
+            else:
+                turns = entry[0]
+            turns.append(self._turn('user', user_message))
+            turns.append(self._turn('assistant', response))
+            self._conversations[sender] = (turns, now)
+            self._conversations.move_to_end(sender)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+                self._count('evicted')
+        self._count('exchanges')
+
+    def clear(self, sender: str):
+        with self._lock:
+            self._conversations.pop(sender, None)
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+class SQLiteConversationStore(ConversationStore):
+    """On-disk store shared by every worker process on the host (one row per sender)"""
+
+    backend_name = 'sqlite'
+
+    # Expired and excess conversations are pruned every this many writes
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str = 'conversations.db', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._connection().execute(
+            """CREATE TABLE IF NOT EXISTS conversations (
+                sender TEXT PRIMARY KEY,
+                turns TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated_at)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread, reopened after fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get_history(self, sender: str, token_budget: int) -> List[Dict[str, str]]:
+        try:
+            row = self._connection().execute(
+                "SELECT turns, updated_at FROM conversations WHERE sender = ?", (sender,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Conversation store read error: {e}")
+            return []
+        if row is None or self._expired(row[1], time.time()):
+            return []
+        return history_window(json.loads(row[0]), token_budget)
+
+    def add_exchange(self, sender: str, user_message: str, response: str):
+        now = time.time()
+        try:
+            conn = self._connection()
+            # Read-modify-write under a write lock so concurrent workers do not drop turns
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT turns, updated_at FROM conversations WHERE sender = ?", (sender,)
+                ).fetchone()
+                turns = [] if row is None or self._expired(row[1], now) else json.loads(row[0])
+                turns.append(self._turn('user', user_message))
+                turns.append(self._turn('assistant', response))
+                conn.execute(
+                    "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                    (sender, json.dumps(turns[-self.max_turns:]), now)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.error(f"Conversation store write error: {e}")
+            return
+
+        self._count('exchanges')
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune(now)
+
+    def _prune(self, now: float):
+        try:
+            conn = self._connection()
+            if self.ttl > 0:
+                expired = conn.execute(
+                    "DELETE FROM conversations WHERE updated_at < ?", (now - self.ttl,)
+                ).rowcount
+                self._count('expired', expired)
+            evicted = conn.execute(
+                """DELETE FROM conversations WHERE sender IN (
+                    SELECT sender FROM conversations ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_conversations,)
+            ).rowcount
+            self._count('evicted', evicted)
+        except sqlite3.Error as e:
+            logger.error(f"Conversation store prune error: {e}")
+
+    def clear(self, sender: str):
+        try:
+            self._connection().execute("DELETE FROM conversations WHERE sender = ?", (sender,))
+        except sqlite3.Error as e:
+            logger.error(f"Conversation store clear error: {e}")
+
+    def __len__(self) -> int:
+        try:
+            return self._connection().execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+def create_conversation_store() -> Optional[ConversationStore]:
+    """Build the conversation store selected by CONVERSATION_STORE (memory, sqlite or none)"""
+    backend = os.getenv('CONVERSATION_STORE', 'none').lower()
+    options = {
+        'max_turns': int(os.getenv('CONVERSATION_MAX_TURNS', '10')),
+        'ttl': float(os.getenv('CONVERSATION_TTL', '1800')),
+        'max_conversations': int(os.getenv('CONVERSATION_MAX_SENDERS', '10000')),
+        'max_turn_chars': int(os.getenv('CONVERSATION_MAX_TURN_CHARS', '2000'))
+    }
+
+    if backend == 'memory':
+        return MemoryConversationStore(**options)
+    if backend == 'sqlite':
+        path = os.getenv('CONVERSATION_DB_PATH', 'conversations.db')
+        return SQLiteConversationStore(path, **options)
+    if backend != 'none':
+        logger.warning(f"Unknown CONVERSATION_STORE backend '{backend}', conversations disabled")
+    return None
@@ -11,12 +11,33 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report
-import re
+import argparse
 import logging
+from retrieval import RetrievalIndex
+from model_artifacts import save_artifacts, load_artifacts
+from streaming_training import train_streaming
+from index_updates import append_to_index
+from text_normalization import normalize_many, normalize_text
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Defaults for train_and_save_model; hyperparameter_sweep.py searches around them
+DEFAULT_VECTORIZER_PARAMS = {
+    'max_features': 5000,
+    'stop_words': 'english',
+    'ngram_range': (1, 2),
+    'min_df': 1,
+    'max_df': 0.95
+}
+DEFAULT_FOREST_PARAMS = {
+    'n_estimators': 100,
+    'random_state': 42,
+    'max_depth': 10,
+    'min_samples_split': 2,
+    'min_samples_leaf': 1
+}
+
 def load_notebook_data():
     """Load data from the notebook - you'll need to adapt this based on your data source"""
     # This is a placeholder - you'll need to replace this with your actual data loading logic
@@ -48,72 +69,59 @@ def load_notebook_data():
     
     return pd.DataFrame(sample_data)
 
-def preprocess_text(text):
-    """Clean and preprocess text data"""
-    if pd.isna(text):
-        return ""
-    
-    # Convert to lowercase
-    text = str(text).lower()
-    
-    # Remove special characters but keep medical terms
-    text = re.sub(r'[^\w\s]', ' ', text)
-    
-    # Remove extra whitespace
-    text = ' '.join(text.split())
-    
-    return text
-
-def train_and_save_model():
+def train_and_save_model(vectorizer_params=None, forest_params=None, df=None):
     """Train the model and save it for the chatbot"""
     try:
+        vectorizer_params = dict(DEFAULT_VECTORIZER_PARAMS, **(vectorizer_params or {}))
+        forest_params = dict(DEFAULT_FOREST_PARAMS, **(forest_params or {}))
+        
         # Load data
-        df = load_notebook_data()
+        if df is None:
+            df = load_notebook_data()
         logger.info(f"Loaded {len(df)} medical records")
         
         # Preprocess the data
-        df['symptoms_clean'] = df['symptoms'].apply(preprocess_text)
-        df['advice_clean'] = df['advice'].apply(preprocess_text)
+        df['symptoms_clean'] = normalize_many(df['symptoms'])
+        df['advice_clean'] = normalize_many(df['advice'])
         
         # Prepare features and labels
         X = df['symptoms_clean'].values
         y = df['advice'].values  # Keep original advice for responses
+        # The forest predicts an answer id; each distinct advice text is stored once, outside the model
+        answers, y_ids = np.unique(y.astype(str).astype(object), return_inverse=True)
         
         # Split the data
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=0.2, random_state=42
+        X_train, X_test, y_train, y_test, ids_train, ids_test = train_test_split(
+            X, y, y_ids, test_size=0.2, random_state=42
         )
         
         # Create and train the vectorizer
         logger.info("Training TF-IDF vectorizer...")
-        vectorizer = TfidfVectorizer(
-            max_features=5000,
-            stop_words='english',
-            ngram_range=(1, 2),
-            min_df=1,
-            max_df=0.95
-        )
+        vectorizer = TfidfVectorizer(**vectorizer_params)
         
         X_train_vectorized = vectorizer.fit_transform(X_train)
         X_test_vectorized = vectorizer.transform(X_test)
         
         # Train the model
         logger.info("Training RandomForest model...")
-        model = RandomForestClassifier(
-            n_estimators=100,
-            random_state=42,
-            max_depth=10,
-            min_samples_split=2,
-            min_samples_leaf=1
-        )
+        model = RandomForestClassifier(**forest_params)
         
-        model.fit(X_train_vectorized, y_train)
+        model.fit(X_train_vectorized, ids_train)
         
         # Evaluate the model
         y_pred = model.predict(X_test_vectorized)
-        accuracy = accuracy_score(y_test, y_pred)
+        accuracy = accuracy_score(ids_test, y_pred)
         logger.info(f"Model accuracy: {accuracy:.4f}")
         
+        # Build the nearest-neighbour retrieval engine over the same features
+        logger.info("Building retrieval index...")
+        retrieval_accuracy = accuracy_score(
+            y_test, RetrievalIndex().fit(X_train_vectorized, y_train).predict(X_test_vectorized)
+        )
+        logger.info(f"Retrieval accuracy: {retrieval_accuracy:.4f}")
+        # Serving index covers every record; held-out rows only cost one more posting each
+        retrieval_index = RetrievalIndex().fit(vectorizer.transform(X), y)
+        
         # Save the model and vectorizer
         logger.info("Saving model and vectorizer...")
         
@@ -123,16 +131,26 @@ def train_and_save_model():
         with open('vectorizer.pkl', 'wb') as f:
             pickle.dump(vectorizer, f)
         
+        with open('retrieval_index.pkl', 'wb') as f:
+            pickle.dump(retrieval_index, f)
+        
+        with open('answers.pkl', 'wb') as f:
+            pickle.dump(list(answers), f)
+        
         # Save model metadata
         metadata = {
             'accuracy': accuracy,
+            'retrieval_accuracy': retrieval_accuracy,
             'n_features': X_train_vectorized.shape[1],
             'n_samples': len(X_train),
-            'model_type': 'RandomForestClassifier'
+            'n_answers': len(answers),
+            'model_type': 'RandomForestClassifier',
+            'hyperparameters': {'vectorizer': vectorizer_params, 'forest': forest_params}
         }
         
-        with open('model_metadata.json', 'w') as f:
-            json.dump(metadata, f, indent=2)
+        # Flat memory-mapped artifacts; their manifest is added to model_metadata.json
+        save_artifacts(vectorizer, model=model, retrieval_index=retrieval_index, metadata=metadata,
+                       answers=list(answers))
         
         logger.info("Model and vectorizer saved successfully!")
         logger.info(f"Model metadata: {metadata}")
@@ -143,15 +161,11 @@ def train_and_save_model():
         logger.error(f"Error training model: {e}")
         return False
 
-def test_model():
-    """Test the saved model"""
+def test_model(engine='forest'):
+    """Test the saved artifacts of one engine (forest or retrieval) the way the bot loads them"""
     try:
-        # Load the saved model
-        with open('medical_model.pkl', 'rb') as f:
-            model = pickle.load(f)
-        
-        with open('vectorizer.pkl', 'rb') as f:
-            vectorizer = pickle.load(f)
+        # Map the saved artifacts, validating their checksums
+        model, vectorizer = load_artifacts(engine)
         
         # Test with sample inputs
         test_symptoms = [
@@ -162,9 +176,9 @@ def test_model():
         
         logger.info("Testing the model...")
         for symptom in test_symptoms:
-            processed = preprocess_text(symptom)
+            processed = normalize_text(symptom)
             vectorized = vectorizer.transform([processed])
-            prediction = model.predict(vectorized)[0]
+            prediction = model.predict_with_scores(vectorized)[0][0]
             
             logger.info(f"Input: {symptom}")
             logger.info(f"Prediction: {prediction[:100]}...")
@@ -176,15 +190,75 @@ def test_model():
         logger.error(f"Error testing model: {e}")
         return False
 
+def train_streaming_model(args):
+    """Out-of-core training of the retrieval engine from a large CSV/JSONL corpus"""
+    try:
+        metadata = train_streaming(
+            args.stream,
+            text_column=args.text_column,
+            answer_column=args.answer_column,
+            chunk_rows=args.chunk_rows,
+            max_features=args.max_features,
+            max_terms=args.max_terms
+        )
+        logger.info(f"Model metadata: {metadata['training']}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error training model: {e}")
+        return False
+
+def append_new_pairs(args):
+    """Add the pairs of a delta file to the retrieval artifacts without retraining"""
+    try:
+        update = append_to_index(
+            args.append,
+            text_column=args.text_column,
+            answer_column=args.answer_column,
+            chunk_rows=args.chunk_rows
+        )
+        logger.info(f"Update: {update}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error appending to the retrieval index: {e}")
+        return False
+
 if __name__ == "__main__":
-    logger.info("Starting model extraction and training...")
+    parser = argparse.ArgumentParser(description="Train the medical model and save it for the chatbot")
+    parser.add_argument('--stream', metavar='PATH',
+                        help='train the retrieval engine out of core from a .csv or .jsonl corpus')
+    parser.add_argument('--append', metavar='PATH',
+                        help='add the pairs of a .csv or .jsonl delta file to the retrieval artifacts')
+    parser.add_argument('--text-column', default='symptoms')
+    parser.add_argument('--answer-column', default='advice')
+    parser.add_argument('--chunk-rows', type=int, default=10000, help='rows read and transformed at a time')
+    parser.add_argument('--max-features', type=int, default=5000, help='TF-IDF vocabulary size')
+    parser.add_argument('--max-terms', type=int, default=1000000,
+                        help='n-grams counted at once during the vocabulary pass before rare ones are pruned')
+    args = parser.parse_args()
     
-    if train_and_save_model():
-        logger.info("Model training completed successfully!")
-        
-        if test_model():
-            logger.info("Model testing completed successfully!")
+    if args.append:
+        logger.info(f"Appending {args.append} to the retrieval index...")
+        if append_new_pairs(args) and test_model('retrieval'):
+            logger.info("Update published! Bots with MODEL_WATCH=true pick it up automatically")
         else:
-            logger.error("Model testing failed!")
+            logger.error("Update failed!")
+    elif args.stream:
+        logger.info(f"Starting streaming training from {args.stream}...")
+        if train_streaming_model(args) and test_model('retrieval'):
+            logger.info("Streaming training completed successfully! Serve it with MODEL_ENGINE=retrieval")
+        else:
+            logger.error("Streaming training failed!")
     else:
-        logger.error("Model training failed!")
\ No newline at end of file
+        logger.info("Starting model extraction and training...")
+        
+        if train_and_save_model():
+            logger.info("Model training completed successfully!")
+            
+            if test_model('forest') and test_model('retrieval'):
+                logger.info("Model testing completed successfully!")
+            else:
+                logger.error("Model testing failed!")
+        else:
+            logger.error("Model training failed!")
@@ -0,0 +1,44 @@
+"""
+Gunicorn configuration for the WhatsApp bot
+Preloads the app so the model is loaded once in the master and shared with the
+workers copy-on-write; SIGHUP reloads the model in the master and replaces the
+workers gracefully, so in-flight requests finish on the old ones. With
+MODEL_WATCH=true one elected worker watches the model files and sends that SIGHUP
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('PRELOAD_APP', 'true').lower() == 'true'
+
+if preload_app:
+    # Tells whatsapp_bot to leave per-process background work to post_fork
+    os.environ['GUNICORN_PRELOAD'] = 'true'
+
+def when_ready(server):
+    if preload_app:
+        # Move everything loaded so far out of the collector's reach, so garbage
+        # collection in the workers does not touch (and copy) the shared pages
+        gc.collect()
+        gc.freeze()
+        server.log.info(f"Preloaded app; froze {gc.get_freeze_count()} objects")
+
+def post_fork(server, worker):
+    if preload_app:
+        import whatsapp_bot
+        whatsapp_bot.start_background_tasks()
+
+def on_reload(server):
+    # Runs in the master on SIGHUP before the new workers are forked
+    if preload_app:
+        import whatsapp_bot
+        gc.unfreeze()
+        # New workers inherit the watcher's view of the files; a failed reload leaves the change pending
+        if whatsapp_bot.chatbot.reload_model() and whatsapp_bot.chatbot.model_watcher:
+            whatsapp_bot.chatbot.model_watcher.reset()
+        gc.collect()
+        gc.freeze()
+        server.log.info("Reloaded model artifacts in the master")
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Parallel hyperparameter sweep for the medical model
+Fits every combination of vectorizer and model settings across a process pool.
+Each vectorizer's feature matrices are computed once and cached on disk, and
+the most accurate candidate whose predict latency and artifact size fit the
+budget is selected
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+
+from extract_model import (
+    DEFAULT_FOREST_PARAMS, DEFAULT_VECTORIZER_PARAMS, load_notebook_data, train_and_save_model
+)
+from model_artifacts import load_artifacts, save_artifacts
+from retrieval import RetrievalIndex
+from streaming_training import iter_chunks
+from text_normalization import normalize_many
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# Every candidate writes and maps its own artifacts; those per-file logs would drown the sweep's
+logging.getLogger('model_artifacts').setLevel(logging.WARNING)
+
+# Bump when the cached files change, so old entries are not reused
+FEATURE_CACHE_VERSION = 1
+
+# The train/test split, set once per pool worker by _init_worker instead of being sent with every task
+_split: Optional[Dict[str, Any]] = None
+
+def _init_worker(split: Dict[str, Any]):
+    global _split
+    _split = split
+
+def load_corpus(path: Optional[str], text_column: str, answer_column: str) -> pd.DataFrame:
+    """Raw symptoms and advice from a .csv/.jsonl file, or the built-in sample data"""
+    if path is None:
+        return load_notebook_data()
+    symptoms, advice = [], []
+    # Raw texts: make_split normalizes them like train_and_save_model does
+    for texts, answers in iter_chunks(path, text_column, answer_column, 100000, normalize=list):
+        symptoms.extend(texts)
+        advice.extend(answers)
+    return pd.DataFrame({'symptoms': symptoms, 'advice': advice})
+
+def make_split(df: pd.DataFrame, test_size: float = 0.2, seed: int = 42) -> Dict[str, Any]:
+    """The same split train_and_save_model uses, plus a fingerprint of it for the feature cache"""
+    X = normalize_many(df['symptoms'].tolist())
+    y = list(df['advice'])
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=seed)
+    digest = hashlib.blake2b(f"{test_size}:{seed}".encode(), digest_size=16)
+    for text, answer in zip(X, y):
+        digest.update(f"{text}\0{answer}\n".encode('utf-8'))
+    return {
+        'X_train': X_train, 'X_test': X_test, 'y_train': y_train, 'y_test': y_test,
+        'fingerprint': digest.hexdigest()
+    }
+
+def feature_key(vectorizer_params: Dict[str, Any], fingerprint: str) -> str:
+    """Cache key for one vectorizer config on one data split"""
+    payload = json.dumps({'version': FEATURE_CACHE_VERSION, 'data': fingerprint, 'vectorizer': vectorizer_params},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def cache_features(cache_dir: str, key: str, vectorizer_params: Dict[str, Any]) -> Dict[str, Any]:
+    """Fit the vectorizer and store its train/test matrices, unless they are cached already"""
+    directory = os.path.join(cache_dir, 'features', key)
+    if os.path.exists(directory):
+        return {'key': key, 'cached': True, 'seconds': 0.0}
+
+    start = time.perf_counter()
+    vectorizer = TfidfVectorizer(**vectorizer_params)
+    X_train = vectorizer.fit_transform(_split['X_train'])
+    X_test = vectorizer.transform(_split['X_test'])
+    seconds = time.perf_counter() - start
+
+    # Written under a private name and renamed, so a reader never sees a partial entry
+    tmp = f"{directory}.tmp{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    sp.save_npz(os.path.join(tmp, 'X_train.npz'), X_train.tocsr(), compressed=False)
+    sp.save_npz(os.path.join(tmp, 'X_test.npz'), X_test.tocsr(), compressed=False)
+    with open(os.path.join(tmp, 'vectorizer.pkl'), 'wb') as f:
+        pickle.dump(vectorizer, f)
+    try:
+        os.rename(tmp, directory)
+    except OSError:
+        # Another sweep cached the same config first
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {'key': key, 'cached': False, 'seconds': round(seconds, 3)}
+
+def load_features(cache_dir: str, key: str) -> Tuple[sp.csr_matrix, sp.csr_matrix, TfidfVectorizer]:
+    directory = os.path.join(cache_dir, 'features', key)
+    with open(os.path.join(directory, 'vectorizer.pkl'), 'rb') as f:
+        vectorizer = pickle.load(f)
+    return (sp.load_npz(os.path.join(directory, 'X_train.npz')),
+            sp.load_npz(os.path.join(directory, 'X_test.npz')), vectorizer)
+
+def fit_candidate(cache_dir: str, candidate: Dict[str, Any]) -> Dict[str, Any]:
+    """Fit one candidate on cached features, score it and write its artifacts"""
+    X_train, X_test, vectorizer = load_features(cache_dir, candidate['feature_key'])
+    start = time.perf_counter()
+    if candidate['engine'] == 'forest':
+        # One core per candidate; the pool provides the parallelism
+        model = RandomForestClassifier(**dict(DEFAULT_FOREST_PARAMS, **candidate['model'], n_jobs=1))
+        model.fit(X_train, _split['y_train'])
+        engines = {'model': model}
+    else:
+        model = RetrievalIndex().fit(X_train, _split['y_train'])
+        engines = {'retrieval_index': model}
+    fit_seconds = time.perf_counter() - start
+    accuracy = accuracy_score(_split['y_test'], model.predict(X_test))
+
+    # Size what the bot would map: the flat artifacts, not a pickle
+    base_dir = os.path.join(cache_dir, 'candidates', candidate['id'])
+    manifest = save_artifacts(vectorizer, base_dir=base_dir, **engines)
+    return dict(candidate, **{
+        'accuracy': round(float(accuracy), 4),
+        'fit_seconds': round(fit_seconds, 3),
+        'n_features': manifest['n_features'],
+        'artifact_bytes': sum(entry['bytes'] for entry in manifest['files'].values())
+    })
+
+def measure_latency(base_dir: str, engine: str, queries: List[str], n_queries: int) -> Dict[str, float]:
+    """Single-message vectorize + predict latency on the mapped artifacts, as the bot serves them"""
+    model, vectorizer = load_artifacts(engine, base_dir=base_dir, verify=False)
+    model.predict(vectorizer.transform(queries[:1]))
+    latencies = []
+    for i in range(n_queries):
+        query = queries[i % len(queries)]
+        start = time.perf_counter()
+        model.predict(vectorizer.transform([query]))
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+        'latency_ms_p99': round(float(np.percentile(latencies, 99)), 3)
+    }
+
+def build_grid(vectorizer_grid: Dict[str, list], forest_grid: Dict[str, list],
+               engines: List[str], fingerprint: str) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """Vectorizer configs by cache key, and one candidate per engine/model config on each of them"""
+    vectorizers = {}
+    for values in itertools.product(*vectorizer_grid.values()):
+        params = dict(DEFAULT_VECTORIZER_PARAMS, **dict(zip(vectorizer_grid, values)))
+        vectorizers[feature_key(params, fingerprint)] = params
+
+    model_configs = []
+    if 'forest' in engines:
+        model_configs += [('forest', dict(zip(forest_grid, values))) for values in itertools.product(*forest_grid.values())]
+    if 'retrieval' in engines:
+        model_configs.append(('retrieval', {}))
+
+    candidates = []
+    for key, params in vectorizers.items():
+        for engine, model_params in model_configs:
+            candidates.append({
+                'id': f"c{len(candidates):03d}", 'engine': engine, 'feature_key': key,
+                'vectorizer': params, 'model': model_params
+            })
+    return vectorizers, candidates
+
+def select_best(results: List[Dict[str, Any]], max_latency_ms: Optional[float],
+                max_artifact_mb: Optional[float]) -> Optional[Dict[str, Any]]:
+    """Most accurate candidate within budget; ties go to the faster, then the smaller one"""
+    for result in results:
+        result['within_budget'] = 'error' not in result and (
+            (max_latency_ms is None or result['latency_ms_p99'] <= max_latency_ms) and
+            (max_artifact_mb is None or result['artifact_bytes'] <= max_artifact_mb * 1e6)
+        )
+    eligible = [result for result in results if result['within_budget']]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda r: (r['accuracy'], -r['latency_ms_p99'], -r['artifact_bytes']))
+
+def run_sweep(split: Dict[str, Any], vectorizers: Dict[str, Dict[str, Any]], candidates: List[Dict[str, Any]],
+              cache_dir: str, workers: int, n_queries: int) -> List[Dict[str, Any]]:
+    results = []
+    failed_keys = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(split,)) as pool:
+        # Features first, once per vectorizer config, so model fits never vectorize
+        futures = {pool.submit(cache_features, cache_dir, key, params): key for key, params in vectorizers.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                entry = future.result()
+                status = 'cached' if entry['cached'] else f"computed in {entry['seconds']}s"
+                logger.info(f"Features {key}: {status}")
+            except Exception as e:
+                logger.error(f"Vectorizing {vectorizers[key]} failed: {e}")
+                failed_keys[key] = str(e)
+
+        futures = {}
+        for candidate in candidates:
+            if candidate['feature_key'] in failed_keys:
+                results.append(dict(candidate, error=failed_keys[candidate['feature_key']]))
+            else:
+                futures[pool.submit(fit_candidate, cache_dir, candidate)] = candidate
+        for future in as_completed(futures):
+            candidate = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                # A worker died, usually killed for memory: forest node arrays grow with depth times classes
+                logger.error(f"Candidate {candidate['id']} lost its worker: {e}")
+                results.append(dict(candidate, error='worker died (out of memory?)'))
+            except Exception as e:
+                logger.error(f"Candidate {candidate['id']} failed: {e}")
+                results.append(dict(candidate, error=str(e)))
+            else:
+                logger.info(f"{result['id']} {result['engine']}: accuracy {result['accuracy']:.4f}, "
+                            f"{result['artifact_bytes'] / 1e6:.2f} MB, fit {result['fit_seconds']}s")
+                results.append(result)
+
+    # Latency is timed one candidate at a time, so candidates do not compete for CPU while being measured
+    for result in results:
+        if 'error' in result:
+            continue
+        base_dir = os.path.join(cache_dir, 'candidates', result['id'])
+        try:
+            result.update(measure_latency(base_dir, result['engine'], split['X_test'], n_queries))
+        except Exception as e:
+            logger.error(f"Timing candidate {result['id']} failed: {e}")
+            result['error'] = str(e)
+        finally:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    results.sort(key=lambda r: r['id'])
+    return results
+
+def _values(text: str, cast) -> list:
+    return [cast(value) for value in text.split(',')]
+
+def _ngram_range(text: str) -> Tuple[int, int]:
+    low, _, high = text.partition('-')
+    return (int(low), int(high or low))
+
+def _optional_int(text: str) -> Optional[int]:
+    return None if text.lower() == 'none' else int(text)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data', metavar='PATH', help='.csv or .jsonl corpus (default: the built-in sample data)')
+    parser.add_argument('--text-column', default='symptoms')
+    parser.add_argument('--answer-column', default='advice')
+    parser.add_argument('--max-features', default='2000,5000,10000', help='comma-separated vocabulary sizes')
+    parser.add_argument('--ngram-range', default='1-1,1-2', help='comma-separated n-gram ranges, e.g. 1-2')
+    parser.add_argument('--min-df', default='1')
+    parser.add_argument('--engines', default='forest,retrieval')
+    parser.add_argument('--n-estimators', default='50,100,200')
+    parser.add_argument('--max-depth', default='10,20', help="comma-separated depths; 'none' for unlimited")
+    parser.add_argument('--min-samples-leaf', default='1')
+    parser.add_argument('--max-latency-ms', type=float, help='p99 single-message predict budget')
+    parser.add_argument('--max-artifact-mb', type=float, help='artifact size budget')
+    parser.add_argument('--queries', type=int, default=200, help='single-message predictions timed per candidate')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cache-dir', default='.sweep_cache', help='feature matrix cache, reused across sweeps')
+    parser.add_argument('--output', default='sweep_results.json')
+    parser.add_argument('--apply', action='store_true',
+                        help='train and save the selected config the way extract_model.py does')
+    args = parser.parse_args()
+
+    df = load_corpus(args.data, args.text_column, args.answer_column)
+    split = make_split(df)
+    logger.info(f"Loaded {len(df)} records ({len(split['X_train'])} train, {len(split['X_test'])} test)")
+
+    vectorizer_grid = {
+        'max_features': _values(args.max_features, int),
+        'ngram_range': _values(args.ngram_range, _ngram_range),
+        'min_df': _values(args.min_df, int)
+    }
+    forest_grid = {
+        'n_estimators': _values(args.n_estimators, int),
+        'max_depth': _values(args.max_depth, _optional_int),
+        'min_samples_leaf': _values(args.min_samples_leaf, int)
+    }
+    engines = _values(args.engines, str.strip)
+    vectorizers, candidates = build_grid(vectorizer_grid, forest_grid, engines, split['fingerprint'])
+    logger.info(f"Sweeping {len(candidates)} candidates over {len(vectorizers)} vectorizer configs "
+                f"with {args.workers} workers")
+
+    start = time.perf_counter()
+    results = run_sweep(split, vectorizers, candidates, args.cache_dir, args.workers, args.queries)
+    best = select_best(results, args.max_latency_ms, args.max_artifact_mb)
+
+    print("\nid    engine     features  accuracy  artifact MB   p50 ms   p99 ms  budget")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['id']:<5} {r['engine']:<10} error: {r['error']}")
+            continue
+        print(f"{r['id']:<5} {r['engine']:<10} {r['n_features']:>8} {r['accuracy']:>9.4f} "
+              f"{r['artifact_bytes'] / 1e6:>12.2f} {r['latency_ms_p50']:>8.3f} {r['latency_ms_p99']:>8.3f}  "
+              f"{'ok' if r['within_budget'] else 'over'}")
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'records': len(df),
+            'data_fingerprint': split['fingerprint'],
+            'budget': {'max_latency_ms': args.max_latency_ms, 'max_artifact_mb': args.max_artifact_mb},
+            'seconds': round(time.perf_counter() - start, 2),
+            'best': best['id'] if best else None,
+            'candidates': results
+        }, f, indent=2)
+    print(f"\n💾 Results saved to {args.output}")
+
+    if best is None:
+        logger.error("No candidate fits the latency and size budget")
+        return
+    logger.info(f"Best: {best['id']} ({best['engine']}) vectorizer={best['vectorizer']} model={best['model']}")
+    if args.apply:
+        forest_params = best['model'] if best['engine'] == 'forest' else None
+        if train_and_save_model(best['vectorizer'], forest_params, df=df):
+            logger.info(f"Saved the selected config; serve it with MODEL_ENGINE={best['engine']}")
+        else:
+            logger.error("Training the selected config failed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Incremental updates to the retrieval engine
+Appends a delta file of new symptom/advice pairs to the memory-mapped
+retrieval artifacts as a new segment and refreshes the retrieval IDF weights.
+The vectorizer vocabulary and the rows already indexed are left untouched
+(queries renormalize them to the refreshed IDF), so an update costs time
+proportional to the delta rather than the corpus
+"""
+
+import os
+import json
+import time
+import logging
+from typing import Any, Dict
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+
+from model_artifacts import ArtifactError, ArtifactWriter, METADATA_FILE, load_artifacts, read_manifest
+from retrieval import RetrievalIndex
+from streaming_training import iter_chunks
+
+logger = logging.getLogger(__name__)
+
+# TfidfVectorizer parameters that decide which vocabulary terms a text contains
+COUNT_PARAMS = ('analyzer', 'binary', 'lowercase', 'ngram_range', 'stop_words', 'strip_accents', 'token_pattern')
+
+# Every segment adds one sparse product per query; past this, a full retrain is worth it
+MAX_SEGMENTS = 10
+
+def refreshed_idf(df: np.ndarray, n_docs: int, smooth_idf: bool = True) -> np.ndarray:
+    """IDF weights from document frequencies, computed the way TfidfVectorizer does"""
+    if smooth_idf:
+        return np.log((n_docs + 1) / (df.astype(np.float64) + 1)) + 1
+    return np.log(n_docs / np.maximum(df, 1).astype(np.float64)) + 1
+
+def append_to_index(path: str, text_column: str = 'symptoms', answer_column: str = 'advice',
+                    chunk_rows: int = 10000, base_dir: str = '.') -> Dict[str, Any]:
+    """Index the pairs in a .csv/.jsonl delta file as a new retrieval segment and publish the next revision"""
+    start = time.perf_counter()
+    manifest = read_manifest(base_dir)
+    if manifest is None or 'retrieval' not in manifest['engines']:
+        raise ArtifactError("No retrieval artifacts to append to; run extract_model.py first")
+    # Validates the manifest and gives the vectorizer with the current retrieval IDF
+    _, vectorizer = load_artifacts('retrieval', base_dir=base_dir, verify=False)
+    info = dict(manifest['engines']['retrieval'])
+    directory = os.path.join(base_dir, manifest['directory'])
+
+    def mapped(name):
+        return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r', allow_pickle=False)
+
+    # Document frequencies of the indexed rows; before the first append they are the posting list lengths
+    if 'df' in info:
+        df, n_docs = np.array(mapped(info['df']), dtype=np.int64), info['n_docs']
+    else:
+        df, n_docs = np.diff(mapped('retrieval_postings_indptr')).astype(np.int64), info['n_rows']
+
+    params = vectorizer.get_params()
+    counter = CountVectorizer(vocabulary=vectorizer.vocabulary_, **{key: params[key] for key in COUNT_PARAMS})
+    counts, answers = [], []
+    skipped = 0
+    for texts, chunk_answers in iter_chunks(path, text_column, answer_column, chunk_rows):
+        if not texts:
+            continue
+        chunk = counter.transform(texts).tocsr()
+        # A row with no vocabulary term can never be retrieved
+        keep = np.diff(chunk.indptr) > 0
+        skipped += int((~keep).sum())
+        counts.append(chunk[keep])
+        answers.extend(answer for answer, kept in zip(chunk_answers, keep) if kept)
+    if not answers:
+        raise ValueError(f"No rows with known terms in {path}")
+
+    counts = sp.vstack(counts).tocsr()
+    counts.sum_duplicates()
+    df = df + np.bincount(counts.indices, minlength=len(df))
+    n_docs += counts.shape[0]
+    idf = refreshed_idf(df, n_docs, params['smooth_idf'])
+    transformer = TfidfTransformer(norm=params['norm'], smooth_idf=params['smooth_idf'],
+                                   sublinear_tf=params['sublinear_tf'])
+    transformer.idf_ = idf
+    segment = RetrievalIndex().fit(transformer.transform(counts), answers)
+
+    revision = manifest.get('revision', 0) + 1
+    writer = ArtifactWriter(base_dir)
+    prefix = f'retrieval_seg{revision}_'
+    segment_info = writer.retrieval(segment, prefix=prefix)
+    segment_info.update(prefix=prefix, idf=f'retrieval_idf_r{revision}')
+    writer.array(segment_info['idf'], idf)
+    writer.array(f'retrieval_df_r{revision}', df)
+
+    # Row norms stored by earlier appends are stale under the refreshed IDF; queries renormalize instead
+    entries = [info] + [dict(entry) for entry in info.get('segments', [])]
+    dropped = [f"{entry.pop('norms')}.npy" for entry in entries if entry.get('norms')]
+    previous_df = info.get('df')
+    if previous_df:
+        dropped.append(f'{previous_df}.npy')
+    info.update(idf=segment_info['idf'], df=f'retrieval_df_r{revision}', n_docs=int(n_docs),
+                segments=entries[1:] + [segment_info])
+
+    seconds = time.perf_counter() - start
+    update = {
+        'revision': revision,
+        'source': os.path.basename(path),
+        'rows': int(counts.shape[0]),
+        'skipped_rows': skipped,
+        'seconds': round(seconds, 2),
+        'rows_per_second': round(counts.shape[0] / seconds, 1) if seconds else None
+    }
+    with open(os.path.join(base_dir, METADATA_FILE)) as f:
+        metadata = json.load(f)
+    metadata['updates'] = metadata.get('updates', []) + [update]
+    writer.update(manifest, dict(manifest['engines'], retrieval=info), metadata,
+                  dropped=tuple(dropped))
+
+    # The df file of the previous revision stays for workers still loading that manifest
+    stale = os.path.join(directory, f'retrieval_df_r{revision - 2}.npy')
+    if os.path.exists(stale):
+        os.remove(stale)
+
+    logger.info(f"Appended {update['rows']} rows as segment {revision} in {update['seconds']}s "
+                f"({skipped} rows without known terms skipped)")
+    if len(info['segments']) > MAX_SEGMENTS:
+        logger.warning(f"The retrieval index has {len(info['segments'])} segments; "
+                       f"rerun extract_model.py to rebuild it as one")
+    return update
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Keyword intent matcher for the rule-based chatbot
+Keywords and phrases from a JSON rules file are indexed once by their words.
+A message is tokenized in one pass and its n-grams are looked up in the index,
+so matching cost depends on the message length, not the number of keywords
+"""
+
+import re
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Whole words only: "hot" matches "hot" but not "shot"
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:'[^\W_]+)?")
+
+def tokenize(text: str) -> Tuple[str, ...]:
+    return tuple(TOKEN_PATTERN.findall(text.lower()))
+
+class KeywordMatcher:
+    """Scores categories by the keywords and phrases found in a message"""
+
+    def __init__(self, categories: List[Dict], default_response: str):
+        self.names = [category['name'] for category in categories]
+        self.responses = {category['name']: category['response'] for category in categories}
+        self.default_response = default_response
+        # Word tuple -> (category index, weight); longer phrases are more specific and weigh more
+        self._index = {}
+        for position, category in enumerate(categories):
+            for keyword in category['keywords']:
+                tokens = tokenize(keyword)
+                if not tokens:
+                    continue
+                if tokens in self._index and self._index[tokens][0] != position:
+                    logger.warning(f"Keyword '{keyword}' is listed under more than one category; "
+                                   f"keeping {self.names[self._index[tokens][0]]}")
+                    continue
+                self._index[tokens] = (position, float(category.get('weight', 1.0)) * len(tokens))
+        self.max_phrase_length = max((len(tokens) for tokens in self._index), default=1)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'KeywordMatcher':
+        """Build a matcher from a rules file: {"default": ..., "categories": [{name, keywords, response}]}"""
+        with open(path, encoding='utf-8') as f:
+            rules = json.load(f)
+        matcher = cls(rules['categories'], rules['default'])
+        logger.info(f"Loaded {len(matcher._index)} keywords in {len(matcher.names)} categories from {path}")
+        return matcher
+
+    def _position_scores(self, message: str) -> Dict[int, float]:
+        tokens = tokenize(message)
+        totals = {}
+        start = 0
+        while start < len(tokens):
+            # Longest phrase first, so "sore throat" is not also counted as "throat"
+            step = 1
+            for length in range(min(self.max_phrase_length, len(tokens) - start), 0, -1):
+                match = self._index.get(tokens[start:start + length])
+                if match:
+                    position, weight = match
+                    totals[position] = totals.get(position, 0.0) + weight
+                    step = length
+                    break
+            start += step
+        return totals
+
+    def scores(self, message: str) -> Dict[str, float]:
+        """Summed keyword weight per matched category"""
+        return {self.names[position]: total for position, total in self._position_scores(message).items()}
+
+    def best_category(self, message: str) -> Optional[str]:
+        """Highest-scoring category; ties go to the category listed first in the rules"""
+        totals = self._position_scores(message)
+        if not totals:
+            return None
+        return self.names[max(totals, key=lambda position: (totals[position], -position))]
+
+    def match(self, message: str) -> str:
+        """Response of the best category, or the default response"""
+        category = self.best_category(message)
+        return self.responses[category] if category else self.default_response
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Asyncio LLM providers for the WhatsApp Medical Chatbot
+Same providers and fallback/hedging behaviour as llm_integration, built on the
+SDKs' async clients and httpx so one event loop can hold many concurrent calls.
+Request building and response parsing are the protocol classes of
+llm_integration; this module only adds the async transports
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+from anthropic import AsyncAnthropic
+
+from llm_integration import (
+    FAILURE_RESPONSE, AnthropicMessages, BaseLLMManager, HuggingFaceInference, LLMProvider,
+    OllamaGenerate, OpenAIChat, anthropic_usage, openai_usage
+)
+from prompt_builder import Prompt
+from metrics import CANCELLED, ERROR, LLM_ATTEMPT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class AsyncLLMProvider(LLMProvider):
+    """Base class for asyncio LLM providers"""
+
+    async def generate_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> str:
+        """Generate response using the LLM; history holds earlier turns as {'role', 'content'}"""
+        try:
+            prompt = self.build_prompt(user_message, history)
+            return self.parse(prompt, await self._send(prompt))
+        except Exception as e:
+            logger.error(f"{self.label} error: {e}")
+            return FAILURE_RESPONSE
+
+    async def _send(self, prompt: Prompt) -> Any:
+        raise NotImplementedError
+
+    async def stream_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+        """Yield the response incrementally; raises on failure instead of apologising"""
+        response = await self.generate_response(user_message, history)
+        if not response or "I'm sorry" in response:
+            raise RuntimeError(f"{type(self).__name__} could not generate a response")
+        yield response
+
+    async def warm_up(self):
+        """Open connections / load the model ahead of the first request"""
+        pass
+
+    async def aclose(self):
+        """Close the underlying client"""
+        pass
+
+class AsyncOpenAIProvider(OpenAIChat, AsyncLLMProvider):
+    """OpenAI GPT integration (async client)"""
+
+    def __init__(self, api_key: str, model: str = "gpt-3.5-turbo"):
+        super().__init__(api_key, model)
+        self.client = openai.AsyncOpenAI(api_key=api_key)
+
+    async def _send(self, prompt: Prompt) -> Any:
+        return await self.client.chat.completions.create(**self.request(prompt))
+
+    async def stream_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+        prompt = self.build_prompt(user_message, history)
+        usage = None
+        async for chunk in await self.client.chat.completions.create(**self.request(prompt, stream=True)):
+            usage = getattr(chunk, 'usage', None) or usage
+            text = self.chunk_text(chunk)
+            if text:
+                yield text
+        self.usage.record(prompt, *openai_usage(usage))
+
+    async def aclose(self):
+        await self.client.close()
+
+class AsyncAnthropicProvider(AnthropicMessages, AsyncLLMProvider):
+    """Anthropic Claude integration (async client)"""
+
+    def __init__(self, api_key: str, model: str = "claude-3-haiku-20240307"):
+        super().__init__(api_key, model)
+        self.client = AsyncAnthropic(api_key=api_key)
+
+    async def _send(self, prompt: Prompt) -> Any:
+        return await self.client.messages.create(**self.request(prompt))
+
+    async def stream_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+        prompt = self.build_prompt(user_message, history)
+        async with self.client.messages.stream(**self.request(prompt)) as stream:
+            async for text in stream.text_stream:
+                yield text
+            final = await stream.get_final_message()
+            self.usage.record(prompt, *anthropic_usage(getattr(final, 'usage', None)))
+
+    async def aclose(self):
+        await self.client.close()
+
+class AsyncHTTPProvider(AsyncLLMProvider):
+    """Base class for providers called over plain HTTP with a pooled httpx client"""
+
+    def __init__(self):
+        super().__init__()
+        pool_size = int(os.getenv('LLM_HTTP_POOL_SIZE', '10'))
+        self.headers = {}
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.timeout = httpx.Timeout(
+            float(os.getenv('LLM_READ_TIMEOUT', '30')),
+            connect=float(os.getenv('LLM_CONNECT_TIMEOUT', '3.05'))
+        )
+        # httpx transport retries only cover connection failures
+        self.retries = int(os.getenv('LLM_HTTP_RETRIES', '2'))
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Pooled client, created on first use inside the running event loop"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=self.limits,
+                timeout=self.timeout,
+                transport=httpx.AsyncHTTPTransport(retries=self.retries, limits=self.limits)
+            )
+        return self._client
+
+    async def _post_json(self, url: str, payload: Dict[str, Any]) -> Any:
+        response = await self.client.post(url, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class AsyncOllamaProvider(OllamaGenerate, AsyncHTTPProvider):
+    """Local Ollama integration (async)"""
+
+    async def warm_up(self):
+        # A request without a prompt loads the model into memory
+        await self.client.post(self.url, json={"model": self.model})
+
+    async def _send(self, prompt: Prompt) -> Any:
+        return await self._post_json(self.url, self.request(prompt))
+
+    async def stream_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+        prompt = self.build_prompt(user_message, history)
+        async with self.client.stream("POST", self.url, json=self.request(prompt, stream=True)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                text, done = self.parse_line(prompt, line)
+                if text:
+                    yield text
+                if done:
+                    break
+
+class AsyncHuggingFaceProvider(HuggingFaceInference, AsyncHTTPProvider):
+    """Hugging Face API integration (async)"""
+
+    async def warm_up(self):
+        # Establish the TLS connection; the status of this call does not matter
+        await self.client.head(self.api_url)
+
+    async def _send(self, prompt: Prompt) -> Any:
+        return await self._post_json(self.api_url, self.request(prompt))
+
+class AsyncLLMManager(BaseLLMManager):
+    """Asyncio counterpart of LLMManager; create one per event loop"""
+
+    openai_provider = AsyncOpenAIProvider
+    anthropic_provider = AsyncAnthropicProvider
+    huggingface_provider = AsyncHuggingFaceProvider
+    ollama_provider = AsyncOllamaProvider
+
+    async def generate_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> Optional[str]:
+        """Generate response with fallback to other providers"""
+        return (await self.generate_response_with_provider(user_message, history))[0]
+
+    async def generate_response_with_provider(self, user_message: str, history: Optional[List[Dict[str, str]]] = None
+                                              ) -> Tuple[Optional[str], Optional[str]]:
+        """Generate response with fallback, also returning the name of the provider that answered"""
+        providers = self.ranked_providers()
+        if not providers:
+            return None, None
+
+        if self.dispatch_mode != 'sequential' and len(providers) > 1:
+            return await self._generate_concurrently(user_message, providers, hedge=self.dispatch_mode == 'hedged',
+                                                     history=history)
+
+        for provider in providers:
+            response = await self._call_provider(provider, user_message, history)
+            if response:
+                return response, type(provider).__name__
+
+        return None, None
+
+    async def _call_provider(self, provider: AsyncLLMProvider, user_message: str,
+                             history: Optional[List[Dict[str, str]]] = None) -> Optional[str]:
+        """Call one provider, returning its response only if it is acceptable"""
+        name = type(provider).__name__
+        health = self._health_for(provider)
+        permit = health.breaker.allow_request()
+        if permit is None:
+            logger.info(f"Skipping {name}: circuit open")
+            return None
+
+        start = time.perf_counter()
+        try:
+            response = await provider.generate_response(user_message, history)
+        except asyncio.CancelledError:
+            # Lost a hedge/race: no outcome to record (frees the probe slot only if this call is the probe)
+            health.breaker.release(permit)
+            LLM_ATTEMPT_SECONDS.observe(time.perf_counter() - start, name, CANCELLED)
+            raise
+        except Exception as e:
+            logger.error(f"Provider {name} failed: {e}")
+            return self._finish_attempt(provider, start, None, ERROR, permit)
+        return self._finish_attempt(provider, start, response, permit=permit)
+
+    async def _generate_concurrently(self, user_message: str, providers: List[AsyncLLMProvider], hedge: bool,
+                                     history: Optional[List[Dict[str, str]]] = None
+                                     ) -> Tuple[Optional[str], Optional[str]]:
+        """Run providers concurrently and return the first acceptable response"""
+        loop = asyncio.get_running_loop()
+        remaining = list(providers)
+        pending = {}
+        next_launch_at = None
+
+        def launch():
+            nonlocal next_launch_at
+            provider = remaining.pop(0)
+            pending[asyncio.ensure_future(self._call_provider(provider, user_message, history))] = provider
+            next_launch_at = loop.time() + self._hedge_delay_for(provider)
+
+        launch()
+        while remaining and not hedge:
+            launch()
+
+        try:
+            while pending:
+                timeout = max(0.0, next_launch_at - loop.time()) if remaining else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                failed = 0
+                for task in done:
+                    provider = pending.pop(task)
+                    response = task.result()
+                    if response:
+                        return response, type(provider).__name__
+                    failed += 1
+
+                for _ in range(self._hedges_due(len(done), failed)):
+                    if remaining:
+                        launch()
+
+            return None, None
+        finally:
+            # Unlike threads, losing calls are really cancelled
+            for task in pending:
+                task.cancel()
+
+    async def stream_response_with_provider(self, user_message: str, history: Optional[List[Dict[str, str]]] = None
+                                            ) -> Tuple[Optional[AsyncIterator[str]], Optional[str]]:
+        """Start streaming from the best available provider, falling back before the first chunk"""
+        for provider in self.ranked_providers():
+            name = type(provider).__name__
+            permit = self._health_for(provider).breaker.allow_request()
+            if permit is None:
+                continue
+
+            start = time.perf_counter()
+            chunks = provider.stream_response(user_message, history)
+            try:
+                first = await chunks.__anext__()
+            except Exception as e:
+                # StopAsyncIteration included: an empty stream is a failure too
+                logger.error(f"Provider {name} failed to stream: {e!r}")
+                self._finish_stream(provider, start, False, permit)
+                continue
+
+            return self._tracked_stream(provider, start, first, chunks, permit), name
+
+        return None, None
+
+    async def _tracked_stream(self, provider: AsyncLLMProvider, start: float, first: str,
+                              chunks: AsyncIterator[str], permit: Optional[int] = None) -> AsyncIterator[str]:
+        """Pass chunks through and record the provider's outcome when the stream ends"""
+        success = False
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+            success = True
+        except (GeneratorExit, asyncio.CancelledError):
+            # The consumer stopped reading; not the provider's fault
+            success = True
+            raise
+        except Exception as e:
+            # Re-raised so the caller knows the text it has is incomplete
+            logger.error(f"Provider {type(provider).__name__} stream interrupted: {e}")
+            raise
+        finally:
+            self._finish_stream(provider, start, success, permit)
+
+    async def warm_up(self):
+        """Warm up every provider concurrently; failures are only logged"""
+        results = await asyncio.gather(*(p.warm_up() for p in self.providers), return_exceptions=True)
+        for provider, result in zip(self.providers, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Warm-up failed for {type(provider).__name__}: {result}")
+            else:
+                logger.info(f"Warmed up {type(provider).__name__}")
+
+    async def aclose(self):
+        """Close every provider's client"""
+        await asyncio.gather(*(p.aclose() for p in self.providers), return_exceptions=True)
@@ -5,21 +5,24 @@ Supports OpenAI GPT, Anthropic Claude, and local models
 """
 
 import os
+import time
 import logging
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 import openai
 from anthropic import Anthropic
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+from provider_health import ProviderHealth, OPEN
+from prompt_builder import Prompt, PromptBuilder, TokenUsage
+from metrics import ERROR, LLM_ATTEMPT_SECONDS, OK, REJECTED
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class LLMProvider:
-    """Base class for LLM providers"""
-    
-    def __init__(self):
-        self.medical_prompt = """You are a helpful medical AI assistant. Provide informative medical guidance while always including appropriate disclaimers.
+MEDICAL_PROMPT = """You are a helpful medical AI assistant. Provide informative medical guidance while always including appropriate disclaimers.
 
 IMPORTANT GUIDELINES:
 - Always include medical disclaimers
@@ -32,144 +35,372 @@ DISCLAIMER TEMPLATE:
 "⚠️ This is AI-generated medical information for educational purposes only. Always consult qualified healthcare professionals for proper diagnosis and treatment."
 """
 
-    def generate_response(self, user_message: str) -> str:
-        """Generate response using the LLM"""
+# What a provider returns instead of raising; the managers count it as a failed call
+FAILURE_RESPONSE = "I'm sorry, I'm having trouble processing your request right now. Please try again later."
+
+class LLMProvider:
+    """Base class for LLM providers
+    
+    An API's request format and response parsing live in a protocol class shared with
+    llm_async (OpenAIChat, AnthropicMessages, ...); providers only add the transport, _send"""
+    
+    label = 'LLM'
+    
+    def __init__(self):
+        self.medical_prompt = MEDICAL_PROMPT
+        self.prompt_builder = PromptBuilder.from_env(self.medical_prompt)
+        self.usage = TokenUsage()
+
+    def generate_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> str:
+        """Generate response using the LLM; history holds earlier turns as {'role', 'content'}"""
+        try:
+            prompt = self.build_prompt(user_message, history)
+            return self.parse(prompt, self._send(prompt))
+        except Exception as e:
+            logger.error(f"{self.label} error: {e}")
+            return FAILURE_RESPONSE
+    
+    def _send(self, prompt: Prompt) -> Any:
+        """Make the (non-streaming) API call and return its decoded result"""
+        raise NotImplementedError
+    
+    def parse(self, prompt: Prompt, result: Any) -> str:
+        """Answer text of an API result, recording its token usage"""
         raise NotImplementedError
+    
+    def stream_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> Iterator[str]:
+        """Yield the response incrementally; raises on failure instead of apologising"""
+        # Providers without a streaming API deliver the whole answer as one chunk
+        response = self.generate_response(user_message, history)
+        if not response or "I'm sorry" in response:
+            raise RuntimeError(f"{type(self).__name__} could not generate a response")
+        yield response
+    
+    def warm_up(self):
+        """Open connections / load the model ahead of the first request"""
+        pass
+    
+    def build_prompt(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> Prompt:
+        """System prompt, budget-trimmed history and the user message"""
+        prompt = self.prompt_builder.build(user_message, history)
+        if prompt.trimmed_turns:
+            logger.info(f"{type(self).__name__}: dropped {prompt.trimmed_turns} history turns to fit the input budget")
+        return prompt
 
-class OpenAIProvider(LLMProvider):
-    """OpenAI GPT integration"""
+def openai_chat_messages(prompt: Prompt) -> List[Dict[str, str]]:
+    # The system prompt stays first, so OpenAI's automatic prefix caching can reuse it
+    return [{"role": "system", "content": prompt.system}] + prompt.chat_messages()
+
+def openai_usage(usage) -> Tuple[Optional[int], Optional[int]]:
+    """(input tokens, cached input tokens) from an OpenAI usage object"""
+    if usage is None:
+        return None, None
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return usage.prompt_tokens, getattr(details, 'cached_tokens', None)
+
+def anthropic_request(prompt: Prompt, cache: bool) -> Tuple[str, List[Dict[str, Any]]]:
+    """(system, messages) for the Messages API, with a cache breakpoint when prompt caching is on"""
+    messages = prompt.chat_messages()
+    # Anthropic ignores breakpoints on prefixes under 1024 tokens (2048 for Haiku). The
+    # system prompt alone is far shorter, so only the conversation so far is marked:
+    # a long conversation's next turn reads system prompt + history back as a prefix
+    if cache and prompt.history:
+        last = messages[-2]
+        messages[-2] = {"role": last["role"], "content": [
+            {"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}
+        ]}
+    return prompt.system, messages
+
+def anthropic_usage(usage) -> Tuple[Optional[int], Optional[int]]:
+    """(input tokens including cached ones, cached input tokens) from an Anthropic usage object"""
+    if usage is None:
+        return None, None
+    cached = getattr(usage, 'cache_read_input_tokens', None) or 0
+    written = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    return usage.input_tokens + cached + written, cached
+
+def build_http_session(pool_size: int = 10, retries: int = 2, backoff: float = 0.5) -> requests.Session:
+    """Keep-alive session with a bounded connection pool and retry with backoff"""
+    # Only retry failures where the server did not process the request. Connection
+    # errors are retried for every method; 429/502/503/504 only for idempotent ones.
+    # Provider calls are POSTs to paid APIs, and a 502/504 from a gateway does not
+    # prove the model never ran, so those surface as a failure and the next provider
+    # takes over. Read timeouts are not retried.
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class HTTPProvider(LLMProvider):
+    """Base class for providers called over plain HTTP with a pooled session"""
+    
+    def __init__(self):
+        super().__init__()
+        self.pool_size = int(os.getenv('LLM_HTTP_POOL_SIZE', '10'))
+        self.retries = int(os.getenv('LLM_HTTP_RETRIES', '2'))
+        self.backoff = float(os.getenv('LLM_HTTP_BACKOFF', '0.5'))
+        self.timeout = (
+            float(os.getenv('LLM_CONNECT_TIMEOUT', '3.05')),
+            float(os.getenv('LLM_READ_TIMEOUT', '30'))
+        )
+        self.headers = {}
+        self._session = None
+        self._session_pid = None
+    
+    @property
+    def session(self) -> requests.Session:
+        """Pooled session, created lazily so each forked worker gets its own sockets"""
+        if self._session is None or self._session_pid != os.getpid():
+            self._session = build_http_session(self.pool_size, self.retries, self.backoff)
+            self._session.headers.update(self.headers)
+            self._session_pid = os.getpid()
+        return self._session
+
+class OpenAIChat:
+    """OpenAI chat completions: request and response format, shared by both transports"""
+    
+    label = 'OpenAI API'
     
     def __init__(self, api_key: str, model: str = "gpt-3.5-turbo"):
         super().__init__()
-        self.client = openai.OpenAI(api_key=api_key)
+        self.api_key = api_key
         self.model = model
-        
-    def generate_response(self, user_message: str) -> str:
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self.medical_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            logger.error(f"OpenAI API error: {e}")
-            return "I'm sorry, I'm having trouble processing your request right now. Please try again later."
+    
+    def request(self, prompt: Prompt, stream: bool = False) -> Dict[str, Any]:
+        kwargs = {
+            'model': self.model,
+            'messages': openai_chat_messages(prompt),
+            'max_tokens': 500,
+            'temperature': 0.7
+        }
+        if stream:
+            # The final chunk then carries the token usage
+            kwargs.update(stream=True, stream_options={"include_usage": True})
+        return kwargs
+    
+    def parse(self, prompt: Prompt, response: Any) -> str:
+        self.usage.record(prompt, *openai_usage(getattr(response, 'usage', None)))
+        return response.choices[0].message.content
+    
+    @staticmethod
+    def chunk_text(chunk: Any) -> Optional[str]:
+        return chunk.choices[0].delta.content if chunk.choices else None
 
-class AnthropicProvider(LLMProvider):
-    """Anthropic Claude integration"""
+class AnthropicMessages:
+    """Anthropic Messages API: request and response format, shared by both transports"""
+    
+    label = 'Anthropic API'
     
     def __init__(self, api_key: str, model: str = "claude-3-haiku-20240307"):
         super().__init__()
-        self.client = Anthropic(api_key=api_key)
+        self.api_key = api_key
         self.model = model
-        
-    def generate_response(self, user_message: str) -> str:
-        try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=500,
-                system=self.medical_prompt,
-                messages=[
-                    {"role": "user", "content": user_message}
-                ]
-            )
-            
-            return response.content[0].text
-            
-        except Exception as e:
-            logger.error(f"Anthropic API error: {e}")
-            return "I'm sorry, I'm having trouble processing your request right now. Please try again later."
+        self.prompt_cache = os.getenv('ANTHROPIC_PROMPT_CACHE', 'true').lower() == 'true'
+    
+    def request(self, prompt: Prompt) -> Dict[str, Any]:
+        system, messages = anthropic_request(prompt, self.prompt_cache)
+        return {'model': self.model, 'max_tokens': 500, 'system': system, 'messages': messages}
+    
+    def parse(self, prompt: Prompt, response: Any) -> str:
+        self.usage.record(prompt, *anthropic_usage(getattr(response, 'usage', None)))
+        return response.content[0].text
 
-class OllamaProvider(LLMProvider):
-    """Local Ollama integration (free, runs on your server)"""
+class OllamaGenerate:
+    """Ollama /api/generate: payload and response format, shared by both transports"""
+    
+    label = 'Ollama'
     
     def __init__(self, base_url: str = "http://localhost:11434", model: str = "llama2"):
         super().__init__()
         self.base_url = base_url
         self.model = model
-        
-    def generate_response(self, user_message: str) -> str:
-        try:
-            payload = {
-                "model": self.model,
-                "prompt": f"{self.medical_prompt}\n\nUser: {user_message}\nAssistant:",
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "max_tokens": 500
-                }
+    
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/api/generate"
+    
+    def request(self, prompt: Prompt, stream: bool = False) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "prompt": self.prompt_builder.text(prompt),
+            "stream": stream,
+            "options": {
+                "temperature": 0.7,
+                "max_tokens": 500
             }
-            
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                return response.json()["response"]
-            else:
-                logger.error(f"Ollama API error: {response.status_code}")
-                return "I'm sorry, I'm having trouble processing your request right now."
-                
-        except Exception as e:
-            logger.error(f"Ollama error: {e}")
-            return "I'm sorry, I'm having trouble processing your request right now. Please try again later."
+        }
+    
+    def parse(self, prompt: Prompt, result: Dict[str, Any]) -> str:
+        # prompt_eval_count excludes a prompt prefix Ollama still had cached
+        self.usage.record(prompt, result.get("prompt_eval_count"))
+        return result["response"]
+    
+    def parse_line(self, prompt: Prompt, line) -> Tuple[Optional[str], bool]:
+        """(text, done) for one line of a streamed response; Ollama streams one JSON object per line"""
+        if not line:
+            return None, False
+        data = json.loads(line)
+        if data.get("done"):
+            self.usage.record(prompt, data.get("prompt_eval_count"))
+        return data.get("response"), bool(data.get("done"))
 
-class HuggingFaceProvider(LLMProvider):
-    """Hugging Face API integration (free tier available)"""
+class HuggingFaceInference:
+    """Hugging Face Inference API: payload and response format, shared by both transports"""
+    
+    label = 'HuggingFace'
     
     def __init__(self, api_key: str, model: str = "microsoft/DialoGPT-medium"):
         super().__init__()
         self.api_key = api_key
         self.model = model
         self.api_url = f"https://api-inference.huggingface.co/models/{model}"
-        
-    def generate_response(self, user_message: str) -> str:
-        try:
-            headers = {"Authorization": f"Bearer {self.api_key}"}
-            payload = {
-                "inputs": f"{self.medical_prompt}\n\nUser: {user_message}\nAssistant:",
-                "parameters": {
-                    "max_length": 500,
-                    "temperature": 0.7,
-                    "do_sample": True
-                }
+        self.headers = {"Authorization": f"Bearer {self.api_key}"}
+    
+    def request(self, prompt: Prompt) -> Dict[str, Any]:
+        return {
+            "inputs": self.prompt_builder.text(prompt),
+            "parameters": {
+                "max_length": 500,
+                "temperature": 0.7,
+                "do_sample": True
             }
-            
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if isinstance(result, list) and len(result) > 0:
-                    return result[0].get("generated_text", "").split("Assistant:")[-1].strip()
-                return "I'm sorry, I couldn't generate a proper response."
-            else:
-                logger.error(f"HuggingFace API error: {response.status_code}")
-                return "I'm sorry, I'm having trouble processing your request right now."
-                
-        except Exception as e:
-            logger.error(f"HuggingFace error: {e}")
-            return "I'm sorry, I'm having trouble processing your request right now. Please try again later."
+        }
+    
+    def parse(self, prompt: Prompt, result: Any) -> str:
+        self.usage.record(prompt)
+        if isinstance(result, list) and len(result) > 0:
+            return result[0].get("generated_text", "").split("Assistant:")[-1].strip()
+        return "I'm sorry, I couldn't generate a proper response."
 
-class LLMManager:
-    """Manages multiple LLM providers with fallback"""
+class OpenAIProvider(OpenAIChat, LLMProvider):
+    """OpenAI GPT integration"""
+    
+    def __init__(self, api_key: str, model: str = "gpt-3.5-turbo"):
+        super().__init__(api_key, model)
+        self._client = None
+        self._client_pid = None
+    
+    @property
+    def client(self) -> openai.OpenAI:
+        """SDK client, created lazily so a preloaded master never shares sockets with workers"""
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = openai.OpenAI(api_key=self.api_key)
+            self._client_pid = os.getpid()
+        return self._client
+    
+    def _send(self, prompt: Prompt) -> Any:
+        return self.client.chat.completions.create(**self.request(prompt))
+    
+    def stream_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> Iterator[str]:
+        prompt = self.build_prompt(user_message, history)
+        usage = None
+        for chunk in self.client.chat.completions.create(**self.request(prompt, stream=True)):
+            usage = getattr(chunk, 'usage', None) or usage
+            text = self.chunk_text(chunk)
+            if text:
+                yield text
+        self.usage.record(prompt, *openai_usage(usage))
+
+class AnthropicProvider(AnthropicMessages, LLMProvider):
+    """Anthropic Claude integration"""
+    
+    def __init__(self, api_key: str, model: str = "claude-3-haiku-20240307"):
+        super().__init__(api_key, model)
+        self._client = None
+        self._client_pid = None
+    
+    @property
+    def client(self) -> Anthropic:
+        """SDK client, created lazily so a preloaded master never shares sockets with workers"""
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = Anthropic(api_key=self.api_key)
+            self._client_pid = os.getpid()
+        return self._client
+    
+    def _send(self, prompt: Prompt) -> Any:
+        return self.client.messages.create(**self.request(prompt))
+    
+    def stream_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> Iterator[str]:
+        prompt = self.build_prompt(user_message, history)
+        with self.client.messages.stream(**self.request(prompt)) as stream:
+            for text in stream.text_stream:
+                yield text
+            self.usage.record(prompt, *anthropic_usage(getattr(stream.get_final_message(), 'usage', None)))
+
+class OllamaProvider(OllamaGenerate, HTTPProvider):
+    """Local Ollama integration (free, runs on your server)"""
+    
+    def warm_up(self):
+        # A request without a prompt loads the model into memory
+        self.session.post(self.url, json={"model": self.model}, timeout=self.timeout)
+    
+    def _send(self, prompt: Prompt) -> Any:
+        response = self.session.post(self.url, json=self.request(prompt), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+    
+    def stream_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> Iterator[str]:
+        prompt = self.build_prompt(user_message, history)
+        with self.session.post(self.url, json=self.request(prompt, stream=True),
+                               timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                text, done = self.parse_line(prompt, line)
+                if text:
+                    yield text
+                if done:
+                    break
+
+class HuggingFaceProvider(HuggingFaceInference, HTTPProvider):
+    """Hugging Face API integration (free tier available)"""
+    
+    def warm_up(self):
+        # Establish the TLS connection; the status of this call does not matter
+        self.session.head(self.api_url, timeout=self.timeout)
+    
+    def _send(self, prompt: Prompt) -> Any:
+        response = self.session.post(self.api_url, json=self.request(prompt), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+DISPATCH_MODES = ('sequential', 'hedged', 'race')
+
+class BaseLLMManager:
+    """Provider setup, health tracking and ranking shared by the sync and async managers"""
+    
+    # Provider classes built by setup_providers(); the async manager swaps these out
+    openai_provider = OpenAIProvider
+    anthropic_provider = AnthropicProvider
+    huggingface_provider = HuggingFaceProvider
+    ollama_provider = OllamaProvider
     
     def __init__(self):
         self.providers = []
         self.current_provider = None
+        # sequential: try providers one after another
+        # hedged: start the next provider if the current one is slow
+        # race: start all providers at once and take the first good answer
+        self.dispatch_mode = os.getenv('LLM_DISPATCH_MODE', 'sequential').lower()
+        if self.dispatch_mode not in DISPATCH_MODES:
+            logger.warning(f"Unknown LLM_DISPATCH_MODE '{self.dispatch_mode}', using sequential")
+            self.dispatch_mode = 'sequential'
+        # Seconds to wait before hedging, or "p95" to use each provider's observed p95 latency
+        self.hedge_delay = os.getenv('LLM_HEDGE_DELAY', '2.0').lower()
+        self.default_hedge_delay = 2.0
+        # Re-rank providers by observed success latency
+        self.adaptive_order = os.getenv('LLM_ADAPTIVE_ORDER', 'true').lower() == 'true'
+        self.health = {}
         self.setup_providers()
         
     def setup_providers(self):
@@ -178,51 +409,256 @@ class LLMManager:
         # OpenAI GPT
         openai_key = os.getenv('OPENAI_API_KEY')
         if openai_key:
-            self.providers.append(OpenAIProvider(openai_key))
+            self.providers.append(self.openai_provider(openai_key))
             logger.info("OpenAI provider configured")
             
         # Anthropic Claude
         anthropic_key = os.getenv('ANTHROPIC_API_KEY')
         if anthropic_key:
-            self.providers.append(AnthropicProvider(anthropic_key))
+            self.providers.append(self.anthropic_provider(anthropic_key))
             logger.info("Anthropic provider configured")
             
         # Hugging Face (free tier)
         hf_key = os.getenv('HUGGINGFACE_API_KEY')
         if hf_key:
-            self.providers.append(HuggingFaceProvider(hf_key))
+            self.providers.append(self.huggingface_provider(hf_key))
             logger.info("HuggingFace provider configured")
             
         # Local Ollama (free, runs locally)
         if os.getenv('USE_OLLAMA', 'false').lower() == 'true':
-            self.providers.append(OllamaProvider())
+            self.providers.append(self.ollama_provider())
             logger.info("Ollama provider configured")
             
+        for provider in self.providers:
+            self.health[type(provider).__name__] = ProviderHealth.from_env(type(provider).__name__)
+            
         if self.providers:
             self.current_provider = self.providers[0]
             logger.info(f"Using {type(self.current_provider).__name__} as primary provider")
         else:
             logger.warning("No LLM providers configured")
     
-    def generate_response(self, user_message: str) -> Optional[str]:
+    def _is_acceptable(self, response: Optional[str]) -> bool:
+        """Providers report their own failures as apology messages"""
+        return bool(response) and "I'm sorry" not in response
+    
+    def _health_for(self, provider: LLMProvider) -> ProviderHealth:
+        name = type(provider).__name__
+        if name not in self.health:
+            self.health[name] = ProviderHealth.from_env(name)
+        return self.health[name]
+    
+    def ranked_providers(self) -> List[LLMProvider]:
+        """Providers whose circuit is not open, fastest first when adaptive ordering is on"""
+        providers = [p for p in self.providers if self._health_for(p).breaker.state != OPEN]
+        if self.adaptive_order:
+            # Providers without latency samples keep their configured position
+            # ahead of measured ones so they get traffic and a measurement
+            def rank(provider):
+                p50 = self._health_for(provider).percentile(0.5)
+                return (p50 is not None, p50 or 0.0)
+            providers.sort(key=rank)
+        return providers
+    
+    def _finish_attempt(self, provider: LLMProvider, start: float, response: Optional[str],
+                        outcome: str = OK, permit: Optional[int] = None) -> Optional[str]:
+        """Record one call on the provider's breaker and latency metric; the response if acceptable"""
+        acceptable = self._is_acceptable(response)
+        elapsed = time.perf_counter() - start
+        self._health_for(provider).record(acceptable, elapsed, permit)
+        # Providers mostly apologise instead of raising; that answer is counted as rejected
+        if not acceptable and outcome == OK:
+            outcome = REJECTED
+        LLM_ATTEMPT_SECONDS.observe(elapsed, type(provider).__name__, outcome)
+        return response if acceptable else None
+    
+    def _finish_stream(self, provider: LLMProvider, start: float, success: bool, permit: Optional[int] = None):
+        """Record the outcome of a stream once it ended, failed or was abandoned by the consumer"""
+        elapsed = time.perf_counter() - start
+        self._health_for(provider).record(success, elapsed, permit)
+        LLM_ATTEMPT_SECONDS.observe(elapsed, type(provider).__name__, OK if success else ERROR)
+    
+    @staticmethod
+    def _hedges_due(done: int, failed: int) -> int:
+        """Providers to start after a wait: one when the hedge delay ran out, one per failed call,
+        even while other calls are still running"""
+        return failed if done else 1
+    
+    def _hedge_delay_for(self, provider: LLMProvider) -> float:
+        """How long to wait on a provider before starting the next one"""
+        if self.hedge_delay != 'p95':
+            return float(self.hedge_delay)
+        
+        health = self._health_for(provider)
+        if health.sample_count() < 10:
+            return self.default_hedge_delay
+        return health.percentile(0.95)
+    
+    def is_available(self) -> bool:
+        """Check if any LLM provider is available"""
+        return len(self.providers) > 0
+    
+    def health_snapshot(self) -> Dict[str, Any]:
+        """Breaker state and rolling latency percentiles per provider"""
+        snapshot = {}
+        for provider in self.providers:
+            snapshot[type(provider).__name__] = self._health_for(provider).snapshot()
+            usage = getattr(provider, 'usage', None)
+            if usage is not None:
+                snapshot[type(provider).__name__]['tokens'] = usage.snapshot()
+        return snapshot
+
+class LLMManager(BaseLLMManager):
+    """Manages multiple LLM providers with fallback"""
+    
+    def __init__(self):
+        self._executor = None
+        self._executor_pid = None
+        super().__init__()
+        
+    def generate_response(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> Optional[str]:
         """Generate response with fallback to other providers"""
-        if not self.providers:
-            return None
+        return self.generate_response_with_provider(user_message, history)[0]
+    
+    def generate_response_with_provider(self, user_message: str, history: Optional[List[Dict[str, str]]] = None
+                                        ) -> Tuple[Optional[str], Optional[str]]:
+        """Generate response with fallback, also returning the name of the provider that answered"""
+        providers = self.ranked_providers()
+        if not providers:
+            return None, None
+        
+        if self.dispatch_mode != 'sequential' and len(providers) > 1:
+            return self._generate_concurrently(user_message, providers, hedge=self.dispatch_mode == 'hedged',
+                                               history=history)
             
-        for provider in self.providers:
+        for provider in providers:
+            response = self._call_provider(provider, user_message, history)
+            if response:
+                return response, type(provider).__name__
+                
+        return None, None
+    
+    def stream_response_with_provider(self, user_message: str, history: Optional[List[Dict[str, str]]] = None
+                                      ) -> Tuple[Optional[Iterator[str]], Optional[str]]:
+        """Start streaming from the best available provider.
+        
+        Falls back to the next provider if one fails before producing any text.
+        Returns (chunk iterator, provider name), or (None, None) if nobody answered.
+        """
+        for provider in self.ranked_providers():
+            name = type(provider).__name__
+            permit = self._health_for(provider).breaker.allow_request()
+            if permit is None:
+                continue
+            
+            start = time.perf_counter()
             try:
-                response = provider.generate_response(user_message)
-                if response and "I'm sorry" not in response:
-                    return response
+                chunks = provider.stream_response(user_message, history)
+                first = next(chunks)
             except Exception as e:
-                logger.error(f"Provider {type(provider).__name__} failed: {e}")
+                # StopIteration included: an empty stream is a failure too
+                logger.error(f"Provider {name} failed to stream: {e!r}")
+                self._finish_stream(provider, start, False, permit)
                 continue
-                
-        return None
+            
+            return self._tracked_stream(provider, start, first, chunks, permit), name
+        
+        return None, None
     
-    def is_available(self) -> bool:
-        """Check if any LLM provider is available"""
-        return len(self.providers) > 0
+    def _tracked_stream(self, provider: LLMProvider, start: float, first: str,
+                        chunks: Iterator[str], permit: Optional[int] = None) -> Iterator[str]:
+        """Pass chunks through and record the provider's outcome when the stream ends"""
+        success = False
+        try:
+            yield first
+            yield from chunks
+            success = True
+        except GeneratorExit:
+            # The consumer stopped reading; not the provider's fault
+            success = True
+            raise
+        except Exception as e:
+            # Re-raised so the caller knows the text it has is incomplete
+            logger.error(f"Provider {type(provider).__name__} stream interrupted: {e}")
+            raise
+        finally:
+            self._finish_stream(provider, start, success, permit)
+    
+    def _call_provider(self, provider: LLMProvider, user_message: str,
+                       history: Optional[List[Dict[str, str]]] = None) -> Optional[str]:
+        """Call one provider, returning its response only if it is acceptable"""
+        name = type(provider).__name__
+        permit = self._health_for(provider).breaker.allow_request()
+        if permit is None:
+            logger.info(f"Skipping {name}: circuit open")
+            return None
+        
+        start = time.perf_counter()
+        try:
+            response = provider.generate_response(user_message, history)
+        except Exception as e:
+            logger.error(f"Provider {name} failed: {e}")
+            return self._finish_attempt(provider, start, None, ERROR, permit)
+        return self._finish_attempt(provider, start, response, permit=permit)
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Thread pool for concurrent provider calls (recreated after fork)"""
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=max(4, len(self.providers) * 4),
+                thread_name_prefix='llm'
+            )
+            self._executor_pid = os.getpid()
+        return self._executor
+    
+    def _generate_concurrently(self, user_message: str, providers: List[LLMProvider], hedge: bool,
+                               history: Optional[List[Dict[str, str]]] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Run providers concurrently and return the first acceptable response"""
+        executor = self._get_executor()
+        remaining = list(providers)
+        pending = {}
+        next_launch_at = None
+        
+        def launch():
+            nonlocal next_launch_at
+            provider = remaining.pop(0)
+            pending[executor.submit(self._call_provider, provider, user_message, history)] = provider
+            next_launch_at = time.monotonic() + self._hedge_delay_for(provider)
+        
+        launch()
+        while remaining and not hedge:
+            launch()
+        
+        while pending:
+            timeout = max(0.0, next_launch_at - time.monotonic()) if remaining else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            failed = 0
+            for future in done:
+                provider = pending.pop(future)
+                response = future.result()
+                if response:
+                    # Losing calls that have not started are cancelled; calls already
+                    # in flight finish in the background and their results are dropped
+                    for loser in pending:
+                        loser.cancel()
+                    return response, type(provider).__name__
+                failed += 1
+            
+            for _ in range(self._hedges_due(len(done), failed)):
+                if remaining:
+                    launch()
+        
+        return None, None
+    
+    def warm_up(self):
+        """Warm up every provider (connections, local models); failures are only logged"""
+        for provider in self.providers:
+            try:
+                provider.warm_up()
+                logger.info(f"Warmed up {type(provider).__name__}")
+            except Exception as e:
+                logger.warning(f"Warm-up failed for {type(provider).__name__}: {e}")
 
 # Example usage
 if __name__ == "__main__":
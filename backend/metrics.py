@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Latency histograms for the WhatsApp Medical Chatbot
+Each thread records into its own bucket counts, so an observation is a
+bisect and two increments with no lock; /metrics sums the per-thread counts
+and renders them in the Prometheus text exposition format. A thread's counts
+are folded into shared totals once the thread is gone
+"""
+
+import time
+import weakref
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; from sub-millisecond local predictions up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Outcome label values
+OK = 'ok'
+ERROR = 'error'
+REJECTED = 'rejected'
+CANCELLED = 'cancelled'
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_bound(bound: float) -> str:
+    return repr(float(bound))
+
+def _merge(totals: Dict[Tuple[str, ...], list], shard: Dict[Tuple[str, ...], list]):
+    """Add a shard's bucket counts and sums into totals"""
+    # dict() copies in one step, so a thread adding a label set cannot break the iteration
+    for labels, (counts, total) in dict(shard).items():
+        merged = totals.setdefault(labels, [[0] * len(counts), 0.0])
+        for i, count in enumerate(list(counts)):
+            merged[0][i] += count
+        merged[1] += total
+
+class Histogram:
+    """Labelled latency histogram with per-thread shards"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        # Live threads' shards by id: {label values: [bucket counts (last one is +Inf), sum]}
+        self._shards: Dict[int, Dict[Tuple[str, ...], list]] = {}
+        # Counts of threads that have exited
+        self._retired: Dict[Tuple[str, ...], list] = {}
+        # Reentrant: a finalizer can run from garbage collection while this thread holds it
+        self._shards_lock = threading.RLock()
+
+    def _new_shard(self) -> Dict[Tuple[str, ...], list]:
+        # Only taken once per thread
+        shard = {}
+        with self._shards_lock:
+            self._shards[id(shard)] = shard
+        self._local.shard = shard
+        # Thread-per-request servers start a thread for every request; folding each shard
+        # away when its thread object is freed keeps memory and collect() bounded
+        weakref.finalize(threading.current_thread(), self._retire, shard)
+        return shard
+
+    def _retire(self, shard: Dict[Tuple[str, ...], list]):
+        with self._shards_lock:
+            self._shards.pop(id(shard), None)
+            _merge(self._retired, shard)
+
+    def observe(self, value: float, *labels: str):
+        """Record one observation for the given label values (in labelnames order)"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        entry = shard.get(labels)
+        if entry is None:
+            entry = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def time(self, *labels: str) -> 'Timer':
+        """Context manager observing the time spent in its block"""
+        return Timer(self, labels)
+
+    def collect(self) -> Dict[Tuple[str, ...], Tuple[List[int], float]]:
+        """Bucket counts and sums per label set, summed over all threads"""
+        totals = {}
+        with self._shards_lock:
+            shards = list(self._shards.values())
+            _merge(totals, self._retired)
+        for shard in shards:
+            _merge(totals, shard)
+        return {labels: (counts, total) for labels, (counts, total) in totals.items()}
+
+    def shard_count(self) -> int:
+        """Shards of live threads that have recorded an observation"""
+        with self._shards_lock:
+            return len(self._shards)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.collect().items()):
+            pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_bound(bound)
+                bucket_pairs = pairs + [f'le="{le}"']
+                lines.append(f"{self.name}_bucket{{{','.join(bucket_pairs)}}} {cumulative}")
+            label_text = f"{{{','.join(pairs)}}}" if pairs else ''
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+class Timer:
+    """Observes elapsed time into a histogram; an outcome label (last) becomes `error` if the block raised"""
+
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = self.labels
+        if exc_type is not None and 'outcome' in self.histogram.labelnames:
+            labels = labels[:-1] + (ERROR,)
+        self.histogram.observe(time.perf_counter() - self.start, *labels)
+        return False
+
+# Request stages: parse, preprocess, vectorize, predict, twilio_send
+STAGE_SECONDS = Histogram(
+    'chatbot_stage_seconds', 'Time spent in each request stage', ('stage', 'outcome')
+)
+# One observation per provider call, including calls lost to a faster provider in hedged or race mode
+LLM_ATTEMPT_SECONDS = Histogram(
+    'chatbot_llm_attempt_seconds', 'Duration of each LLM provider attempt', ('provider', 'outcome')
+)
+REQUEST_SECONDS = Histogram(
+    'chatbot_request_seconds', 'End-to-end HTTP request duration', ('endpoint', 'status')
+)
+
+REGISTRY = (STAGE_SECONDS, LLM_ATTEMPT_SECONDS, REQUEST_SECONDS)
+
+def render_metrics() -> str:
+    """All histograms in the Prometheus text exposition format"""
+    lines = []
+    for histogram in REGISTRY:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Flat, memory-mapped model artifacts
+The vocabulary, IDF weights, forest tree arrays and retrieval matrix are stored
+as plain .npy/.txt files listed in a versioned manifest inside
+model_metadata.json. Workers map them read-only, so the pages are shared
+between processes instead of being unpickled into every worker
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from retrieval import RetrievalIndex, SegmentedIndex
+
+logger = logging.getLogger(__name__)
+
+# Version 2 adds retrieval segments appended by index_updates.py; version 3 moves the advice
+# texts of both engines into one shared, compressed answer store. Older manifests load unchanged
+ARTIFACT_FORMAT_VERSION = 3
+SUPPORTED_FORMAT_VERSIONS = (1, 2, 3)
+ARTIFACT_DIR = 'model_artifacts'
+METADATA_FILE = 'model_metadata.json'
+# Preset deflate dictionary for answer records; larger ones compress little better and cost more per record
+ANSWER_DICTIONARY_BYTES = 16384
+
+# Files written by retrieval appends rather than by a full save
+APPENDED_PREFIXES = ('retrieval_seg', 'retrieval_idf_r', 'retrieval_df_r', 'retrieval_norms_r')
+
+# TfidfVectorizer parameters that affect transform() and survive JSON
+VECTORIZER_PARAMS = (
+    'analyzer', 'binary', 'lowercase', 'ngram_range', 'norm', 'smooth_idf',
+    'stop_words', 'strip_accents', 'sublinear_tf', 'token_pattern', 'use_idf'
+)
+
+class ArtifactError(Exception):
+    """Raised when an artifact directory is missing, stale or corrupted"""
+
+def answer_dictionary(samples: List[bytes], size: int = ANSWER_DICTIONARY_BYTES) -> bytes:
+    """Preset dictionary from an even sample of answers, so phrasing they share is compressed by reference"""
+    if not samples:
+        return b''
+    mean_length = sum(len(sample) for sample in samples[:1000]) / min(len(samples), 1000)
+    step = max(1, int(len(samples) * mean_length / size))
+    return b''.join(samples[::step])[-size:]
+
+class AnswerEncoder:
+    """Deflates answers one record at a time against a preset dictionary"""
+
+    def __init__(self, zdict: bytes):
+        self.zdict = zdict
+        # Loading the dictionary is the expensive part of compressing a short record, so every record
+        # starts from a copy of one primed compressor
+        self._primed = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=zdict)
+
+    def encode(self, text: bytes) -> bytes:
+        compressor = self._primed.copy()
+        return compressor.compress(text) + compressor.flush()
+
+class AnswerStore:
+    """Read-only list of advice texts backed by one blob of records and an offsets array
+
+    Records are deflated against a shared dictionary (format 3) or plain UTF-8 when zdict is None"""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray, zdict: Optional[bytes] = None):
+        self._blob = blob
+        self._offsets = offsets
+        self._zdict = zdict
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        start, end = self._offsets[index], self._offsets[index + 1]
+        data = self._blob[start:end].tobytes()
+        if self._zdict is not None:
+            decompressor = zlib.decompressobj(-15, zdict=self._zdict)
+            data = decompressor.decompress(data) + decompressor.flush()
+        return data.decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
+
+class FlatForest:
+    """RandomForest predict() over concatenated tree arrays; classes map to ids in the answer store"""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], answers: AnswerStore, class_answers: np.ndarray,
+                 chunk_size: int = 256):
+        self.tree_roots = arrays['tree_roots']
+        self.children_left = arrays['children_left']
+        self.children_right = arrays['children_right']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        # Class distribution of each leaf as a CSR row; internal nodes have empty rows
+        self.leaf_indptr = arrays['leaf_indptr']
+        self.leaf_classes = arrays['leaf_classes']
+        self.leaf_values = arrays['leaf_values']
+        self.answers = answers
+        self.class_answers = class_answers
+        self.chunk_size = chunk_size
+
+    @property
+    def classes_(self) -> np.ndarray:
+        return np.asarray([self.answers[i] for i in self.class_answers], dtype=object)
+
+    def _leaves(self, X: np.ndarray) -> np.ndarray:
+        """Walk every tree for every query at once, one level per step"""
+        nodes = np.broadcast_to(self.tree_roots, (X.shape[0], len(self.tree_roots))).copy()
+        rows = np.arange(X.shape[0])[:, None]
+        while True:
+            left = self.children_left[nodes]
+            internal = left >= 0
+            if not internal.any():
+                return nodes
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(internal, np.where(go_left, left, self.children_right[nodes]), nodes)
+
+    def predict_proba(self, X: sp.spmatrix) -> np.ndarray:
+        """Mean leaf class distribution over trees, like RandomForestClassifier"""
+        X = sp.csr_matrix(X)
+        proba = np.zeros((X.shape[0], len(self.class_answers)), dtype=np.float64)
+        for start in range(0, X.shape[0], self.chunk_size):
+            # Trees split on float32 features, so compare in float32 like sklearn does
+            leaves = self._leaves(X[start:start + self.chunk_size].toarray().astype(np.float32))
+            starts = self.leaf_indptr[leaves.ravel()]
+            lengths = self.leaf_indptr[leaves.ravel() + 1] - starts
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            query_rows = np.repeat(np.repeat(np.arange(leaves.shape[0]), leaves.shape[1]), lengths)
+            np.add.at(proba, (start + query_rows, self.leaf_classes[positions]), self.leaf_values[positions])
+        return proba / len(self.tree_roots)
+
+    def predict_ids_with_scores(self, X: sp.spmatrix) -> Tuple[np.ndarray, np.ndarray]:
+        """Answer id of the most probable class and its probability for each query"""
+        proba = self.predict_proba(X)
+        best = proba.argmax(axis=1)
+        return np.asarray(self.class_answers)[best], proba[np.arange(len(best)), best]
+
+    def predict_with_scores(self, X: sp.spmatrix) -> Tuple[List[str], np.ndarray]:
+        """Most probable advice and its probability for each query"""
+        answer_ids, scores = self.predict_ids_with_scores(X)
+        return [self.answers[i] for i in answer_ids], scores
+
+    def predict(self, X: sp.spmatrix) -> np.ndarray:
+        return np.asarray(self.predict_with_scores(X)[0], dtype=object)
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _answer_arrays(answers) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Compressed answer records and their manifest entry"""
+    encoded = [str(answer).encode('utf-8') for answer in answers]
+    zdict = answer_dictionary(encoded)
+    encoder = AnswerEncoder(zdict)
+    records = [encoder.encode(text) for text in encoded]
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum([len(record) for record in records], out=offsets[1:])
+    arrays = {
+        'answers_blob': np.frombuffer(b''.join(records), dtype=np.uint8),
+        'answers_offsets': offsets,
+        'answers_zdict': np.frombuffer(zdict, dtype=np.uint8)
+    }
+    info = {
+        'n_answers': len(records),
+        'compression': 'deflate',
+        'bytes': int(offsets[-1]) + len(zdict),
+        'raw_bytes': sum(len(text) for text in encoded)
+    }
+    return arrays, info
+
+def _forest_arrays(model) -> Dict[str, np.ndarray]:
+    """Concatenate the estimators' node arrays, shifting child ids by each tree's offset"""
+    roots, left, right, feature, threshold = [], [], [], [], []
+    leaf_counts, leaf_classes, leaf_values = [], [], []
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left < 0
+        roots.append(offset)
+        left.append(np.where(is_leaf, -1, tree.children_left + offset))
+        right.append(np.where(is_leaf, -1, tree.children_right + offset))
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+
+        # Normalize leaf values (counts on older sklearn, fractions on newer) to class distributions
+        values = tree.value[:, 0, :]
+        values = values / np.maximum(values.sum(axis=1, keepdims=True), 1e-12)
+        values[~is_leaf] = 0.0
+        counts = np.count_nonzero(values, axis=1)
+        node_ids, class_ids = np.nonzero(values)
+        leaf_counts.append(counts)
+        leaf_classes.append(class_ids)
+        leaf_values.append(values[node_ids, class_ids])
+        offset += tree.node_count
+
+    leaf_indptr = np.zeros(offset + 1, dtype=np.int64)
+    np.cumsum(np.concatenate(leaf_counts), out=leaf_indptr[1:])
+    return {
+        'tree_roots': np.asarray(roots, dtype=np.int64),
+        'children_left': np.concatenate(left).astype(np.int64),
+        'children_right': np.concatenate(right).astype(np.int64),
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold).astype(np.float64),
+        'leaf_indptr': leaf_indptr,
+        'leaf_classes': np.concatenate(leaf_classes).astype(np.int32),
+        'leaf_values': np.concatenate(leaf_values).astype(np.float32)
+    }
+
+def _retrieval_arrays(index: RetrievalIndex, answer_ids: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    postings = index.postings
+    row_answers = np.asarray(index.row_answers) if answer_ids is None else answer_ids[index.row_answers]
+    # scipy wants indices and indptr of one dtype; a mismatch would copy the mapped arrays
+    index_dtype = np.int32 if postings.nnz < np.iinfo(np.int32).max else np.int64
+    # Row-major copy, read when an append has changed the IDF the rows were weighted with
+    rows = postings.T.tocsr()
+    return {
+        'postings_data': postings.data.astype(np.float32),
+        'postings_indices': postings.indices.astype(index_dtype),
+        'postings_indptr': postings.indptr.astype(index_dtype),
+        'rows_data': rows.data.astype(np.float32),
+        'rows_indices': rows.indices.astype(index_dtype),
+        'rows_indptr': rows.indptr.astype(index_dtype),
+        'row_answers': row_answers.astype(np.int32)
+    }
+
+def vectorizer_params(vectorizer: TfidfVectorizer) -> Dict[str, Any]:
+    """The JSON-serializable transform parameters stored in the manifest"""
+    params = vectorizer.get_params()
+    selected = {key: params[key] for key in VECTORIZER_PARAMS}
+    if isinstance(selected['stop_words'], (set, frozenset)):
+        selected['stop_words'] = sorted(selected['stop_words'])
+    return selected
+
+def build_vectorizer(params: Dict[str, Any], terms: List[str], idf: np.ndarray) -> TfidfVectorizer:
+    """A fitted TfidfVectorizer from manifest parameters, terms in column order and IDF weights"""
+    params = dict(params)
+    params['ngram_range'] = tuple(params['ngram_range'])
+    vectorizer = TfidfVectorizer(**params)
+    vectorizer.vocabulary_ = {term: column for column, term in enumerate(terms)}
+    vectorizer.idf_ = idf
+    return vectorizer
+
+class ArtifactWriter:
+    """Writes artifact files into ARTIFACT_DIR and publishes them with a manifest"""
+
+    def __init__(self, base_dir: str = '.'):
+        self.base_dir = base_dir
+        self.directory = os.path.join(base_dir, ARTIFACT_DIR)
+        os.makedirs(self.directory, exist_ok=True)
+        self.files = []
+
+    # Each file is written under a temporary name and renamed into place: a running
+    # bot may have the old file mapped, and truncating it in place would crash it
+    def _publish(self, name: str, tmp_path: str):
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        self.files.append(name)
+
+    def array(self, name: str, array: np.ndarray):
+        path = os.path.join(self.directory, f'{name}.npy.tmp')
+        with open(path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array), allow_pickle=False)
+        self._publish(f'{name}.npy', path)
+
+    def array_from_chunks(self, name: str, dtype, length: int, chunks):
+        """Write a 1-D .npy from an iterable of array chunks without holding the whole array"""
+        dtype = np.dtype(dtype)
+        path = os.path.join(self.directory, f'{name}.npy.tmp')
+        written = 0
+        with open(path, 'wb') as f:
+            np.lib.format.write_array_header_1_0(f, {
+                'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (length,)
+            })
+            for chunk in chunks:
+                chunk = np.ascontiguousarray(chunk, dtype=dtype)
+                chunk.tofile(f)
+                written += len(chunk)
+        if written != length:
+            os.remove(path)
+            raise ArtifactError(f"Artifact {name} expected {length} values, got {written}")
+        self._publish(f'{name}.npy', path)
+
+    def answers(self, answers, prefix: str = '') -> Dict[str, Any]:
+        """Write an answer store and return its manifest entry"""
+        arrays, info = _answer_arrays(answers)
+        for name, array in arrays.items():
+            self.array(f'{prefix}{name}', array)
+        return info
+
+    def retrieval(self, index: RetrievalIndex, prefix: str = 'retrieval_',
+                  answer_ids: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """Write one retrieval index and return its manifest entry
+
+        With answer_ids (index answer -> shared store id) its rows point into the shared store;
+        without, the index gets an answer store of its own (appended segments)"""
+        for name, array in _retrieval_arrays(index, answer_ids).items():
+            self.array(f'{prefix}{name}', array)
+        info = {'n_rows': int(index.postings.shape[1]), 'row_major': True}
+        if answer_ids is None:
+            info['answers'] = self.answers(index.answers, prefix)
+            info['default_answer'] = int(index.default_answer)
+        else:
+            info['default_answer'] = int(answer_ids[index.default_answer]) if len(answer_ids) else 0
+        return info
+
+    def vocabulary(self, terms: List[str]):
+        """Vocabulary in column order, one term per line (terms never contain newlines)"""
+        path = os.path.join(self.directory, 'vocab.txt.tmp')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(terms))
+        self._publish('vocab.txt', path)
+
+    def finish(self, n_features: int, params: Dict[str, Any], engines: Dict[str, Any],
+               metadata: Optional[Dict[str, Any]] = None, answers: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Checksum the written files and add their manifest to model_metadata.json"""
+        files = self._checksums()
+        manifest = {
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'directory': ARTIFACT_DIR,
+            'n_features': n_features,
+            'vectorizer': params,
+            'engines': engines,
+            'files': files
+        }
+        if answers is not None:
+            # Shared answer store (answers_*.npy) that both engines' answer ids point into
+            manifest['answers'] = answers
+        self._write_metadata(metadata, manifest)
+        # A full save replaces every appended segment (see index_updates.py)
+        for name in os.listdir(self.directory):
+            if name.startswith(APPENDED_PREFIXES) and name not in files:
+                os.remove(os.path.join(self.directory, name))
+        logger.info(f"Saved {len(files)} artifact files to {self.directory}")
+        return manifest
+
+    def update(self, manifest: Dict[str, Any], engines: Dict[str, Any], metadata: Dict[str, Any],
+               dropped: Tuple[str, ...] = ()) -> Dict[str, Any]:
+        """Publish the next revision of an existing manifest with the files written since"""
+        files = {name: entry for name, entry in manifest['files'].items() if name not in dropped}
+        files.update(self._checksums())
+        manifest = dict(manifest, format_version=ARTIFACT_FORMAT_VERSION, engines=engines, files=files,
+                        revision=manifest.get('revision', 0) + 1)
+        self._write_metadata(metadata, manifest)
+        logger.info(f"Published artifact revision {manifest['revision']} with {len(self.files)} new files")
+        return manifest
+
+    def _checksums(self) -> Dict[str, Dict[str, Any]]:
+        files = {}
+        for name in self.files:
+            path = os.path.join(self.directory, name)
+            files[name] = {'sha256': _sha256(path), 'bytes': os.path.getsize(path)}
+        return files
+
+    def _write_metadata(self, metadata: Optional[Dict[str, Any]], manifest: Dict[str, Any]):
+        metadata = dict(metadata or {})
+        metadata['artifacts'] = manifest
+        # Manifest goes last so a half-written directory is never referenced
+        metadata_path = os.path.join(self.base_dir, METADATA_FILE)
+        with open(metadata_path + '.tmp', 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(metadata_path + '.tmp', metadata_path)
+
+def save_artifacts(vectorizer: TfidfVectorizer, model=None, retrieval_index: Optional[RetrievalIndex] = None,
+                   metadata: Optional[Dict[str, Any]] = None, base_dir: str = '.',
+                   answers: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Write flat artifacts and add their manifest to model_metadata.json
+
+    A forest trained on integer answer ids needs `answers`, the advice text of each id"""
+    writer = ArtifactWriter(base_dir)
+    terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+    writer.vocabulary(terms)
+    writer.array('idf', vectorizer.idf_)
+    engines = {}
+    # Advice text -> id in the shared store; each distinct text is stored once for both engines
+    store: Dict[str, int] = {}
+
+    def answer_ids(texts) -> np.ndarray:
+        return np.array([store.setdefault(str(text), len(store)) for text in texts], dtype=np.int32)
+
+    if answers is not None:
+        answer_ids(answers)
+
+    if model is not None:
+        if model.classes_.dtype.kind in 'iu':
+            if answers is None:
+                raise ValueError("A forest trained on answer ids needs the answers list")
+            class_answers = model.classes_.astype(np.int32)
+        else:
+            class_answers = answer_ids(model.classes_)
+        for name, array in _forest_arrays(model).items():
+            writer.array(f'forest_{name}', array)
+        writer.array('forest_class_answers', class_answers)
+        engines['forest'] = {'n_trees': len(model.estimators_), 'n_classes': len(model.classes_)}
+
+    if retrieval_index is not None:
+        engines['retrieval'] = writer.retrieval(retrieval_index, answer_ids=answer_ids(retrieval_index.answers))
+
+    answers_info = writer.answers(list(store))
+    return writer.finish(len(terms), vectorizer_params(vectorizer), engines, metadata, answers=answers_info)
+
+def _mapped_answers(mapped, prefix: str, info: Optional[Dict[str, Any]]) -> AnswerStore:
+    # Stores written before format 3 have no manifest entry and are plain UTF-8
+    zdict = None
+    if info is not None and info.get('compression') == 'deflate':
+        zdict = mapped(f'{prefix}answers_zdict').tobytes()
+    return AnswerStore(mapped(f'{prefix}answers_blob'), mapped(f'{prefix}answers_offsets'), zdict)
+
+def _mapped_retrieval(mapped, prefix: str, n_features: int, info: Dict[str, Any],
+                      answers: AnswerStore) -> RetrievalIndex:
+    index = RetrievalIndex()
+    index.answers = answers
+    index.row_answers = mapped(f'{prefix}row_answers')
+    index.postings = sp.csr_matrix(
+        (mapped(f'{prefix}postings_data'), mapped(f'{prefix}postings_indices'), mapped(f'{prefix}postings_indptr')),
+        shape=(n_features, info['n_rows']), copy=False
+    )
+    if info.get('row_major'):
+        index.rows = sp.csr_matrix(
+            (mapped(f'{prefix}rows_data'), mapped(f'{prefix}rows_indices'), mapped(f'{prefix}rows_indptr')),
+            shape=(info['n_rows'], n_features), copy=False
+        )
+    index.default_answer = info['default_answer']
+    return index
+
+def read_manifest(base_dir: str = '.') -> Optional[Dict[str, Any]]:
+    """Artifact manifest from model_metadata.json, None if there is none"""
+    metadata_path = os.path.join(base_dir, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path) as f:
+        return json.load(f).get('artifacts')
+
+def load_artifacts(engine: str = 'forest', base_dir: str = '.', verify: bool = True):
+    """Memory-map the artifacts for one engine and return (model, vectorizer)"""
+    manifest = read_manifest(base_dir)
+    if manifest is None:
+        raise ArtifactError(f"No artifact manifest in {METADATA_FILE}")
+    if manifest.get('format_version') not in SUPPORTED_FORMAT_VERSIONS:
+        raise ArtifactError(f"Unsupported artifact format version {manifest.get('format_version')}")
+    if engine not in manifest['engines']:
+        raise ArtifactError(f"Artifacts have no {engine} engine")
+
+    directory = os.path.join(base_dir, manifest['directory'])
+    prefix = f'{engine}_'
+    needed = [name for name in manifest['files']
+              if not name.startswith(('forest_', 'retrieval_')) or name.startswith(prefix)]
+    for name in needed:
+        path = os.path.join(directory, name)
+        expected = manifest['files'][name]
+        if not os.path.exists(path) or os.path.getsize(path) != expected['bytes']:
+            raise ArtifactError(f"Artifact {name} is missing or has the wrong size")
+        if verify and _sha256(path) != expected['sha256']:
+            raise ArtifactError(f"Checksum mismatch for artifact {name}")
+
+    def mapped(name):
+        return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r', allow_pickle=False)
+
+    with open(os.path.join(directory, 'vocab.txt'), encoding='utf-8') as f:
+        terms = f.read().split('\n') if manifest['n_features'] else []
+
+    # Format 3 keeps one answer store for both engines; older manifests have one per engine
+    shared = manifest.get('answers')
+    answers = _mapped_answers(mapped, '', shared) if shared else _mapped_answers(mapped, prefix, None)
+    if engine == 'forest':
+        vectorizer = build_vectorizer(manifest['vectorizer'], terms, mapped('idf'))
+        class_answers = mapped('forest_class_answers') if shared else np.arange(len(answers))
+        model = FlatForest({name: mapped(f'forest_{name}') for name in (
+            'tree_roots', 'children_left', 'children_right', 'feature', 'threshold',
+            'leaf_indptr', 'leaf_classes', 'leaf_values')}, answers, class_answers)
+    else:
+        info = manifest['engines']['retrieval']
+        # Appends refresh the retrieval IDF in a file of its own; the forest keeps idf.npy
+        idf = mapped(info.get('idf', 'idf'))
+        vectorizer = build_vectorizer(manifest['vectorizer'], terms, idf)
+        model = _mapped_retrieval(mapped, 'retrieval_', manifest['n_features'], info, answers)
+        if info.get('segments'):
+            segments = [model] + [
+                _mapped_retrieval(mapped, segment['prefix'], manifest['n_features'], segment,
+                                  _mapped_answers(mapped, segment['prefix'], segment.get('answers')))
+                for segment in info['segments']
+            ]
+            scales = [None if name == info['idf'] else np.asarray(idf) / mapped(name)
+                      for name in ['idf'] + [segment['idf'] for segment in info['segments']]]
+            model = SegmentedIndex(segments, scales)
+
+    logger.info(f"Memory-mapped {engine} artifacts from {directory}")
+    return model, vectorizer
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Loading, validating and hot-swapping the local model
+A ModelBundle pairs a model with the vectorizer it was trained with, so request
+threads read both through one reference that a reload replaces atomically
+"""
+
+import os
+import time
+import fcntl
+import pickle
+import logging
+import functools
+import threading
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from model_artifacts import METADATA_FILE, ArtifactError, load_artifacts, read_manifest
+from metrics import OK, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SMOKE_TEST_MESSAGES = ['fever and headache', 'stomach pain and nausea']
+
+# Advice texts of the forest's answer ids when it is loaded from pickles
+ANSWERS_PATH = 'answers.pkl'
+
+# Distinct (answer id, suffix) strings kept ready per bundle; the common answers are a small set
+ADVICE_CACHE_SIZE = 4096
+
+class ModelBundle:
+    """A model and its vectorizer, loaded together and never mutated
+
+    Models predict answer ids; `answers` holds the advice text of each id and
+    `class_answers` the id of each class of a classifier"""
+
+    def __init__(self, model: Any, vectorizer: Any, engine: str, source: str,
+                 answers: Optional[Sequence[str]] = None, class_answers: Optional[np.ndarray] = None):
+        self.model = model
+        self.vectorizer = vectorizer
+        self.engine = engine
+        # 'artifacts' (memory-mapped) or 'pickle'
+        self.source = source
+        self.answers = answers if answers is not None else model.answers
+        self.class_answers = class_answers
+        # Replies are built from a cache of advice texts with the suffix already appended, so a
+        # common answer is decompressed and concatenated once rather than per request
+        self._advice = functools.lru_cache(maxsize=ADVICE_CACHE_SIZE)(self._render)
+        self.loaded_at = time.time()
+
+    def _render(self, answer_id: int, suffix: str) -> str:
+        return self.answers[answer_id] + suffix
+
+    def advice(self, answer_ids: Sequence[int], suffix: str = '') -> List[str]:
+        """Advice texts for answer ids, each followed by suffix"""
+        return [self._advice(int(answer_id), suffix) for answer_id in answer_ids]
+
+    def predict_ids_with_confidence(self, processed_messages: List[str]) -> Tuple[np.ndarray, List[float]]:
+        """Answer id plus a confidence per message: class probability (forest) or cosine similarity (retrieval)"""
+        with STAGE_SECONDS.time('vectorize', OK):
+            vectors = self.vectorizer.transform(processed_messages)
+        with STAGE_SECONDS.time('predict', OK):
+            if hasattr(self.model, 'predict_ids_with_scores'):
+                answer_ids, scores = self.model.predict_ids_with_scores(vectors)
+                return np.asarray(answer_ids), [float(score) for score in scores]
+            # Pickled RandomForestClassifier
+            proba = self.model.predict_proba(vectors)
+            best = proba.argmax(axis=1)
+            return self.class_answers[best], [float(proba[i, j]) for i, j in enumerate(best)]
+
+    def predict(self, processed_messages: List[str]) -> List[str]:
+        """Vectorize and predict preprocessed messages in one call"""
+        return self.predict_with_confidence(processed_messages)[0]
+
+    def predict_with_confidence(self, processed_messages: List[str]) -> Tuple[List[str], List[float]]:
+        """Advice plus a confidence per message"""
+        answer_ids, scores = self.predict_ids_with_confidence(processed_messages)
+        return self.advice(answer_ids), scores
+
+def _pickle_paths(engine: str) -> Tuple[str, ...]:
+    # MODEL_ENGINE=retrieval swaps the RandomForest for the nearest-neighbour index
+    if engine == 'retrieval':
+        return 'retrieval_index.pkl', 'vectorizer.pkl'
+    return 'medical_model.pkl', 'vectorizer.pkl', ANSWERS_PATH
+
+def load_bundle(engine: str, verify: bool = True) -> Optional[ModelBundle]:
+    """Load the model for an engine, None if no model files exist"""
+    # Flat artifacts are memory-mapped and shared between workers; pickles are the fallback
+    try:
+        if read_manifest() is not None:
+            model, vectorizer = load_artifacts(engine, verify=verify)
+            logger.info(f"Model artifacts mapped successfully ({engine} engine)")
+            return ModelBundle(model, vectorizer, engine, 'artifacts')
+    except (ArtifactError, OSError, ValueError) as e:
+        logger.warning(f"Could not load model artifacts, falling back to pickles: {e}")
+
+    model_path, vectorizer_path = _pickle_paths(engine)[:2]
+    if not (os.path.exists(model_path) and os.path.exists(vectorizer_path)):
+        return None
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    with open(vectorizer_path, 'rb') as f:
+        vectorizer = pickle.load(f)
+    logger.info(f"Model loaded successfully ({engine} engine)")
+    if engine == 'retrieval':
+        return ModelBundle(model, vectorizer, engine, 'pickle')
+    if model.classes_.dtype.kind in 'iu':
+        with open(ANSWERS_PATH, 'rb') as f:
+            answers = pickle.load(f)
+        return ModelBundle(model, vectorizer, engine, 'pickle', answers, model.classes_)
+    # Forests pickled before answer ids were trained on the advice texts themselves
+    return ModelBundle(model, vectorizer, engine, 'pickle', list(model.classes_), np.arange(len(model.classes_)))
+
+def smoke_test(bundle: ModelBundle):
+    """Raise unless the bundle answers a few sample messages with non-empty advice"""
+    predictions = bundle.predict(SMOKE_TEST_MESSAGES)
+    if len(predictions) != len(SMOKE_TEST_MESSAGES):
+        raise ValueError(f"Smoke test expected {len(SMOKE_TEST_MESSAGES)} predictions, got {len(predictions)}")
+    for prediction in predictions:
+        if not isinstance(prediction, str) or not prediction.strip():
+            raise ValueError(f"Smoke test got an empty or non-text prediction: {prediction!r}")
+
+def artifact_fingerprint(engine: str) -> Tuple:
+    """Size and mtime of the files a reload would read; changes when a new model is written"""
+    fingerprint = []
+    # Artifacts are written before the manifest, so the metadata file changes last
+    for path in (METADATA_FILE,) + _pickle_paths(engine):
+        try:
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            fingerprint.append((path, None, None))
+    return tuple(fingerprint)
+
+class ModelWatcher:
+    """Polls the model files and calls reload_fn once they change and settle"""
+
+    def __init__(self, engine: str, reload_fn: Callable[[], bool], interval: float = 5.0):
+        self.engine = engine
+        self.reload_fn = reload_fn
+        self.interval = interval
+        self._fingerprint = artifact_fingerprint(engine)
+        self._pid = None
+        self._lock = threading.Lock()
+        self._election_file = None
+
+    @classmethod
+    def from_env(cls, engine: str, reload_fn: Callable[[], bool]) -> Optional['ModelWatcher']:
+        """Build a watcher if MODEL_WATCH is enabled"""
+        if os.getenv('MODEL_WATCH', 'false').lower() != 'true':
+            return None
+        return cls(engine, reload_fn, interval=float(os.getenv('MODEL_WATCH_INTERVAL', '5')))
+
+    def start(self, election_path: Optional[str] = None):
+        """Start the polling thread in the current process (threads do not survive fork)
+
+        With election_path, only the process holding an exclusive lock on that file polls;
+        the others keep trying to take it, so one process watches as workers come and go"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, args=(election_path,), name='model-watcher', daemon=True).start()
+            self._pid = os.getpid()
+
+    def reset(self):
+        """Take the model files as they are now as the loaded ones"""
+        self._fingerprint = artifact_fingerprint(self.engine)
+
+    def _await_election(self, election_path: str):
+        election_file = open(election_path, 'a')
+        while True:
+            try:
+                fcntl.flock(election_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                time.sleep(self.interval)
+                continue
+            # Held until this process exits, which releases the lock for the next one
+            self._election_file = election_file
+            logger.info(f"Process {os.getpid()} watches the model files")
+            return
+
+    def _run(self, election_path: Optional[str] = None):
+        if election_path:
+            self._await_election(election_path)
+        while True:
+            time.sleep(self.interval)
+            fingerprint = artifact_fingerprint(self.engine)
+            if fingerprint == self._fingerprint:
+                continue
+            # Wait one more interval so a training run still writing files is not picked up halfway
+            time.sleep(self.interval)
+            settled = artifact_fingerprint(self.engine)
+            if settled != fingerprint:
+                continue
+            logger.info("Model files changed, reloading")
+            try:
+                reloaded = self.reload_fn()
+            except Exception as e:
+                logger.error(f"Model reload from watcher failed: {e}")
+                reloaded = False
+            # Only a successful reload settles the change; otherwise (a reload already running,
+            # files not loadable yet) the next poll still sees it as new and tries again
+            if reloaded:
+                self._fingerprint = settled
+            else:
+                logger.warning(f"Model reload did not complete, retrying in {self.interval}s")
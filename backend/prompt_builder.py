@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Prompt assembly for the LLM providers
+Builds the system prompt, conversation history and user message for chat and
+completion APIs within an input-token budget. The system prompt is counted and
+formatted once, history is trimmed oldest-first when over budget, and token
+usage is tracked per provider. Token counts are estimates, not a tokenizer's;
+the counts the APIs report are tracked next to them
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+def estimate_tokens(text: str) -> int:
+    """Estimated token count: four ASCII characters per token, one token per other character
+
+    English averages about four characters per token; accented, non-Latin and emoji
+    characters often take a token or more each, so they are counted one by one
+    and non-English text is over- rather than under-counted against the budget"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return max(1, ascii_chars // 4 + len(text) - ascii_chars)
+
+class Prompt:
+    """One assembled request: system prompt, trimmed history and the user message"""
+
+    def __init__(self, system: str, history: List[Dict[str, str]], user_message: str,
+                 input_tokens: int, trimmed_turns: int):
+        self.system = system
+        self.history = history
+        self.user_message = user_message
+        self.input_tokens = input_tokens
+        self.trimmed_turns = trimmed_turns
+
+    def chat_messages(self) -> List[Dict[str, str]]:
+        """History and the user message as chat-API messages (without the system prompt)"""
+        return [{'role': turn['role'], 'content': turn['content']} for turn in self.history] + [
+            {'role': 'user', 'content': self.user_message}
+        ]
+
+class PromptBuilder:
+    """Assembles prompts under LLM_MAX_INPUT_TOKENS, trimming history but never the system prompt"""
+
+    def __init__(self, system_prompt: str, max_input_tokens: int = 3000):
+        self.system_prompt = system_prompt
+        self.max_input_tokens = max_input_tokens
+        # The system prompt never changes, so its token count and text prefix are computed once
+        self.system_tokens = estimate_tokens(system_prompt)
+        self._text_prefix = f"{system_prompt}\n\n"
+
+    @classmethod
+    def from_env(cls, system_prompt: str) -> 'PromptBuilder':
+        return cls(system_prompt, max_input_tokens=int(os.getenv('LLM_MAX_INPUT_TOKENS', '3000')))
+
+    def build(self, user_message: str, history: Optional[List[Dict[str, Any]]] = None) -> Prompt:
+        """Keep the newest whole exchanges that fit next to the system prompt and user message"""
+        history = list(history or [])
+        user_tokens = estimate_tokens(user_message)
+        budget = self.max_input_tokens - self.system_tokens - user_tokens
+        kept = []
+        used = 0
+        # History comes in (user, assistant) pairs; drop whole exchanges from the oldest end
+        for end in range(len(history), 1, -2):
+            exchange = history[end - 2:end]
+            # Turns from the conversation store carry their token count already
+            cost = sum(turn.get('tokens') or estimate_tokens(turn['content']) for turn in exchange)
+            if used + cost > budget:
+                break
+            used += cost
+            kept[:0] = exchange
+        return Prompt(self.system_prompt, kept, user_message,
+                      input_tokens=self.system_tokens + used + user_tokens,
+                      trimmed_turns=len(history) - len(kept))
+
+    def text(self, prompt: Prompt) -> str:
+        """Single prompt string for completion APIs (Ollama, HuggingFace)"""
+        lines = [f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}" for turn in prompt.history]
+        lines.append(f"User: {prompt.user_message}")
+        lines.append("Assistant:")
+        return self._text_prefix + "\n".join(lines)
+
+class TokenUsage:
+    """Input-token counters for one provider: our estimate and what the API reported"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.estimated_input_tokens = 0
+        self.reported_input_tokens = 0
+        self.cached_input_tokens = 0
+        self.trimmed_turns = 0
+        self.last_input_tokens = None
+
+    def record(self, prompt: Prompt, reported: Optional[int] = None, cached: Optional[int] = None):
+        with self._lock:
+            self.requests += 1
+            self.estimated_input_tokens += prompt.input_tokens
+            self.trimmed_turns += prompt.trimmed_turns
+            self.last_input_tokens = reported if reported is not None else prompt.input_tokens
+            if reported is not None:
+                self.reported_input_tokens += reported
+            if cached:
+                self.cached_input_tokens += cached
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Totals and averages for the health endpoint"""
+        with self._lock:
+            requests = self.requests
+            return {
+                'requests': requests,
+                'estimated_input_tokens': self.estimated_input_tokens,
+                'reported_input_tokens': self.reported_input_tokens,
+                'cached_input_tokens': self.cached_input_tokens,
+                'mean_input_tokens': round(self.estimated_input_tokens / requests, 1) if requests else 0.0,
+                'last_input_tokens': self.last_input_tokens,
+                'trimmed_turns': self.trimmed_turns
+            }
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Health tracking for LLM providers
+Circuit breaker with closed/open/half-open states driven by error rate and
+latency over a sliding window, plus rolling latency percentiles
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import deque
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """Opens when too many recent calls failed or were too slow"""
+
+    def __init__(self, name: str, window_size: int = 20, min_calls: int = 5,
+                 error_threshold: float = 0.5, slow_call_seconds: float = 10.0,
+                 open_seconds: float = 30.0):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self._outcomes = deque(maxlen=window_size)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        # Every admitted call gets a new permit; the half-open probe is the call holding _probe
+        self._permits = 0
+        self._probe = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> Optional[int]:
+        """A permit for a call that may go through now, None if it may not (half-open lets a single probe through)
+
+        Pass the permit to record() or release(), so a call admitted before the breaker
+        tripped cannot settle or free the half-open probe"""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return None
+                self._state = HALF_OPEN
+                self._probe = None
+            if self._state == HALF_OPEN and self._probe is not None:
+                return None
+            self._permits += 1
+            if self._state == HALF_OPEN:
+                self._probe = self._permits
+            return self._permits
+
+    def record(self, success: bool, latency: float, permit: Optional[int] = None):
+        """Record the outcome of a call; slow successes count against the provider"""
+        bad = not success or latency > self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                # Only the probe decides; late outcomes of calls admitted earlier are dropped
+                if permit is None or permit != self._probe:
+                    return
+                self._probe = None
+                if bad:
+                    self._trip()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    logger.info(f"Circuit for {self.name} closed")
+                return
+
+            self._outcomes.append(bad)
+            if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+                if sum(self._outcomes) / len(self._outcomes) >= self.error_threshold:
+                    self._trip()
+
+    def release(self, permit: Optional[int]):
+        """Give back the half-open probe slot if this permit's call was the probe and ended without an outcome"""
+        with self._lock:
+            if self._state == HALF_OPEN and permit is not None and permit == self._probe:
+                self._probe = None
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        logger.warning(f"Circuit for {self.name} opened for {self.open_seconds}s")
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return sum(self._outcomes) / len(self._outcomes)
+
+class ProviderHealth:
+    """Breaker plus rolling success latencies for one provider"""
+
+    def __init__(self, name: str, breaker: CircuitBreaker, latency_window: int = 100):
+        self.name = name
+        self.breaker = breaker
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls, name: str) -> 'ProviderHealth':
+        """Build health tracking configured from LLM_BREAKER_* environment variables"""
+        breaker = CircuitBreaker(
+            name,
+            window_size=int(os.getenv('LLM_BREAKER_WINDOW', '20')),
+            min_calls=int(os.getenv('LLM_BREAKER_MIN_CALLS', '5')),
+            error_threshold=float(os.getenv('LLM_BREAKER_ERROR_RATE', '0.5')),
+            slow_call_seconds=float(os.getenv('LLM_BREAKER_SLOW_CALL', '10')),
+            open_seconds=float(os.getenv('LLM_BREAKER_OPEN_SECONDS', '30'))
+        )
+        return cls(name, breaker)
+
+    def record(self, success: bool, latency: float, permit: Optional[int] = None):
+        with self._lock:
+            self.calls += 1
+            if success:
+                self._latencies.append(latency)
+            else:
+                self.failures += 1
+        self.breaker.record(success, latency, permit)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Rolling success latency percentile in seconds, None without samples"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[int(q * (len(samples) - 1))]
+
+    def sample_count(self) -> int:
+        with self._lock:
+            return len(self._latencies)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """State and latency percentiles for the health endpoint"""
+        with self._lock:
+            calls, failures = self.calls, self.failures
+        return {
+            'state': self.breaker.state,
+            'calls': calls,
+            'failures': failures,
+            'window_error_rate': round(self.breaker.error_rate(), 3),
+            'latency_p50': self.percentile(0.50),
+            'latency_p95': self.percentile(0.95),
+            'latency_p99': self.percentile(0.99)
+        }
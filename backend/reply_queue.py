@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Background reply delivery for the WhatsApp webhook
+Lets the webhook acknowledge Twilio immediately while a bounded pool of
+worker threads runs inference and sends the outbound message
+"""
+
+import os
+import queue
+import threading
+import logging
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_POLICIES = ('reject', 'drop_oldest', 'block')
+
+class ReplyWorkerPool:
+    """Bounded job queue drained by a fixed number of worker threads"""
+
+    def __init__(self, handler: Callable[..., Any], workers: int = 4, queue_size: int = 100,
+                 backpressure: str = 'reject', block_timeout: float = 1.0):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {backpressure}")
+
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'dropped': 0}
+
+    @classmethod
+    def from_env(cls, handler: Callable[..., Any]) -> 'ReplyWorkerPool':
+        """Build a pool configured from REPLY_* environment variables"""
+        return cls(
+            handler,
+            workers=int(os.getenv('REPLY_WORKERS', '4')),
+            queue_size=int(os.getenv('REPLY_QUEUE_SIZE', '100')),
+            backpressure=os.getenv('REPLY_BACKPRESSURE', 'reject').lower(),
+            block_timeout=float(os.getenv('REPLY_BLOCK_TIMEOUT', '1.0'))
+        )
+
+    def _ensure_started(self):
+        """Start the worker threads in the current process"""
+        # Threads do not survive fork, so a pool created before Gunicorn
+        # forks its workers is (re)started on first use in each worker
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"reply-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+            logger.info(f"Started {self.workers} reply workers (queue size {self.queue_size}, {self.backpressure})")
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def submit(self, *args: Any) -> bool:
+        """Queue a job; returns False if it was rejected by the backpressure policy"""
+        self._ensure_started()
+
+        try:
+            if self.backpressure == 'block':
+                self._queue.put(args, timeout=self.block_timeout)
+            elif self.backpressure == 'drop_oldest':
+                while True:
+                    try:
+                        self._queue.put_nowait(args)
+                        break
+                    except queue.Full:
+                        try:
+                            self._queue.get_nowait()
+                            self._queue.task_done()
+                            self._count('dropped')
+                            logger.warning("Reply queue full, dropped oldest job")
+                        except queue.Empty:
+                            pass
+            else:
+                self._queue.put_nowait(args)
+        except queue.Full:
+            self._count('rejected')
+            logger.warning("Reply queue full, rejecting job")
+            return False
+
+        self._count('submitted')
+        return True
+
+    def _run(self):
+        """Worker loop: run the handler for each queued job"""
+        while True:
+            job = self._queue.get()
+            try:
+                self.handler(*job)
+                self._count('completed')
+            except Exception as e:
+                self._count('failed')
+                logger.error(f"Reply worker failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current configuration, queue depth and counters"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats.update({
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'backpressure': self.backpressure
+        })
+        return stats
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Response cache for the WhatsApp Medical Chatbot
+Caches generated advice keyed on the normalized user query, with an
+in-process LRU backend and a SQLite backend shared between workers
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """Base class for response caches with LRU/TTL eviction and counters"""
+
+    backend_name = 'none'
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._stats_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """Return (response, backend) for a cached query, or None"""
+        raise NotImplementedError
+
+    def set(self, key: str, response: str, backend: str):
+        """Store a response and the backend that produced it"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Drop all cached entries"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and configuration for the health endpoint"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats.update({
+            'backend': self.backend_name,
+            'entries': len(self),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl
+        })
+        return stats
+
+class MemoryResponseCache(ResponseCache):
+    """In-process LRU cache (one per worker process)"""
+
+    backend_name = 'memory'
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        super().__init__(max_entries, ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[2], now):
+                del self._entries[key]
+                self._count('evictions')
+                entry = None
+            if entry is None:
+                self._count('misses')
+                return None
+            self._entries.move_to_end(key)
+        self._count('hits')
+        return entry[0], entry[1]
+
+    def set(self, key: str, response: str, backend: str):
+        with self._lock:
+            self._entries[key] = (response, backend, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._count('evictions')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SQLiteResponseCache(ResponseCache):
+    """On-disk cache shared by every worker process on the host"""
+
+    backend_name = 'sqlite'
+
+    # Inserts between size checks; COUNT(*) scans the table, and workers share it so no
+    # process can keep a running count. The table may exceed max_entries by this much per worker
+    EVICT_EVERY = 64
+
+    def __init__(self, path: str = 'response_cache.db', max_entries: int = 10000, ttl: float = 3600):
+        super().__init__(max_entries, ttl)
+        self.path = path
+        self.evict_every = max(1, min(self.EVICT_EVERY, self.max_entries // 10))
+        self._inserts = 0
+        self._local = threading.local()
+        self._connection().execute(
+            """CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed_at)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread, reopened after fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT response, backend, created_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self._expired(row[2], now):
+                conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._count('evictions')
+                row = None
+            if row is None:
+                self._count('misses')
+                return None
+            conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logger.error(f"Response cache read error: {e}")
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        return row[0], row[1]
+
+    def set(self, key: str, response: str, backend: str):
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?)",
+                (key, response, backend, now, now)
+            )
+            with self._stats_lock:
+                self._inserts += 1
+                due = self._inserts % self.evict_every == 0
+            if not due:
+                return
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    """DELETE FROM response_cache WHERE key IN (
+                        SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?
+                    )""",
+                    (excess,)
+                )
+                self._count('evictions', excess)
+        except sqlite3.Error as e:
+            logger.error(f"Response cache write error: {e}")
+
+    def clear(self):
+        try:
+            self._connection().execute("DELETE FROM response_cache")
+        except sqlite3.Error as e:
+            logger.error(f"Response cache clear error: {e}")
+
+    def __len__(self) -> int:
+        try:
+            return self._connection().execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+def create_response_cache() -> Optional[ResponseCache]:
+    """Build the response cache selected by RESPONSE_CACHE (memory, sqlite or none)"""
+    backend = os.getenv('RESPONSE_CACHE', 'memory').lower()
+    max_entries = int(os.getenv('RESPONSE_CACHE_SIZE', '1024'))
+    ttl = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+
+    if backend == 'memory':
+        return MemoryResponseCache(max_entries, ttl)
+    if backend == 'sqlite':
+        path = os.getenv('RESPONSE_CACHE_PATH', 'response_cache.db')
+        return SQLiteResponseCache(path, max_entries, ttl)
+    if backend != 'none':
+        logger.warning(f"Unknown RESPONSE_CACHE backend '{backend}', caching disabled")
+    return None
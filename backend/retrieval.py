@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Nearest-neighbour retrieval engine for medical advice
+Keeps the TF-IDF matrix of training symptoms and answers with the advice of the
+most similar rows, instead of a RandomForest whose classes are the advice texts
+"""
+
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+logger = logging.getLogger(__name__)
+
+def row_norms(postings: sp.csr_matrix, scale: np.ndarray, block: int = 1 << 22) -> np.ndarray:
+    """L2 norm of every indexed row of a term-major postings matrix once term t is weighted by scale[t]"""
+    n_rows = postings.shape[1]
+    squares = np.zeros(n_rows)
+    # Postings are walked in blocks so memory stays bounded on large memory-mapped indexes
+    for start in range(0, postings.nnz, block):
+        end = min(start + block, postings.nnz)
+        terms = np.searchsorted(postings.indptr, np.arange(start, end), side='right') - 1
+        weights = postings.data[start:end] * scale[terms]
+        squares += np.bincount(postings.indices[start:end], weights=weights * weights, minlength=n_rows)
+    return np.sqrt(squares).astype(np.float32)
+
+class RetrievalIndex:
+    """Sparse dot-product index over L2-normalized TF-IDF rows"""
+
+    def __init__(self, chunk_size: int = 256):
+        # Queries are scored in chunks to bound the size of the score matrix
+        self.chunk_size = chunk_size
+        self.answers = []
+        self.row_answers = None
+        self.postings = None
+        # Row-major copy of the postings, mapped from artifacts that have one
+        self.rows = None
+        self.default_answer = 0
+
+    def fit(self, X: sp.spmatrix, y) -> 'RetrievalIndex':
+        """Index TF-IDF rows X with their advice texts y"""
+        answers, row_answers = np.unique(np.asarray(y, dtype=object), return_inverse=True)
+        self.answers = list(answers)
+        self.row_answers = row_answers.astype(np.int32)
+        # Term-major (inverted) layout: a query only touches the posting lists of its own terms
+        self.postings = normalize(sp.csr_matrix(X, dtype=np.float32)).T.tocsr()
+        # Queries that share no term with any row get the most common advice
+        self.default_answer = int(np.bincount(self.row_answers).argmax()) if len(self.row_answers) else 0
+        logger.info(f"Indexed {X.shape[0]} rows with {len(self.answers)} distinct answers")
+        return self
+
+    @property
+    def classes_(self) -> np.ndarray:
+        """Distinct advice texts, mirroring the classifier attribute"""
+        return np.asarray(self.answers, dtype=object)
+
+    def kneighbors(self, X: sp.spmatrix, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Row indices and cosine similarities of the k nearest indexed rows per query"""
+        return self._nearest(normalize(sp.csr_matrix(X, dtype=np.float32)), k)
+
+    def _nearest(self, queries: sp.csr_matrix, k: int,
+                 renormalized: Optional['RenormalizedRows'] = None) -> Tuple[np.ndarray, np.ndarray]:
+        n_rows = self.postings.shape[1]
+        k = min(k, n_rows)
+        indices = np.zeros((queries.shape[0], k), dtype=np.int64)
+        scores = np.zeros((queries.shape[0], k), dtype=np.float32)
+
+        for start in range(0, queries.shape[0], self.chunk_size):
+            chunk = (queries[start:start + self.chunk_size] @ self.postings).tocsr()
+            for i in range(chunk.shape[0]):
+                # Only rows sharing a term with the query have non-zero scores
+                row_start, row_end = chunk.indptr[i], chunk.indptr[i + 1]
+                if row_start == row_end:
+                    continue
+                data = chunk.data[row_start:row_end]
+                columns = chunk.indices[row_start:row_end]
+                if renormalized is not None:
+                    columns, data = renormalized.rescore(columns, data, k)
+                top = np.argpartition(-data, k - 1)[:k] if len(data) > k else np.arange(len(data))
+                top = top[np.argsort(-data[top], kind='stable')]
+                indices[start + i, :len(top)] = columns[top]
+                scores[start + i, :len(top)] = data[top]
+
+        return indices, scores
+
+    def predict_ids_with_scores(self, X: sp.spmatrix) -> Tuple[np.ndarray, np.ndarray]:
+        """Answer id of the nearest row and its similarity for each query"""
+        indices, scores = self.kneighbors(X, k=1)
+        answer_ids = np.where(scores[:, 0] > 0, self.row_answers[indices[:, 0]], self.default_answer)
+        return answer_ids, scores[:, 0]
+
+    def predict_with_scores(self, X: sp.spmatrix) -> Tuple[List[str], np.ndarray]:
+        """Advice of the nearest row and its similarity for each query"""
+        answer_ids, scores = self.predict_ids_with_scores(X)
+        return [self.answers[i] for i in answer_ids], scores
+
+    def predict(self, X: sp.spmatrix) -> np.ndarray:
+        """Same contract as RandomForestClassifier.predict: one advice text per query"""
+        return np.asarray(self.predict_with_scores(X)[0], dtype=object)
+
+    def top_k(self, X: sp.spmatrix, k: int = 3) -> List[List[Tuple[str, float]]]:
+        """Up to k distinct (advice, similarity) pairs per query, best first"""
+        indices, scores = self.kneighbors(X, k=k)
+        results = []
+        for row_indices, row_scores in zip(indices, scores):
+            seen = {}
+            for index, score in zip(row_indices, row_scores):
+                if score <= 0:
+                    break
+                answer = self.answers[self.row_answers[index]]
+                if answer not in seen:
+                    seen[answer] = float(score)
+            results.append(list(seen.items()))
+        return results
+
+class RenormalizedRows:
+    """Cosine scores under the current IDF for rows stored with the weights of an older one
+
+    A row's length under the current IDF is |w * scale|, which lies between the smallest and
+    largest scale. Only rows whose bounded score can still reach the top k get their exact
+    length, from the row-major copy of the postings; lengths are kept once computed"""
+
+    def __init__(self, scale: np.ndarray, postings: sp.csr_matrix, rows: Optional[sp.csr_matrix] = None):
+        self.scale = scale.astype(np.float32)
+        self.low, self.high = float(self.scale.min()), float(self.scale.max())
+        self.postings = postings
+        self.rows = rows
+        self.lengths = None
+
+    def rescore(self, columns: np.ndarray, dots: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact cosines of the rows that may rank in the top k, given their dot products with the scaled query"""
+        if len(dots) > k:
+            # A row whose highest possible score is below the k-th best lowest possible score cannot rank
+            floor = np.partition(dots, len(dots) - k)[len(dots) - k] / self.high
+            keep = dots >= floor * self.low * (1 - 1e-6)
+            columns, dots = columns[keep], dots[keep]
+        return columns, dots / self._lengths(columns)
+
+    def _lengths(self, columns: np.ndarray) -> np.ndarray:
+        if self.lengths is None:
+            # Artifacts without a row-major copy get every row's length on the first query
+            self.lengths = (row_norms(self.postings, self.scale) if self.rows is None
+                            else np.full(self.postings.shape[1], np.nan, dtype=np.float32))
+        lengths = self.lengths[columns]
+        missing = np.isnan(lengths)
+        if missing.any():
+            # Candidates share a term with the query, so none of their rows is empty
+            rows = self.rows[columns[missing]]
+            weights = rows.data * self.scale[rows.indices]
+            lengths[missing] = np.sqrt(np.add.reduceat(weights * weights, rows.indptr[:-1]))
+            self.lengths[columns[missing]] = lengths[missing]
+        return lengths
+
+class ChainedAnswers:
+    """Answer lists of several segments read as one, ids numbered segment after segment"""
+
+    def __init__(self, stores: List):
+        self.stores = stores
+        self.offsets = np.cumsum([0] + [len(store) for store in stores])
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index: int) -> str:
+        position = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        return self.stores[position][index - self.offsets[position]]
+
+class SegmentedIndex:
+    """A base index plus segments appended later, searched as one index"""
+
+    def __init__(self, segments: List[RetrievalIndex], query_scales: List[Optional[np.ndarray]]):
+        self.segments = segments
+        # Each segment keeps the TF-IDF weights it was built with. Scaling the query by
+        # current IDF / segment IDF re-weights its rows to the current IDF, and dividing
+        # by the rows' lengths under that IDF turns the products back into cosines, so
+        # scores stay in [0, 1] and segments of different ages rank alike
+        self.query_scales = [None if scale is None else sp.diags(scale.astype(np.float32)) for scale in query_scales]
+        self.renormalized = [None if scale is None else RenormalizedRows(scale, segment.postings, segment.rows)
+                             for segment, scale in zip(segments, query_scales)]
+        self.offsets = np.cumsum([0] + [segment.postings.shape[1] for segment in segments])
+        self.chunk_size = segments[0].chunk_size
+        # Every segment has an answer store of its own; ids count on from the previous segment's
+        self.answers = ChainedAnswers([segment.answers for segment in segments])
+        self.default_answer = segments[0].default_answer
+
+    @property
+    def classes_(self) -> np.ndarray:
+        return np.asarray([self.answers[i] for i in range(len(self.answers))], dtype=object)
+
+    def _answer_id(self, row: int) -> int:
+        position = int(np.searchsorted(self.offsets, row, side='right')) - 1
+        segment = self.segments[position]
+        return int(self.answers.offsets[position] + segment.row_answers[row - self.offsets[position]])
+
+    def _answer(self, row: int) -> str:
+        return self.answers[self._answer_id(row)]
+
+    def kneighbors(self, X: sp.spmatrix, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Global row indices (segments in order) and similarities of the k nearest rows per query"""
+        queries = normalize(sp.csr_matrix(X, dtype=np.float32))
+        all_indices, all_scores = [], []
+        for segment, scale, renormalized, offset in zip(self.segments, self.query_scales, self.renormalized, self.offsets):
+            indices, scores = segment._nearest(queries if scale is None else (queries @ scale).tocsr(), k, renormalized)
+            all_indices.append(indices + offset)
+            all_scores.append(scores)
+        indices = np.hstack(all_indices)
+        scores = np.hstack(all_scores)
+        top = np.argsort(-scores, axis=1, kind='stable')[:, :min(k, scores.shape[1])]
+        return np.take_along_axis(indices, top, axis=1), np.take_along_axis(scores, top, axis=1)
+
+    def predict_ids_with_scores(self, X: sp.spmatrix) -> Tuple[np.ndarray, np.ndarray]:
+        indices, scores = self.kneighbors(X, k=1)
+        answer_ids = np.array([self._answer_id(row) if score > 0 else self.default_answer
+                               for row, score in zip(indices[:, 0], scores[:, 0])], dtype=np.int64)
+        return answer_ids, scores[:, 0]
+
+    def predict_with_scores(self, X: sp.spmatrix) -> Tuple[List[str], np.ndarray]:
+        answer_ids, scores = self.predict_ids_with_scores(X)
+        return [self.answers[i] for i in answer_ids], scores
+
+    def predict(self, X: sp.spmatrix) -> np.ndarray:
+        return np.asarray(self.predict_with_scores(X)[0], dtype=object)
+
+    def top_k(self, X: sp.spmatrix, k: int = 3) -> List[List[Tuple[str, float]]]:
+        indices, scores = self.kneighbors(X, k=k)
+        results = []
+        for row_indices, row_scores in zip(indices, scores):
+            seen = {}
+            for index, score in zip(row_indices, row_scores):
+                if score <= 0:
+                    break
+                answer = self._answer(index)
+                if answer not in seen:
+                    seen[answer] = float(score)
+            results.append(list(seen.items()))
+        return results
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tiered routing between the local model and the LLMs
+The local model answers first; only questions it is unsure about (confidence
+below a threshold) are escalated to the LLM providers. Per-tier counts and
+latencies show how much traffic each tier absorbs
+"""
+
+import os
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+# Tiers a request can be answered by
+CACHE_TIER = 'cache'
+LOCAL_TIER = 'local'
+LLM_TIER = 'llm'
+LOCAL_FALLBACK_TIER = 'local_fallback'
+TIERS = (CACHE_TIER, LOCAL_TIER, LLM_TIER, LOCAL_FALLBACK_TIER)
+
+def _percentile(samples, q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[int(q * (len(ordered) - 1))]
+
+class TieredRouter:
+    """Confidence threshold for the local tier plus per-tier statistics"""
+
+    def __init__(self, enabled: bool = False, threshold: float = 0.5, window: int = 1000):
+        self.enabled = enabled
+        self.threshold = threshold
+        self._counts = {tier: 0 for tier in TIERS}
+        self._latencies = {tier: deque(maxlen=window) for tier in TIERS}
+        # Local confidences, to help pick a threshold for the current engine
+        self._confidences = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'TieredRouter':
+        """Configured from TIERED_ROUTING and LOCAL_CONFIDENCE_THRESHOLD"""
+        return cls(
+            enabled=os.getenv('TIERED_ROUTING', 'false').lower() == 'true',
+            threshold=float(os.getenv('LOCAL_CONFIDENCE_THRESHOLD', '0.5'))
+        )
+
+    def is_confident(self, confidence: float) -> bool:
+        """Whether a local answer is good enough to skip the LLM"""
+        with self._lock:
+            self._confidences.append(float(confidence))
+        return confidence >= self.threshold
+
+    def record(self, tier: str, latency: float):
+        with self._lock:
+            self._counts[tier] += 1
+            self._latencies[tier].append(latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Hit rate and latency percentiles (ms) per tier for the health endpoint"""
+        with self._lock:
+            counts = dict(self._counts)
+            latencies = {tier: list(samples) for tier, samples in self._latencies.items()}
+            confidences = list(self._confidences)
+        total = sum(counts.values())
+        tiers = {}
+        for tier in TIERS:
+            p50 = _percentile(latencies[tier], 0.50)
+            p95 = _percentile(latencies[tier], 0.95)
+            tiers[tier] = {
+                'requests': counts[tier],
+                'hit_rate': round(counts[tier] / total, 3) if total else 0.0,
+                'latency_ms_p50': round(p50 * 1000, 2) if p50 is not None else None,
+                'latency_ms_p95': round(p95 * 1000, 2) if p95 is not None else None
+            }
+        return {
+            'enabled': self.enabled,
+            'threshold': self.threshold,
+            'local_confidence_p50': _percentile(confidences, 0.50),
+            'tiers': tiers
+        }
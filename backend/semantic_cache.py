@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Semantic near-duplicate cache for LLM answers
+Reuses a stored answer when a new query's TF-IDF vector is close enough
+(cosine similarity) to a previously answered one
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """Fixed-capacity store of (query vector, answer) pairs with vectorized lookup
+
+    Each slot holds its row's term indices and weights in preallocated arrays, padded
+    with zero weights, so an add overwrites one slot in place and a lookup is one gather"""
+
+    def __init__(self, threshold: float = 0.9, capacity: int = 1000, row_width: int = 32):
+        self.threshold = threshold
+        self.capacity = max(1, capacity)
+        self._indices = np.zeros((self.capacity, row_width), dtype=np.int32)
+        self._weights = np.zeros((self.capacity, row_width), dtype=np.float32)
+        self._responses = [None] * self.capacity
+        self._backends = [None] * self.capacity
+        self._last_used = np.full(self.capacity, -np.inf)
+        self._size = 0
+        self._n_features = None
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @classmethod
+    def from_env(cls) -> Optional['SemanticCache']:
+        """Build the cache if SEMANTIC_CACHE is enabled"""
+        if os.getenv('SEMANTIC_CACHE', 'false').lower() != 'true':
+            return None
+        return cls(
+            threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9')),
+            capacity=int(os.getenv('SEMANTIC_CACHE_SIZE', '1000'))
+        )
+
+    def get(self, query_vector: sp.spmatrix) -> Optional[Tuple[str, str, float]]:
+        """Return (response, backend, similarity) of the nearest stored query above the threshold"""
+        if query_vector.nnz == 0:
+            # Nothing to match on, but still a lookup that missed
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+
+        query = normalize(sp.csr_matrix(query_vector)).toarray().ravel().astype(np.float32)
+        with self._lock:
+            if self._size == 0 or self._n_features != len(query):
+                # Empty, or the vectorizer changed since these entries were stored
+                self.stats['misses'] += 1
+                return None
+
+            similarities = (query[self._indices] * self._weights).sum(axis=1)
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.stats['misses'] += 1
+                return None
+
+            self._last_used[best] = time.monotonic()
+            self.stats['hits'] += 1
+            return self._responses[best], self._backends[best], similarity
+
+    def add(self, query_vector: sp.spmatrix, response: str, backend: str):
+        """Store an answer, evicting the least recently used entry when full"""
+        if query_vector.nnz == 0:
+            return
+
+        row = normalize(sp.csr_matrix(query_vector))
+        row.sum_duplicates()
+        with self._lock:
+            if self._n_features != row.shape[1]:
+                self._clear()
+                self._n_features = row.shape[1]
+            if row.nnz > self._indices.shape[1]:
+                # Rare long message: widen every slot once rather than truncating the row
+                pad = ((0, 0), (0, row.nnz - self._indices.shape[1]))
+                self._indices = np.pad(self._indices, pad)
+                self._weights = np.pad(self._weights, pad)
+
+            slot = int(np.argmin(self._last_used))
+            if self._responses[slot] is not None:
+                self.stats['evictions'] += 1
+            else:
+                self._size += 1
+
+            self._indices[slot] = 0
+            self._weights[slot] = 0
+            self._indices[slot, :row.nnz] = row.indices
+            self._weights[slot, :row.nnz] = row.data
+            self._responses[slot] = response
+            self._backends[slot] = backend
+            self._last_used[slot] = time.monotonic()
+
+    def _clear(self):
+        self._indices[:] = 0
+        self._weights[:] = 0
+        self._responses = [None] * self.capacity
+        self._backends = [None] * self.capacity
+        self._last_used[:] = -np.inf
+        self._size = 0
+
+    def clear(self):
+        """Drop all stored answers"""
+        with self._lock:
+            self._clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and configuration for the health endpoint"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({
+                'entries': self._size,
+                'capacity': self.capacity,
+                'threshold': self.threshold
+            })
+        return stats
@@ -9,6 +9,7 @@ import logging
 from flask import Flask, request, jsonify
 from twilio.rest import Client
 from dotenv import load_dotenv
+from keyword_matcher import KeywordMatcher
 
 # Load environment variables
 load_dotenv()
@@ -19,71 +20,17 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-class SimpleMedicalChatbot:
-    def __init__(self):
-        # Simple rule-based responses
-        self.responses = {
-            'fever': """For fever:
-• Rest and stay hydrated
-• Take paracetamol/acetaminophen as directed
-• Monitor temperature regularly
-• Seek medical help if fever >39°C (102°F) or persists >3 days
-
-⚠️ DISCLAIMER: This is general information only. Consult a healthcare professional for proper medical advice.""",
-            
-            'headache': """For headaches:
-• Rest in a quiet, dark room
-• Apply cold/warm compress
-• Stay hydrated
-• Consider over-the-counter pain relief
-• Avoid triggers like stress, certain foods
-
-⚠️ DISCLAIMER: Severe or persistent headaches require medical evaluation.""",
-            
-            'stomach': """For stomach issues:
-• Eat bland foods (rice, toast, bananas)
-• Stay hydrated with small sips
-• Avoid dairy, spicy, or fatty foods
-• Consider probiotics
-• Rest and avoid stress
-
-⚠️ DISCLAIMER: Persistent stomach problems need medical attention.""",
-            
-            'cough': """For cough:
-• Stay hydrated
-• Use honey (for adults)
-• Humidify the air
-• Avoid irritants like smoke
-• Rest your voice
+# Keyword -> response rules; extend the JSON file to add keywords or categories
+RULES_FILE = os.getenv('RULES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'medical_rules.json'))
 
-⚠️ DISCLAIMER: Persistent cough or breathing difficulties require immediate medical care.""",
-            
-            'default': """I understand you're not feeling well. Here are some general health tips:
-
-• Stay hydrated
-• Get adequate rest
-• Eat nutritious foods
-• Monitor your symptoms
-• Seek medical help if symptoms worsen
-
-⚠️ DISCLAIMER: This is general health information. Always consult qualified healthcare professionals for proper medical diagnosis and treatment."""
-        }
+class SimpleMedicalChatbot:
+    def __init__(self, rules_file=RULES_FILE):
+        # Keywords are indexed once, so lookups stay fast as the rules grow
+        self.matcher = KeywordMatcher.from_file(rules_file)
     
     def get_medical_advice(self, user_message):
-        """Generate medical advice based on keywords"""
-        message_lower = user_message.lower()
-        
-        # Check for keywords and return appropriate response
-        if any(word in message_lower for word in ['fever', 'temperature', 'hot']):
-            return self.responses['fever']
-        elif any(word in message_lower for word in ['headache', 'head', 'migraine']):
-            return self.responses['headache']
-        elif any(word in message_lower for word in ['stomach', 'nausea', 'vomit', 'belly']):
-            return self.responses['stomach']
-        elif any(word in message_lower for word in ['cough', 'throat', 'cold']):
-            return self.responses['cough']
-        else:
-            return self.responses['default']
+        """Generate medical advice from the best-matching keyword category"""
+        return self.matcher.match(user_message)
 
 # Initialize the chatbot
 chatbot = SimpleMedicalChatbot()
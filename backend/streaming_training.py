@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Out-of-core training of the retrieval engine
+Reads a CSV or JSONL corpus in chunks. The first pass counts document
+frequencies to build the TF-IDF vocabulary; the second transforms each chunk,
+spills its non-zeros into term-range bucket files (and, in row order, into a
+row-major copy) and appends the answers to disk. The buckets are then sorted one at a time into the postings arrays, so
+peak memory depends on the chunk size, the term-count cap and the bucket size,
+not on the size of the corpus
+"""
+
+import os
+import time
+import hashlib
+import logging
+import resource
+import tempfile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from model_artifacts import AnswerEncoder, ArtifactWriter, answer_dictionary, build_vectorizer, vectorizer_params
+from text_normalization import normalize_many
+
+logger = logging.getLogger(__name__)
+
+# Same transform settings as the in-memory trainer in extract_model.py
+ANALYZER_PARAMS = {'stop_words': 'english', 'ngram_range': (1, 2)}
+
+# Non-zeros spilled to disk: term column, row id and TF-IDF weight
+SPILL_RECORD = np.dtype([('term', '<i4'), ('row', '<i8'), ('value', '<f4')])
+MAX_BUCKETS = 256
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is in KiB on Linux)"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def iter_chunks(path: str, text_column: str, answer_column: str, chunk_rows: int,
+                normalize: Callable[[pd.Series], List[str]] = normalize_many) -> Iterator[Tuple[List[str], List[str]]]:
+    """(normalized texts, answers) for each chunk of a .csv or .jsonl file; rows without an answer are skipped"""
+    if path.endswith(('.jsonl', '.json')):
+        reader = pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=False)
+    else:
+        reader = pd.read_csv(path, usecols=[text_column, answer_column], chunksize=chunk_rows,
+                             dtype=str, keep_default_na=False)
+    with reader:
+        for frame in reader:
+            frame = frame[[text_column, answer_column]].dropna()
+            answers = frame[answer_column].astype(str)
+            keep = answers.str.strip() != ''
+            yield list(normalize(frame[text_column][keep])), list(answers[keep])
+
+class VocabularyCounter:
+    """Document and term frequencies of every n-gram, capped at max_terms entries"""
+
+    def __init__(self, max_terms: int = 1000000):
+        self.max_terms = max_terms
+        self.df: Dict[str, int] = {}
+        self.tf: Dict[str, int] = {}
+        self.n_docs = 0
+        # Terms rarer than this may have been dropped (and undercounted if they came back)
+        self.prune_floor = 0
+        self.pruned_terms = 0
+
+    def update(self, texts: List[str]):
+        self.n_docs += len(texts)
+        counter = CountVectorizer(**ANALYZER_PARAMS)
+        try:
+            counts = counter.fit_transform(texts)
+        except ValueError:
+            # Every text in the chunk was empty or only stop words
+            return
+        chunk_df = np.bincount(counts.indices, minlength=counts.shape[1])
+        chunk_tf = np.asarray(counts.sum(axis=0)).ravel()
+        df, tf = self.df, self.tf
+        for term, column in counter.vocabulary_.items():
+            df[term] = df.get(term, 0) + int(chunk_df[column])
+            tf[term] = tf.get(term, 0) + int(chunk_tf[column])
+        if len(df) > self.max_terms:
+            self._prune()
+
+    def _prune(self):
+        """Keep the most frequent half of the cap, like lossy counting"""
+        keep = self.max_terms // 2
+        counts = np.fromiter(self.tf.values(), dtype=np.int64, count=len(self.tf))
+        cut = int(np.partition(counts, len(counts) - keep)[len(counts) - keep])
+        rare = [term for term, count in self.tf.items() if count < cut]
+        if len(self.tf) - len(rare) > self.max_terms:
+            # Too many ties at the cut; drop them as well
+            cut += 1
+            rare = [term for term, count in self.tf.items() if count < cut]
+        for term in rare:
+            del self.df[term]
+            del self.tf[term]
+        self.pruned_terms += len(rare)
+        self.prune_floor = max(self.prune_floor, cut)
+        logger.info(f"Vocabulary pass: pruned {len(rare)} terms with fewer than {cut} occurrences")
+
+    def vocabulary(self, max_features: Optional[int], min_df: float = 1, max_df: float = 1.0
+                   ) -> Tuple[List[str], np.ndarray]:
+        """Terms (alphabetical, like TfidfVectorizer) and their document frequencies"""
+        max_docs = max_df * self.n_docs if isinstance(max_df, float) else max_df
+        min_docs = min_df * self.n_docs if isinstance(min_df, float) else min_df
+        terms = sorted(term for term, count in self.df.items() if min_docs <= count <= max_docs)
+        if max_features is not None and len(terms) > max_features:
+            # Same selection (and tie order) as TfidfVectorizer: highest corpus frequency among sorted terms
+            tfs = np.array([self.tf[term] for term in terms], dtype=np.int64)
+            keep = np.sort((-tfs).argsort()[:max_features])
+            terms = [terms[i] for i in keep]
+        return terms, np.array([self.df[term] for term in terms], dtype=np.int64)
+
+    def idf(self, df: np.ndarray) -> np.ndarray:
+        """Smoothed IDF, as TfidfVectorizer(smooth_idf=True) computes it"""
+        return np.log((1 + self.n_docs) / (1 + df)) + 1
+
+class AnswerSpill:
+    """Answers appended to disk with ids deduplicated by digest (up to dedupe_limit distinct answers)
+
+    Records are deflated against a dictionary sampled from the first chunk's answers"""
+
+    def __init__(self, directory: str, dedupe_limit: int = 1000000):
+        self.dedupe_limit = dedupe_limit
+        self._ids: Dict[bytes, int] = {}
+        self._counts = np.zeros(1024, dtype=np.int64)
+        self._blob = open(os.path.join(directory, 'answers.bin'), 'wb')
+        self._offsets_path = os.path.join(directory, 'answer_offsets.bin')
+        self._offsets = open(self._offsets_path, 'wb')
+        self._offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+        self._encoder: Optional[AnswerEncoder] = None
+        self.n_answers = 0
+        self.blob_bytes = 0
+        self.raw_bytes = 0
+
+    def add(self, answers: List[str]) -> np.ndarray:
+        """Answer id for each answer, appending new answers to the spill files"""
+        ids = np.empty(len(answers), dtype=np.int32)
+        new_offsets = []
+        encoded_answers = [answer.encode('utf-8') for answer in answers]
+        if self._encoder is None:
+            self._encoder = AnswerEncoder(answer_dictionary(list(dict.fromkeys(encoded_answers))))
+        for i, encoded in enumerate(encoded_answers):
+            key = hashlib.blake2b(encoded, digest_size=16).digest()
+            answer_id = self._ids.get(key)
+            if answer_id is None:
+                answer_id = self.n_answers
+                self.n_answers += 1
+                record = self._encoder.encode(encoded)
+                self._blob.write(record)
+                self.raw_bytes += len(encoded)
+                self.blob_bytes += len(record)
+                new_offsets.append(self.blob_bytes)
+                if len(self._ids) < self.dedupe_limit:
+                    self._ids[key] = answer_id
+            ids[i] = answer_id
+        self._offsets.write(np.asarray(new_offsets, dtype=np.int64).tobytes())
+
+        # Only deduplicated answers can repeat, so only they need counts for the default answer
+        tracked = ids[ids < self.dedupe_limit]
+        if len(tracked):
+            if tracked.max() >= len(self._counts):
+                self._counts = np.pad(self._counts, (0, max(int(tracked.max()) + 1, 2 * len(self._counts))
+                                                     - len(self._counts)))
+            np.add.at(self._counts, tracked, 1)
+        return ids
+
+    @property
+    def default_answer(self) -> int:
+        """The most common answer, for queries that share no term with any row"""
+        return int(self._counts.argmax()) if self.n_answers else 0
+
+    def write(self, writer: ArtifactWriter, prefix: str = '') -> Dict[str, Any]:
+        """Write the answer store and return its manifest entry"""
+        self._blob.close()
+        self._offsets.close()
+        zdict = self._encoder.zdict if self._encoder is not None else b''
+        writer.array_from_chunks(f'{prefix}answers_blob', np.uint8, self.blob_bytes,
+                                 _read_blocks(self._blob.name, np.uint8))
+        writer.array_from_chunks(f'{prefix}answers_offsets', np.int64, self.n_answers + 1,
+                                 _read_blocks(self._offsets_path, np.int64))
+        writer.array(f'{prefix}answers_zdict', np.frombuffer(zdict, dtype=np.uint8))
+        return {
+            'n_answers': self.n_answers,
+            'compression': 'deflate',
+            'bytes': self.blob_bytes + len(zdict),
+            'raw_bytes': self.raw_bytes
+        }
+
+def _read_blocks(path: str, dtype, block_items: int = 1 << 20) -> Iterator[np.ndarray]:
+    dtype = np.dtype(dtype)
+    with open(path, 'rb') as f:
+        while True:
+            block = np.fromfile(f, dtype=dtype, count=block_items)
+            if not len(block):
+                return
+            yield block
+
+class PostingsSpill:
+    """Builds the term-major postings of the retrieval index from row chunks via term-range buckets"""
+
+    def __init__(self, directory: str, df: np.ndarray, bucket_nnz: int = 2000000):
+        self.n_features = len(df)
+        # Document frequencies from the vocabulary pass size the buckets; the real counts are kept below
+        bucket_nnz = max(bucket_nnz, int(df.sum() // MAX_BUCKETS) + 1)
+        bucket_of_term = np.zeros(self.n_features, dtype=np.int32)
+        bucket, filled = 0, 0
+        for term, count in enumerate(df):
+            if filled and filled + count > bucket_nnz:
+                bucket, filled = bucket + 1, 0
+            bucket_of_term[term] = bucket
+            filled += count
+        self.bucket_of_term = bucket_of_term
+        self.paths = [os.path.join(directory, f'bucket_{i:03d}.bin') for i in range(bucket + 1)]
+        self._files = [open(path, 'wb') for path in self.paths]
+        # The row-major copy needs no sorting: chunks arrive in row order
+        self.rows_paths = {field: os.path.join(directory, f'rows_{field}.bin') for field in ('term', 'value')}
+        self._rows_files = {field: open(path, 'wb') for field, path in self.rows_paths.items()}
+        self.row_lengths = []
+        self.term_counts = np.zeros(self.n_features, dtype=np.int64)
+        self.n_rows = 0
+
+    def add(self, X):
+        """Spill the non-zeros of one chunk of TF-IDF rows"""
+        X = normalize(X.tocsr().astype(np.float32))
+        records = np.empty(X.nnz, dtype=SPILL_RECORD)
+        records['term'] = X.indices
+        records['row'] = np.repeat(np.arange(self.n_rows, self.n_rows + X.shape[0]), np.diff(X.indptr))
+        records['value'] = X.data
+        records['term'].tofile(self._rows_files['term'])
+        records['value'].tofile(self._rows_files['value'])
+        self.row_lengths.append(np.diff(X.indptr))
+        self.n_rows += X.shape[0]
+        self.term_counts += np.bincount(X.indices, minlength=self.n_features)
+
+        buckets = self.bucket_of_term[records['term']]
+        # Stable, so rows stay in ascending order inside each bucket
+        order = np.argsort(buckets, kind='stable')
+        records, buckets = records[order], buckets[order]
+        bounds = np.searchsorted(buckets, np.arange(len(self._files) + 1))
+        for bucket, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if end > start:
+                records[start:end].tofile(self._files[bucket])
+
+    def _sorted_buckets(self, field: str, dtype) -> Iterator[np.ndarray]:
+        """One bucket in memory at a time, ordered by term (rows are already ascending within a term)"""
+        for path in self.paths:
+            records = np.fromfile(path, dtype=SPILL_RECORD)
+            order = np.argsort(records['term'], kind='stable')
+            yield records[field][order].astype(dtype)
+
+    def write(self, writer: ArtifactWriter, prefix: str):
+        for f in self._files + list(self._rows_files.values()):
+            f.close()
+        nnz = int(self.term_counts.sum())
+        # scipy wants indices and indptr of one dtype; see model_artifacts._retrieval_arrays
+        index_dtype = np.int32 if max(nnz, self.n_rows) < np.iinfo(np.int32).max else np.int64
+        indptr = np.zeros(self.n_features + 1, dtype=index_dtype)
+        np.cumsum(self.term_counts, out=indptr[1:])
+        writer.array(f'{prefix}postings_indptr', indptr)
+        writer.array_from_chunks(f'{prefix}postings_indices', index_dtype, nnz,
+                                 self._sorted_buckets('row', index_dtype))
+        writer.array_from_chunks(f'{prefix}postings_data', np.float32, nnz,
+                                 self._sorted_buckets('value', np.float32))
+
+        indptr = np.zeros(self.n_rows + 1, dtype=index_dtype)
+        np.cumsum(np.concatenate(self.row_lengths) if self.row_lengths else [], out=indptr[1:])
+        writer.array(f'{prefix}rows_indptr', indptr)
+        writer.array_from_chunks(f'{prefix}rows_indices', index_dtype, nnz,
+                                 (block.astype(index_dtype) for block in _read_blocks(self.rows_paths['term'], np.int32)))
+        writer.array_from_chunks(f'{prefix}rows_data', np.float32, nnz, _read_blocks(self.rows_paths['value'], np.float32))
+
+def train_streaming(path: str, text_column: str = 'symptoms',
+                    answer_column: str = 'advice', chunk_rows: int = 10000, max_features: Optional[int] = 5000,
+                    max_terms: int = 1000000, bucket_nnz: int = 2000000, base_dir: str = '.',
+                    spill_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Build retrieval artifacts from a corpus file in two streaming passes; returns the saved metadata"""
+    started = time.perf_counter()
+    counter = VocabularyCounter(max_terms)
+    for texts, _ in iter_chunks(path, text_column, answer_column, chunk_rows):
+        counter.update(texts)
+    vocabulary_seconds = time.perf_counter() - started
+    vocabulary_rss = peak_rss_mb()
+    logger.info(f"Vocabulary pass: {counter.n_docs} rows in {vocabulary_seconds:.1f}s, "
+                f"{len(counter.df)} candidate terms, peak RSS {vocabulary_rss} MB")
+
+    terms, df = counter.vocabulary(max_features, min_df=1, max_df=0.95)
+    params = vectorizer_params(TfidfVectorizer(**ANALYZER_PARAMS))
+    vectorizer = build_vectorizer(params, terms, counter.idf(df))
+    # Free the candidate counts before the second pass
+    counter.df, counter.tf = {}, {}
+
+    index_started = time.perf_counter()
+    writer = ArtifactWriter(base_dir)
+    with tempfile.TemporaryDirectory(prefix='streaming_train_', dir=spill_dir or base_dir) as directory:
+        postings = PostingsSpill(directory, df, bucket_nnz)
+        answers = AnswerSpill(directory)
+        row_answers_path = os.path.join(directory, 'row_answers.bin')
+        with open(row_answers_path, 'wb') as row_answers:
+            for texts, chunk_answers in iter_chunks(path, text_column, answer_column, chunk_rows):
+                postings.add(vectorizer.transform(texts))
+                answers.add(chunk_answers).tofile(row_answers)
+
+        writer.vocabulary(terms)
+        writer.array('idf', vectorizer.idf_)
+        postings.write(writer, 'retrieval_')
+        writer.array_from_chunks('retrieval_row_answers', np.int32, postings.n_rows,
+                                 _read_blocks(row_answers_path, np.int32))
+        answers_info = answers.write(writer)
+    index_seconds = time.perf_counter() - index_started
+    total_seconds = time.perf_counter() - started
+    logger.info(f"Index pass: {postings.n_rows} rows in {index_seconds:.1f}s, {answers.n_answers} distinct answers")
+
+    metadata = {
+        'model_type': 'RetrievalIndex',
+        'n_features': len(terms),
+        'n_samples': postings.n_rows,
+        'training': {
+            'mode': 'streaming',
+            'source': os.path.basename(path),
+            'chunk_rows': chunk_rows,
+            'max_terms': max_terms,
+            'pruned_terms': counter.pruned_terms,
+            'prune_floor': counter.prune_floor,
+            'vocabulary_pass': {
+                'rows': counter.n_docs,
+                'seconds': round(vocabulary_seconds, 3),
+                'rows_per_second': round(counter.n_docs / vocabulary_seconds, 1) if vocabulary_seconds else None,
+                'peak_rss_mb': vocabulary_rss
+            },
+            'index_pass': {
+                'rows': postings.n_rows,
+                'seconds': round(index_seconds, 3),
+                'rows_per_second': round(postings.n_rows / index_seconds, 1) if index_seconds else None,
+                'peak_rss_mb': peak_rss_mb()
+            },
+            'rows_per_second': round(postings.n_rows / total_seconds, 1) if total_seconds else None,
+            'peak_rss_mb': peak_rss_mb()
+        }
+    }
+    engines = {'retrieval': {
+        'n_rows': postings.n_rows,
+        'row_major': True,
+        'n_answers': answers.n_answers,
+        'default_answer': answers.default_answer
+    }}
+    writer.finish(len(terms), params, engines, metadata, answers=answers_info)
+    logger.info(f"Streaming training done: {metadata['training']['rows_per_second']} rows/s, "
+                f"peak RSS {metadata['training']['peak_rss_mb']} MB")
+    return metadata
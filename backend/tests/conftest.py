@@ -0,0 +1,25 @@
+"""Shared fixtures for the backend unit tests"""
+
+import os
+import sys
+
+import pytest
+
+# The backend modules are flat files next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class Clock:
+    """Stand-in for time.time / time.monotonic that only moves when told to"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+@pytest.fixture
+def clock():
+    return Clock()
@@ -0,0 +1,82 @@
+"""Appending to the retrieval index against a full retrain on the same rows"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from benchmark_engines import make_corpus
+from extract_model import DEFAULT_VECTORIZER_PARAMS
+from index_updates import append_to_index
+from model_artifacts import load_artifacts, read_manifest, save_artifacts
+from retrieval import RenormalizedRows, RetrievalIndex
+from text_normalization import normalize_many
+
+BASE_ROWS = 4000
+DELTA_ROWS = 400
+
+@pytest.fixture(scope='module')
+def corpus():
+    symptoms, advice = make_corpus(BASE_ROWS + 2 * DELTA_ROWS, 50, vocab_size=800)
+    queries = normalize_many(make_corpus(300, 1, vocab_size=800, seed=7)[0])
+    return symptoms, advice, normalize_many(symptoms), queries
+
+@pytest.fixture(scope='module')
+def appended(corpus, tmp_path_factory):
+    """Artifacts trained on the base rows with two delta files appended"""
+    symptoms, advice, texts, _ = corpus
+    base_dir = str(tmp_path_factory.mktemp('artifacts'))
+    vectorizer = TfidfVectorizer(**DEFAULT_VECTORIZER_PARAMS)
+    X = vectorizer.fit_transform(texts[:BASE_ROWS])
+    save_artifacts(vectorizer, retrieval_index=RetrievalIndex().fit(X, advice[:BASE_ROWS]), base_dir=base_dir)
+    for n in range(2):
+        rows = slice(BASE_ROWS + n * DELTA_ROWS, BASE_ROWS + (n + 1) * DELTA_ROWS)
+        path = f'{base_dir}/delta{n}.csv'
+        pd.DataFrame({'symptoms': symptoms[rows], 'advice': advice[rows]}).to_csv(path, index=False)
+        append_to_index(path, base_dir=base_dir)
+    return base_dir, vectorizer
+
+@pytest.fixture(scope='module')
+def retrained(corpus, appended):
+    """Index fitted on the same rows with the same vocabulary, IDF computed over all of them"""
+    _, _, texts, queries = corpus
+    _, vectorizer = appended
+    terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+    delta = texts[BASE_ROWS:]
+    kept = [text for text, nnz in zip(delta, np.diff(vectorizer.transform(delta).indptr)) if nnz]
+    reference = TfidfVectorizer(vocabulary=terms, stop_words=vectorizer.stop_words,
+                                ngram_range=vectorizer.ngram_range)
+    X = reference.fit_transform(texts[:BASE_ROWS] + kept)
+    return reference, RetrievalIndex().fit(X, np.zeros(X.shape[0], dtype=np.int64))
+
+def test_append_publishes_segments(appended):
+    base_dir, _ = appended
+    manifest = read_manifest(base_dir)
+    info = manifest['engines']['retrieval']
+    assert manifest['revision'] == 2
+    assert len(info['segments']) == 2
+    assert info['n_docs'] == BASE_ROWS + 2 * DELTA_ROWS
+
+def test_appended_idf_matches_retrain(appended, retrained):
+    _, served = load_artifacts('retrieval', base_dir=appended[0])
+    np.testing.assert_allclose(served.idf_, retrained[0].idf_, rtol=1e-9)
+
+@pytest.mark.parametrize('k', [1, 3])
+def test_appended_scores_match_retrain(corpus, appended, retrained, k):
+    queries = corpus[3]
+    model, served = load_artifacts('retrieval', base_dir=appended[0])
+    _, scores = model.kneighbors(served.transform(queries), k)
+    reference, index = retrained
+    _, expected = index.kneighbors(reference.transform(queries), k)
+    assert scores.max() <= 1 + 1e-5
+    np.testing.assert_allclose(scores, expected, atol=1e-5)
+
+def test_row_major_lengths_match_full_pass(appended):
+    model, _ = load_artifacts('retrieval', base_dir=appended[0])
+    base = model.segments[0]
+    scale = model.renormalized[0].scale
+    columns = np.arange(base.postings.shape[1])
+    columns = columns[np.diff(base.rows.indptr) > 0]
+    lazy = RenormalizedRows(scale, base.postings, base.rows)._lengths(columns)
+    full = RenormalizedRows(scale, base.postings)._lengths(columns)
+    np.testing.assert_allclose(lazy, full, rtol=1e-5)
@@ -0,0 +1,31 @@
+"""History trimming under the input-token budget"""
+
+from prompt_builder import PromptBuilder, estimate_tokens
+
+def exchange(n, tokens=100):
+    return [{'role': 'user', 'content': f'question {n}', 'tokens': tokens},
+            {'role': 'assistant', 'content': f'answer {n}', 'tokens': tokens}]
+
+def test_keeps_everything_within_budget():
+    builder = PromptBuilder('system', max_input_tokens=1000)
+    prompt = builder.build('hello', exchange(1) + exchange(2))
+    assert len(prompt.history) == 4 and prompt.trimmed_turns == 0
+    assert prompt.input_tokens == estimate_tokens('system') + 400 + estimate_tokens('hello')
+
+def test_drops_oldest_whole_exchanges():
+    builder = PromptBuilder('system', max_input_tokens=350)
+    prompt = builder.build('hello', exchange(1) + exchange(2) + exchange(3))
+    assert [turn['content'] for turn in prompt.history] == ['question 3', 'answer 3']
+    assert prompt.trimmed_turns == 4
+    assert prompt.input_tokens <= 350
+
+def test_never_trims_system_prompt_or_message():
+    system = 'x' * 4000
+    builder = PromptBuilder(system, max_input_tokens=100)
+    prompt = builder.build('hello', exchange(1))
+    assert prompt.system == system and prompt.user_message == 'hello'
+    assert prompt.history == [] and prompt.trimmed_turns == 2
+
+def test_non_ascii_text_is_not_undercounted():
+    assert estimate_tokens('fever and headache') == 4
+    assert estimate_tokens('发烧和头痛') == 5
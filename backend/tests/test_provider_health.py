@@ -0,0 +1,84 @@
+"""Circuit breaker state machine"""
+
+import pytest
+
+import provider_health
+from provider_health import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+@pytest.fixture
+def breaker(clock, monkeypatch):
+    monkeypatch.setattr(provider_health.time, 'monotonic', clock)
+    return CircuitBreaker('test', window_size=4, min_calls=4, error_threshold=0.5,
+                          slow_call_seconds=1.0, open_seconds=30.0)
+
+def fail(breaker, times):
+    for _ in range(times):
+        breaker.record(False, 0.1, breaker.allow_request())
+
+def trip(breaker):
+    fail(breaker, breaker.min_calls)
+    assert breaker.state == OPEN
+
+def test_stays_closed_below_min_calls(breaker):
+    fail(breaker, 3)
+    assert breaker.state == CLOSED
+    assert breaker.allow_request() is not None
+
+def test_opens_at_error_threshold(breaker):
+    breaker.record(True, 0.1, breaker.allow_request())
+    breaker.record(True, 0.1, breaker.allow_request())
+    fail(breaker, 2)
+    assert breaker.state == OPEN
+    assert breaker.allow_request() is None
+
+def test_slow_successes_count_as_failures(breaker):
+    for _ in range(4):
+        breaker.record(True, 5.0, breaker.allow_request())
+    assert breaker.state == OPEN
+
+def test_half_open_after_open_seconds_lets_one_probe_through(breaker, clock):
+    trip(breaker)
+    clock.advance(29)
+    assert breaker.allow_request() is None
+    clock.advance(1)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request() is not None
+    assert breaker.allow_request() is None
+
+def test_probe_success_closes(breaker, clock):
+    trip(breaker)
+    clock.advance(30)
+    breaker.record(True, 0.1, breaker.allow_request())
+    assert breaker.state == CLOSED
+    assert breaker.error_rate() == 0.0
+
+def test_probe_failure_reopens(breaker, clock):
+    trip(breaker)
+    clock.advance(30)
+    breaker.record(False, 0.1, breaker.allow_request())
+    assert breaker.state == OPEN
+    clock.advance(29)
+    assert breaker.allow_request() is None
+
+def test_released_probe_frees_the_slot(breaker, clock):
+    trip(breaker)
+    clock.advance(30)
+    probe = breaker.allow_request()
+    breaker.release(probe)
+    assert breaker.allow_request() is not None
+
+def test_call_admitted_before_trip_cannot_free_or_settle_the_probe(breaker, clock):
+    stale = breaker.allow_request()
+    trip(breaker)
+    clock.advance(30)
+    probe = breaker.allow_request()
+
+    # Cancelled after losing a hedge: must not let a second probe through
+    breaker.release(stale)
+    assert breaker.allow_request() is None
+    # Its late outcome is not the probe's
+    breaker.record(True, 0.1, stale)
+    assert breaker.state == HALF_OPEN
+
+    breaker.record(True, 0.1, probe)
+    assert breaker.state == CLOSED
@@ -0,0 +1,78 @@
+"""TTL and LRU eviction of the response caches"""
+
+import pytest
+
+import response_cache
+from response_cache import MemoryResponseCache, SQLiteResponseCache
+
+@pytest.fixture(autouse=True)
+def frozen_time(clock, monkeypatch):
+    monkeypatch.setattr(response_cache.time, 'time', clock)
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_cache(request, tmp_path):
+    def make(max_entries=3, ttl=60):
+        if request.param == 'memory':
+            return MemoryResponseCache(max_entries, ttl)
+        return SQLiteResponseCache(str(tmp_path / 'cache.db'), max_entries, ttl)
+    return make
+
+def test_hit_returns_response_and_backend(make_cache):
+    cache = make_cache()
+    assert cache.get('fever') is None
+    cache.set('fever', 'rest', 'RandomForest')
+    assert cache.get('fever') == ('rest', 'RandomForest')
+    assert cache.stats['hits'] == 1 and cache.stats['misses'] == 1
+
+def test_entries_expire_after_ttl(make_cache, clock):
+    cache = make_cache(ttl=60)
+    cache.set('fever', 'rest', 'OpenAIProvider')
+    clock.advance(60)
+    assert cache.get('fever') is not None
+    clock.advance(1)
+    assert cache.get('fever') is None
+    assert cache.stats['evictions'] == 1
+    assert len(cache) == 0
+
+def test_zero_ttl_never_expires(make_cache, clock):
+    cache = make_cache(ttl=0)
+    cache.set('fever', 'rest', 'RandomForest')
+    clock.advance(10 ** 6)
+    assert cache.get('fever') == ('rest', 'RandomForest')
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryResponseCache(max_entries=2, ttl=60)
+    cache.set('a', '1', 'RandomForest')
+    cache.set('b', '2', 'RandomForest')
+    cache.get('a')
+    cache.set('c', '3', 'RandomForest')
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats['evictions'] == 1
+
+def test_sqlite_cache_trims_least_recently_used_every_n_inserts(tmp_path, clock):
+    cache = SQLiteResponseCache(str(tmp_path / 'cache.db'), max_entries=20, ttl=0)
+    assert cache.evict_every == 2
+    for i in range(20):
+        cache.set(f'q{i}', str(i), 'RandomForest')
+        clock.advance(1)
+    cache.get('q0')
+    clock.advance(1)
+    cache.set('q20', '20', 'RandomForest')
+    assert len(cache) == 21
+    cache.set('q21', '21', 'RandomForest')
+    assert len(cache) == 20
+    # q0 was read last, so q1 and q2 were the least recently used
+    assert cache.get('q0') is not None
+    assert cache.get('q1') is None and cache.get('q2') is None
+
+def test_sqlite_cache_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    SQLiteResponseCache(path).set('fever', 'rest', 'AnthropicProvider')
+    assert SQLiteResponseCache(path).get('fever') == ('rest', 'AnthropicProvider')
+
+def test_clear(make_cache):
+    cache = make_cache()
+    cache.set('fever', 'rest', 'RandomForest')
+    cache.clear()
+    assert cache.get('fever') is None
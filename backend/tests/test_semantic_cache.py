@@ -0,0 +1,50 @@
+"""Similarity lookup and LRU eviction of the semantic cache"""
+
+import numpy as np
+import scipy.sparse as sp
+
+from semantic_cache import SemanticCache
+
+def vector(weights, n_features=10):
+    row = np.zeros((1, n_features))
+    for term, weight in weights.items():
+        row[0, term] = weight
+    return sp.csr_matrix(row)
+
+def test_returns_answer_above_threshold_only():
+    cache = SemanticCache(threshold=0.9, capacity=4)
+    cache.add(vector({0: 1.0, 1: 1.0}), 'rest', 'OpenAIProvider')
+    response, backend, similarity = cache.get(vector({0: 1.0, 1: 0.9}))
+    assert (response, backend) == ('rest', 'OpenAIProvider')
+    assert similarity > 0.99
+    assert cache.get(vector({0: 1.0, 2: 1.0})) is None
+    assert cache.stats['hits'] == 1 and cache.stats['misses'] == 1
+
+def test_evicts_least_recently_used():
+    cache = SemanticCache(threshold=0.99, capacity=2)
+    cache.add(vector({0: 1.0}), 'a', 'OpenAIProvider')
+    cache.add(vector({1: 1.0}), 'b', 'OpenAIProvider')
+    assert cache.get(vector({0: 1.0}))[0] == 'a'
+    cache.add(vector({2: 1.0}), 'c', 'OpenAIProvider')
+    assert cache.get(vector({1: 1.0})) is None
+    assert cache.get(vector({0: 1.0}))[0] == 'a'
+    assert cache.get(vector({2: 1.0}))[0] == 'c'
+    assert cache.stats['evictions'] == 1
+
+def test_long_rows_are_not_truncated():
+    cache = SemanticCache(threshold=0.99, capacity=2, row_width=2)
+    weights = {term: 1.0 for term in range(6)}
+    cache.add(vector(weights), 'long', 'OpenAIProvider')
+    assert cache.get(vector(weights))[2] > 0.999
+
+def test_empty_query_is_a_miss():
+    cache = SemanticCache()
+    assert cache.get(vector({})) is None
+    assert cache.stats['misses'] == 1
+
+def test_vocabulary_change_drops_old_entries():
+    cache = SemanticCache(threshold=0.9)
+    cache.add(vector({0: 1.0}), 'a', 'OpenAIProvider')
+    assert cache.get(vector({0: 1.0}, n_features=12)) is None
+    cache.add(vector({0: 1.0}, n_features=12), 'b', 'OpenAIProvider')
+    assert cache.get(vector({0: 1.0}, n_features=12))[0] == 'b'
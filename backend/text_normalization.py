@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Text normalization shared by training and serving
+Lowercases, turns every character that is neither a word character nor
+whitespace into a space and collapses whitespace. The model is fitted on
+normalized symptoms, so the bot must normalize messages exactly the same way
+or the vectorizer sees tokens at serving time that it was never fitted on
+"""
+
+import re
+from typing import Any, Iterable, List
+
+import pandas as pd
+
+# Tokens of the normalized text: maximal runs of word characters
+_WORDS = re.compile(r'\w+')
+
+def _ascii_table() -> bytes:
+    """bytes.translate table that lowercases [A-Za-z0-9_] and maps every other ASCII byte to a space"""
+    table = bytearray(b' ' * 256)
+    for code in range(128):
+        char = chr(code)
+        if char.isalnum() or char == '_':
+            table[code] = ord(char.lower())
+    return bytes(table)
+
+_ASCII_TABLE = _ascii_table()
+
+def normalize_text(text: Any) -> str:
+    """Normalize one message; missing values (None, NaN) become an empty string"""
+    if not isinstance(text, str):
+        if text is None or pd.isna(text):
+            return ''
+        text = str(text)
+    if text.isascii():
+        # One table lookup per byte lowercases and strips punctuation, about twice as fast as the regex
+        return ' '.join(text.encode('ascii').translate(_ASCII_TABLE).decode('ascii').split())
+    return ' '.join(_WORDS.findall(text.lower()))
+
+def normalize_many(texts: Iterable[Any]) -> Any:
+    """Normalize a batch; a pandas Series comes back as a Series with the same index, anything else as a list"""
+    if isinstance(texts, pd.Series):
+        # Iterating a plain list is much faster than iterating the Series
+        return pd.Series(list(map(normalize_text, texts.tolist())), index=texts.index, name=texts.name, dtype=object)
+    return list(map(normalize_text, texts))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Webhook throttling for the WhatsApp Medical Chatbot
+Token buckets per sender and for the whole process cap how fast messages are
+accepted, and a short per-sender debounce window merges a burst of messages
+into one query, both before any model or LLM work is done
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Allows `rate` events per second on average and bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def has_token(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self):
+        self.tokens -= 1
+
+class RateLimiter:
+    """Per-sender and global token buckets; both must have a token for a message to be accepted"""
+
+    def __init__(self, sender_rate: float = 20 / 60, sender_burst: float = 10,
+                 global_rate: float = 0, global_burst: float = 50, max_senders: int = 10000):
+        self.sender_rate = sender_rate
+        self.sender_burst = max(1.0, sender_burst)
+        self.max_senders = max(1, max_senders)
+        # A global rate of 0 means no global limit
+        self._global = TokenBucket(global_rate, max(1.0, global_burst)) if global_rate > 0 else None
+        # sender -> TokenBucket, least recently seen first; an evicted sender starts again with a full bucket
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'allowed': 0, 'throttled_sender': 0, 'throttled_global': 0}
+
+    @classmethod
+    def from_env(cls) -> Optional['RateLimiter']:
+        """Build a limiter if RATE_LIMIT is enabled; sender rates are per minute, the global rate per second"""
+        if os.getenv('RATE_LIMIT', 'false').lower() != 'true':
+            return None
+        return cls(
+            sender_rate=float(os.getenv('RATE_LIMIT_PER_SENDER', '20')) / 60,
+            sender_burst=float(os.getenv('RATE_LIMIT_SENDER_BURST', '10')),
+            global_rate=float(os.getenv('RATE_LIMIT_GLOBAL', '0')),
+            global_burst=float(os.getenv('RATE_LIMIT_GLOBAL_BURST', '50')),
+            max_senders=int(os.getenv('RATE_LIMIT_MAX_SENDERS', '10000'))
+        )
+
+    def allow(self, sender: str) -> bool:
+        """Take a token from the sender's bucket and the global bucket, or neither"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(sender)
+            if bucket is None:
+                bucket = TokenBucket(self.sender_rate, self.sender_burst, now)
+                self._buckets[sender] = bucket
+                while len(self._buckets) > self.max_senders:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(sender)
+
+            # Check both before taking either, so a globally throttled message does not use up the sender's quota
+            if not bucket.has_token(now):
+                self.stats['throttled_sender'] += 1
+                return False
+            if self._global is not None and not self._global.has_token(now):
+                self.stats['throttled_global'] += 1
+                return False
+            bucket.take()
+            if self._global is not None:
+                self._global.take()
+            self.stats['allowed'] += 1
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and configuration for the health endpoint"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['tracked_senders'] = len(self._buckets)
+        stats.update({
+            'per_sender_per_minute': round(self.sender_rate * 60, 2),
+            'sender_burst': self.sender_burst,
+            'global_per_second': self._global.rate if self._global is not None else None
+        })
+        return stats
+
+class _Burst:
+    """Messages from one sender waiting for the debounce window to close"""
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.messages: List[str] = []
+        self.generation = 0
+        self.timer = None
+
+class MessageCoalescer:
+    """Debounces each sender's messages and hands a burst to `flush` as one newline-joined message"""
+
+    def __init__(self, flush: Callable[[str, str], Any], window: float = 1.5,
+                 max_wait: float = 5.0, max_messages: int = 5):
+        self.flush = flush
+        self.window = window
+        # A sender who keeps typing still gets an answer after max_wait
+        self.max_wait = max(window, max_wait)
+        self.max_messages = max(1, max_messages)
+        self._pending: Dict[str, _Burst] = {}
+        self._lock = threading.Lock()
+        self.stats = {'messages': 0, 'bursts': 0, 'merged': 0}
+
+    @classmethod
+    def from_env(cls, flush: Callable[[str, str], Any]) -> Optional['MessageCoalescer']:
+        """Build a coalescer if COALESCE_WINDOW_MS is above zero"""
+        window_ms = float(os.getenv('COALESCE_WINDOW_MS', '0'))
+        if window_ms <= 0:
+            return None
+        return cls(
+            flush,
+            window=window_ms / 1000,
+            max_wait=float(os.getenv('COALESCE_MAX_WAIT_MS', '5000')) / 1000,
+            max_messages=int(os.getenv('COALESCE_MAX_MESSAGES', '5'))
+        )
+
+    def add(self, sender: str, message: str):
+        """Add a message to the sender's burst; the burst is flushed once the sender goes quiet"""
+        now = time.monotonic()
+        ready = None
+        with self._lock:
+            self.stats['messages'] += 1
+            burst = self._pending.get(sender)
+            if burst is None:
+                burst = _Burst(now)
+                self._pending[sender] = burst
+            burst.messages.append(message)
+            burst.generation += 1
+            if burst.timer is not None:
+                burst.timer.cancel()
+            if len(burst.messages) >= self.max_messages:
+                ready = self._pending.pop(sender)
+            else:
+                delay = min(self.window, burst.started_at + self.max_wait - now)
+                # Timers are created per burst, so none are inherited across fork
+                burst.timer = threading.Timer(max(0.0, delay), self._expire, (sender, burst, burst.generation))
+                burst.timer.daemon = True
+                burst.timer.start()
+        if ready is not None:
+            self._flush(sender, ready)
+
+    def _expire(self, sender: str, burst: _Burst, generation: int):
+        with self._lock:
+            # A newer message restarted the window (or the burst was already flushed)
+            if self._pending.get(sender) is not burst or burst.generation != generation:
+                return
+            del self._pending[sender]
+        self._flush(sender, burst)
+
+    def _flush(self, sender: str, burst: _Burst):
+        with self._lock:
+            self.stats['bursts'] += 1
+            self.stats['merged'] += len(burst.messages) - 1
+        if len(burst.messages) > 1:
+            logger.info(f"Coalesced {len(burst.messages)} messages from {sender}")
+        try:
+            self.flush(sender, '\n'.join(burst.messages))
+        except Exception as e:
+            logger.error(f"Flushing coalesced messages failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and configuration for the health endpoint"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending_senders'] = len(self._pending)
+        stats.update({
+            'window_ms': round(self.window * 1000),
+            'max_wait_ms': round(self.max_wait * 1000),
+            'max_messages': self.max_messages
+        })
+        return stats
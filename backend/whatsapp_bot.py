@@ -8,13 +8,27 @@ import os
 import json
 import pickle
 import logging
-from flask import Flask, request, jsonify
+import threading
+import time
+import hmac
+import signal
+import tempfile
+from flask import Flask, Response, g, request, jsonify
 from twilio.rest import Client
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.ensemble import RandomForestClassifier
-import re
 from llm_integration import LLMManager
+from reply_queue import ReplyWorkerPool
+from response_cache import create_response_cache
+from semantic_cache import SemanticCache
+from batching import MicroBatcher
+from model_bundle import ModelWatcher, load_bundle, smoke_test
+from conversation_store import create_conversation_store
+from routing import TieredRouter, CACHE_TIER, LOCAL_TIER, LLM_TIER, LOCAL_FALLBACK_TIER
+from throttling import MessageCoalescer, RateLimiter
+from text_normalization import normalize_text
+from metrics import CONTENT_TYPE, OK, REQUEST_SECONDS, STAGE_SECONDS, render_metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,100 +36,415 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+RANDOM_FOREST_BACKEND = 'RandomForest'
+# The RandomForest answering because the LLMs failed; such answers are not cached
+RANDOM_FOREST_FALLBACK_BACKEND = 'RandomForest (LLM fallback)'
+
+DISCLAIMER = "\n\n⚠️ DISCLAIMER: This is AI-generated advice for informational purposes only. Please consult a qualified healthcare professional for proper medical diagnosis and treatment."
+
+# Sent after the parts already delivered when an LLM stream breaks off
+STREAM_INTERRUPTED_MESSAGE = "⚠️ Sorry, this answer was cut off. Please send your question again for the full advice."
+
+# Twilio rejects WhatsApp message bodies longer than this
+MAX_MESSAGE_LENGTH = 1600
+
+def split_message(text, max_length=MAX_MESSAGE_LENGTH):
+    """Split text into messages of at most max_length, preferring paragraph breaks"""
+    parts = []
+    current = ''
+    for paragraph in text.split('\n\n'):
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if len(candidate) <= max_length:
+            current = candidate
+            continue
+        if current:
+            parts.append(current)
+        while len(paragraph) > max_length:
+            parts.append(paragraph[:max_length])
+            paragraph = paragraph[max_length:]
+        current = paragraph
+    if current.strip():
+        parts.append(current)
+    return parts
+
+def iter_delivery_parts(chunks, max_length=MAX_MESSAGE_LENGTH):
+    """Turn streamed text chunks into messages: the first paragraph as soon as it
+    is complete, then the remainder once the stream ends"""
+    buffer = ''
+    first_sent = False
+    for chunk in chunks:
+        buffer += chunk
+        if first_sent:
+            continue
+        buffer = buffer.lstrip()
+        end = buffer.find('\n\n')
+        if end == -1 and len(buffer) < max_length:
+            continue
+        if end == -1:
+            end = max_length
+        first_sent = True
+        yield from split_message(buffer[:end].strip(), max_length)
+        buffer = buffer[end:]
+    
+    rest = buffer.strip()
+    if rest:
+        yield from split_message(rest, max_length)
+
 class MedicalChatbot:
     def __init__(self):
-        self.model = None
-        self.vectorizer = None
+        # Model and vectorizer live in one bundle that reloads replace in a single assignment
+        self.bundle = None
         self.llm_manager = LLMManager()
         self.use_llm = os.getenv('USE_LLM', 'false').lower() == 'true'
+        self.response_cache = create_response_cache()
+        self.semantic_cache = SemanticCache.from_env()
+        # Send the first paragraph of an LLM answer before the rest is generated
+        self.stream_replies = os.getenv('STREAM_REPLIES', 'false').lower() == 'true'
+        # Group concurrent fallback predictions into one vectorize/predict call
+        self.micro_batcher = MicroBatcher.from_env(self.predict_scored_batch)
+        # Answer confident questions locally and escalate the rest to the LLMs
+        self.router = TieredRouter.from_env()
+        # Recent turns per sender, passed to the LLMs so follow-up questions keep their context
+        self.conversations = create_conversation_store()
+        self.history_tokens = int(os.getenv('CONVERSATION_HISTORY_TOKENS', '1000'))
+        self.model_engine = os.getenv('MODEL_ENGINE', 'forest').lower()
+        self.verify_artifacts = os.getenv('ARTIFACT_VERIFY', 'true').lower() == 'true'
+        self._reload_lock = threading.Lock()
+        # A preloaded app reloads in the Gunicorn master, which then replaces every worker
+        preloaded = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+        self.model_watcher = ModelWatcher.from_env(
+            self.model_engine, self.request_master_reload if preloaded else self.reload_model)
         self.load_model()
+    
+    @property
+    def model(self):
+        return self.bundle.model if self.bundle else None
+    
+    @property
+    def vectorizer(self):
+        return self.bundle.vectorizer if self.bundle else None
         
     def load_model(self):
         """Load the trained ML model and vectorizer"""
         try:
-            # Try to load pre-trained model
-            if os.path.exists('medical_model.pkl') and os.path.exists('vectorizer.pkl'):
-                with open('medical_model.pkl', 'rb') as f:
-                    self.model = pickle.load(f)
-                with open('vectorizer.pkl', 'rb') as f:
-                    self.vectorizer = pickle.load(f)
-                logger.info("Model loaded successfully")
-            else:
+            bundle = load_bundle(self.model_engine, verify=self.verify_artifacts)
+            if bundle is None:
                 logger.warning("Model files not found. Please train the model first.")
+                return
+            self.bundle = bundle
         except Exception as e:
             logger.error(f"Error loading model: {e}")
     
+    def reload_model(self):
+        """Load the current model files, smoke-test them and swap them in; the old model keeps serving until then"""
+        if not self._reload_lock.acquire(blocking=False):
+            logger.info("Model reload already in progress")
+            return False
+        try:
+            bundle = self._load_tested_bundle()
+            # Request threads read self.bundle once, so they see either the old or the new model
+            self.bundle = bundle
+            # Cached answers (and semantic cache vectors) belong to the old model and vocabulary
+            if self.response_cache is not None:
+                self.response_cache.clear()
+            if self.semantic_cache is not None:
+                self.semantic_cache.clear()
+            logger.info(f"Model reloaded ({bundle.engine} engine from {bundle.source})")
+            return True
+        except Exception as e:
+            logger.error(f"Model reload failed, keeping the current model: {e}")
+            return False
+        finally:
+            self._reload_lock.release()
+    
+    def _load_tested_bundle(self):
+        """Load the current model files and smoke-test them; raises if they are missing or broken"""
+        bundle = load_bundle(self.model_engine, verify=self.verify_artifacts)
+        if bundle is None:
+            raise FileNotFoundError("model files not found")
+        smoke_test(bundle)
+        return bundle
+    
+    def request_master_reload(self):
+        """Check that the changed model files load, then have the Gunicorn master reload every worker"""
+        try:
+            self._load_tested_bundle()
+        except Exception as e:
+            logger.error(f"Changed model files do not load yet: {e}")
+            return False
+        # Same as /admin/reload: the master reloads once and the copy-on-write sharing is kept
+        os.kill(os.getppid(), signal.SIGHUP)
+        return True
+    
+    def reload_model_in_background(self):
+        """Start a reload on a background thread so no request thread blocks on loading"""
+        if self._reload_lock.locked():
+            return False
+        threading.Thread(target=self.reload_model, name='model-reload', daemon=True).start()
+        return True
+    
     def preprocess_text(self, text):
         """Clean and preprocess user input"""
-        # Remove special characters and normalize
-        text = re.sub(r'[^a-zA-Z0-9\s]', '', text.lower())
-        text = ' '.join(text.split())  # Remove extra whitespace
-        return text
+        with STAGE_SECONDS.time('preprocess', OK):
+            # Same normalization the model was trained with
+            return normalize_text(text)
+    
+    def get_medical_advice(self, user_message, sender=None):
+        """Generate medical advice based on user input (and the sender's recent conversation)"""
+        start = time.perf_counter()
+        history = self._history_for(sender)
+        # Follow-up questions depend on their conversation, so only opening questions use the caches
+        cache_key = '' if history else self.preprocess_text(user_message)
+        
+        cached, query_vector = self._lookup_cached(cache_key)
+        if cached:
+            self.router.record(CACHE_TIER, time.perf_counter() - start)
+            self._remember(sender, user_message, cached)
+            return cached
+        
+        response, backend = self._generate_advice(user_message, start=start, history=history)
+        self._store_answer(cache_key, query_vector, response, backend)
+        if backend:
+            self._remember(sender, user_message, response)
+        return response
+    
+    def iter_medical_advice(self, user_message, sender=None):
+        """Yield the advice as WhatsApp-sized parts, streaming LLM answers when enabled"""
+        start = time.perf_counter()
+        history = self._history_for(sender)
+        cache_key = '' if history else self.preprocess_text(user_message)
+        
+        cached, query_vector = self._lookup_cached(cache_key)
+        if cached:
+            self.router.record(CACHE_TIER, time.perf_counter() - start)
+            self._remember(sender, user_message, cached)
+            yield from split_message(cached)
+            return
+        
+        local = None
+        if self.router.enabled:
+            local = self._predict_local(self.preprocess_text(user_message))
+            if local and self.router.is_confident(local[1]):
+                self.router.record(LOCAL_TIER, time.perf_counter() - start)
+                self._store_answer(cache_key, query_vector, local[0], RANDOM_FOREST_BACKEND)
+                self._remember(sender, user_message, local[0])
+                yield from split_message(local[0])
+                return
+        
+        if self.stream_replies and self.use_llm and self.llm_manager.is_available():
+            chunks, provider = self.llm_manager.stream_response_with_provider(user_message, history)
+            if chunks:
+                logger.info(f"Streaming LLM response from {provider}")
+                received = []
+                delivered = 0
+                
+                def collect():
+                    for chunk in chunks:
+                        received.append(chunk)
+                        yield chunk
+                
+                try:
+                    for part in iter_delivery_parts(collect()):
+                        delivered += 1
+                        yield part
+                except Exception as e:
+                    # A cut-off answer is never cached or remembered
+                    logger.error(f"LLM stream from {provider} failed after {delivered} parts: {e}")
+                    if delivered:
+                        yield STREAM_INTERRUPTED_MESSAGE
+                        return
+                else:
+                    self.router.record(LLM_TIER, time.perf_counter() - start)
+                    self._store_answer(cache_key, query_vector, ''.join(received), provider)
+                    self._remember(sender, user_message, ''.join(received))
+                    return
+                # Nothing reached the user yet: answer through the regular fallback chain instead
+        
+        response, backend = self._generate_advice(user_message, local=local, start=start, history=history)
+        self._store_answer(cache_key, query_vector, response, backend)
+        if backend:
+            self._remember(sender, user_message, response)
+        yield from split_message(response)
+    
+    def _history_for(self, sender):
+        """Token-budgeted recent turns for a sender, empty without a conversation store"""
+        if self.conversations is None or not sender:
+            return []
+        return self.conversations.get_history(sender, self.history_tokens)
     
-    def get_medical_advice(self, user_message):
-        """Generate medical advice based on user input"""
+    def _remember(self, sender, user_message, response):
+        """Append an exchange to the sender's conversation"""
+        if self.conversations is None or not sender or not response:
+            return
+        # The disclaimer repeats on every local answer; it only costs history tokens
+        self.conversations.add_exchange(sender, user_message, response.removesuffix(DISCLAIMER))
+    
+    def end_conversation(self, sender):
+        """Forget a sender's conversation (they said goodbye)"""
+        if self.conversations is not None and sender:
+            self.conversations.clear(sender)
+    
+    def _lookup_cached(self, cache_key):
+        """Return (cached response or None, query vector for the semantic cache)"""
+        if self.response_cache is not None and cache_key:
+            cached = self.response_cache.get(cache_key)
+            if cached:
+                logger.info(f"Using cached response from {cached[1]}")
+                return cached[0], None
+        
+        # Paraphrases of earlier LLM questions can reuse their answers
+        query_vector = None
+        if self.semantic_cache is not None and self.use_llm and self.vectorizer and cache_key:
+            query_vector = self.vectorizer.transform([cache_key])
+            similar = self.semantic_cache.get(query_vector)
+            if similar:
+                logger.info(f"Using semantically cached response from {similar[1]} (similarity {similar[2]:.2f})")
+                if self.response_cache is not None:
+                    self.response_cache.set(cache_key, similar[0], similar[1])
+                return similar[0], query_vector
+        
+        return None, query_vector
+    
+    def _store_answer(self, cache_key, query_vector, response, backend):
+        """Cache a generated answer; error messages (backend None) and LLM fallbacks are not cached"""
+        # A fallback cached during a provider outage would keep answering after the LLMs recover
+        if not backend or not response or backend == RANDOM_FOREST_FALLBACK_BACKEND:
+            return
+        if self.response_cache is not None and cache_key:
+            self.response_cache.set(cache_key, response, backend)
+        if query_vector is not None and backend != RANDOM_FOREST_BACKEND:
+            self.semantic_cache.add(query_vector, response, backend)
+    
+    def _predict_local(self, processed_message):
+        """(advice with disclaimer, confidence) from the local model, None if it is unavailable"""
+        if self.bundle is None:
+            return None
+        try:
+            if self.micro_batcher:
+                return self.micro_batcher.submit(processed_message)
+            return self.predict_scored_batch([processed_message])[0]
+        except Exception as e:
+            logger.error(f"Error generating advice: {e}")
+            return None
+    
+    def _generate_advice(self, user_message, local=None, start=None, history=None):
+        """Generate advice, returning (response, backend) where backend is None on failure"""
+        start = start if start is not None else time.perf_counter()
+        llm_available = self.use_llm and self.llm_manager.is_available()
+        
+        # Tiered routing: a confident local answer never reaches the LLMs
+        # (a local answer passed in has already been checked by the caller)
+        if self.router.enabled and llm_available and local is None:
+            local = self._predict_local(self.preprocess_text(user_message))
+            if local and self.router.is_confident(local[1]):
+                logger.info(f"Using local model (confidence {local[1]:.2f})")
+                self.router.record(LOCAL_TIER, time.perf_counter() - start)
+                return local[0], RANDOM_FOREST_BACKEND
         
         # Try LLM first if enabled and available
-        if self.use_llm and self.llm_manager.is_available():
+        if llm_available:
             try:
-                llm_response = self.llm_manager.generate_response(user_message)
+                llm_response, provider = self.llm_manager.generate_response_with_provider(user_message, history)
                 if llm_response:
                     logger.info("Using LLM response")
-                    return llm_response
+                    self.router.record(LLM_TIER, time.perf_counter() - start)
+                    return llm_response, provider
             except Exception as e:
                 logger.error(f"LLM error, falling back to traditional model: {e}")
         
         # Fallback to traditional RandomForest model
-        if not self.model or not self.vectorizer:
-            return "I'm sorry, the medical AI is currently unavailable. Please try again later."
+        if self.bundle is None:
+            return "I'm sorry, the medical AI is currently unavailable. Please try again later.", None
         
-        try:
-            # Preprocess the message
-            processed_message = self.preprocess_text(user_message)
-            
-            # Vectorize the input
-            message_vector = self.vectorizer.transform([processed_message])
-            
-            # Get prediction
-            prediction = self.model.predict(message_vector)[0]
-            
-            # Add disclaimer to medical advice
-            disclaimer = "\n\n⚠️ DISCLAIMER: This is AI-generated advice for informational purposes only. Please consult a qualified healthcare professional for proper medical diagnosis and treatment."
-            
-            logger.info("Using traditional RandomForest model")
-            return f"{prediction}{disclaimer}"
-            
-        except Exception as e:
-            logger.error(f"Error generating advice: {e}")
-            return "I'm sorry, I couldn't process your medical query. Please try rephrasing your question."
+        local = local or self._predict_local(self.preprocess_text(user_message))
+        if local is None:
+            return "I'm sorry, I couldn't process your medical query. Please try rephrasing your question.", None
+        
+        logger.info("Using traditional RandomForest model")
+        self.router.record(LOCAL_FALLBACK_TIER if llm_available else LOCAL_TIER, time.perf_counter() - start)
+        return local[0], RANDOM_FOREST_FALLBACK_BACKEND if self.use_llm else RANDOM_FOREST_BACKEND
+    
+    def predict_scored_batch(self, processed_messages):
+        """Vectorize and predict preprocessed messages in one call, returning (advice with disclaimer, confidence) pairs"""
+        # Read the bundle once so a concurrent reload cannot mix model and vectorizer
+        bundle = self.bundle
+        answer_ids, confidences = bundle.predict_ids_with_confidence(processed_messages)
+        return list(zip(bundle.advice(answer_ids, DISCLAIMER), confidences))
+    
+    def predict_batch(self, processed_messages):
+        """Vectorize and predict preprocessed messages in one call, returning advice with disclaimers"""
+        # Read the bundle once so a concurrent reload cannot mix model and vectorizer
+        bundle = self.bundle
+        answer_ids, _ = bundle.predict_ids_with_confidence(processed_messages)
+        
+        # The bundle keeps the common answers with the disclaimer already appended
+        return bundle.advice(answer_ids, DISCLAIMER)
+    
+    def get_medical_advice_batch(self, messages):
+        """Generate advice for many messages with the local model, sharing one predict call"""
+        if self.bundle is None:
+            return ["I'm sorry, the medical AI is currently unavailable. Please try again later."] * len(messages)
+        
+        cache_keys = [self.preprocess_text(message) for message in messages]
+        responses = [None] * len(messages)
+        
+        misses = []
+        for i, cache_key in enumerate(cache_keys):
+            cached = self.response_cache.get(cache_key) if self.response_cache is not None and cache_key else None
+            if cached:
+                responses[i] = cached[0]
+            else:
+                misses.append(i)
+        
+        if misses:
+            advice = self.predict_batch([cache_keys[i] for i in misses])
+            for i, response in zip(misses, advice):
+                responses[i] = response
+                self._store_answer(cache_keys[i], None, response, RANDOM_FOREST_BACKEND)
+        
+        logger.info(f"Batch of {len(messages)} messages ({len(misses)} predicted)")
+        return responses
 
 # Initialize the chatbot
 chatbot = MedicalChatbot()
 
+def start_background_tasks():
+    """Start per-process background work (called after fork when the app is preloaded)"""
+    if chatbot.model_watcher:
+        if os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true':
+            # One elected worker watches for all of them; the lock file is per master
+            chatbot.model_watcher.start(os.path.join(tempfile.gettempdir(), f'model_watch_{os.getppid()}.lock'))
+        else:
+            chatbot.model_watcher.start()
+    # Open LLM connections (and load local Ollama models) without blocking startup
+    if chatbot.use_llm and os.getenv('LLM_WARMUP', 'true').lower() == 'true':
+        threading.Thread(target=chatbot.llm_manager.warm_up, name='llm-warmup', daemon=True).start()
+
+# gunicorn.conf.py sets GUNICORN_PRELOAD and starts these in each worker's post_fork instead
+if os.getenv('GUNICORN_PRELOAD', 'false').lower() != 'true':
+    start_background_tasks()
+
 # Twilio configuration
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
+TWILIO_CONFIGURED = bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN)
 
-if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
-    twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-else:
-    twilio_client = None
+if not TWILIO_CONFIGURED:
     logger.warning("Twilio credentials not found. WhatsApp functionality will be limited.")
 
-@app.route('/webhook', methods=['POST'])
-def whatsapp_webhook():
-    """Handle incoming WhatsApp messages"""
-    try:
-        # Get message data from Twilio
-        incoming_msg = request.values.get('Body', '').strip()
-        sender_number = request.values.get('From', '')
-        
-        logger.info(f"Received message from {sender_number}: {incoming_msg}")
-        
-        # Handle different types of messages
-        if incoming_msg.lower() in ['hi', 'hello', 'start', 'help']:
-            response = """🏥 Welcome to Medical AI Assistant!
+_twilio_client = None
+_twilio_client_pid = None
+
+def get_twilio_client():
+    """Twilio client for this process, created lazily so forked workers never share its session"""
+    global _twilio_client, _twilio_client_pid
+    if TWILIO_CONFIGURED and _twilio_client_pid != os.getpid():
+        _twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        _twilio_client_pid = os.getpid()
+    return _twilio_client
+
+WELCOME_MESSAGE = """🏥 Welcome to Medical AI Assistant!
             
 I can help you with:
 • General health questions
@@ -126,22 +455,102 @@ I can help you with:
 Please describe your symptoms or health concern, and I'll provide guidance.
 
 ⚠️ Remember: This is for informational purposes only. Always consult a healthcare professional for serious medical issues."""
+
+GOODBYE_MESSAGE = "Thank you for using Medical AI Assistant. Take care of your health! 🏥"
+
+GREETING_KEYWORDS = ['hi', 'hello', 'start', 'help']
+GOODBYE_KEYWORDS = ['bye', 'goodbye', 'exit', 'quit']
+
+def build_reply(incoming_msg, sender_number=None):
+    """Pick the canned greeting/goodbye or ask the model for advice"""
+    if incoming_msg.lower() in GREETING_KEYWORDS:
+        return WELCOME_MESSAGE
+    elif incoming_msg.lower() in GOODBYE_KEYWORDS:
+        chatbot.end_conversation(sender_number)
+        return GOODBYE_MESSAGE
+    else:
+        # Get medical advice from the AI model
+        return chatbot.get_medical_advice(incoming_msg, sender=sender_number)
+
+def send_whatsapp_message(to, body):
+    """Send a message back to the user via WhatsApp"""
+    twilio_client = get_twilio_client()
+    if twilio_client:
+        with STAGE_SECONDS.time('twilio_send', OK):
+            twilio_client.messages.create(
+                body=body,
+                from_=TWILIO_PHONE_NUMBER,
+                to=to
+            )
+        logger.info(f"Response sent to {to}")
+
+def deliver_reply(sender_number, incoming_msg):
+    """Build the reply for a message and send it (runs on a reply worker in async mode)"""
+    if chatbot.stream_replies and incoming_msg.lower() not in GREETING_KEYWORDS + GOODBYE_KEYWORDS:
+        # Each part is sent as soon as it is ready
+        for part in chatbot.iter_medical_advice(incoming_msg, sender=sender_number):
+            send_whatsapp_message(sender_number, part)
+        return
+    
+    response = build_reply(incoming_msg, sender_number)
+    send_whatsapp_message(sender_number, response)
+
+# Async webhook mode: acknowledge Twilio immediately, reply from a worker pool
+ASYNC_WEBHOOK = os.getenv('ASYNC_WEBHOOK', 'false').lower() == 'true'
+reply_pool = ReplyWorkerPool.from_env(deliver_reply) if ASYNC_WEBHOOK else None
+
+def submit_reply(sender_number, incoming_msg):
+    """Queue a (possibly coalesced) message for a reply worker"""
+    if not reply_pool.submit(sender_number, incoming_msg):
+        logger.warning(f"Reply queue full, dropped coalesced message from {sender_number}")
+
+# Throttling happens in the webhook, before any model or LLM work
+rate_limiter = RateLimiter.from_env()
+# Merging a burst into one query needs the reply to be sent later, so it only applies in async mode
+coalescer = MessageCoalescer.from_env(submit_reply) if ASYNC_WEBHOOK else None
+if not ASYNC_WEBHOOK and float(os.getenv('COALESCE_WINDOW_MS', '0')) > 0:
+    logger.warning("COALESCE_WINDOW_MS needs ASYNC_WEBHOOK=true, message coalescing disabled")
+
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '1000'))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    start = g.get('request_start')
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, request.endpoint or 'unknown', str(response.status_code))
+    return response
+
+@app.route('/webhook', methods=['POST'])
+def whatsapp_webhook():
+    """Handle incoming WhatsApp messages"""
+    try:
+        # Get message data from Twilio
+        with STAGE_SECONDS.time('parse', OK):
+            incoming_msg = request.values.get('Body', '').strip()
+            sender_number = request.values.get('From', '')
         
-        elif incoming_msg.lower() in ['bye', 'goodbye', 'exit', 'quit']:
-            response = "Thank you for using Medical AI Assistant. Take care of your health! 🏥"
+        logger.info(f"Received message from {sender_number}: {incoming_msg}")
         
-        else:
-            # Get medical advice from the AI model
-            response = chatbot.get_medical_advice(incoming_msg)
+        if rate_limiter and not rate_limiter.allow(sender_number):
+            logger.warning(f"Rate limit exceeded for {sender_number}, message dropped")
+            return jsonify({'status': 'throttled'}), 429
+        
+        if reply_pool:
+            if not incoming_msg or not sender_number:
+                return jsonify({'status': 'ignored'})
+            if coalescer:
+                coalescer.add(sender_number, incoming_msg)
+                return jsonify({'status': 'queued'})
+            if not reply_pool.submit(sender_number, incoming_msg):
+                return jsonify({'status': 'busy'}), 503
+            return jsonify({'status': 'queued'})
         
         # Send response back via WhatsApp
-        if twilio_client:
-            message = twilio_client.messages.create(
-                body=response,
-                from_=TWILIO_PHONE_NUMBER,
-                to=sender_number
-            )
-            logger.info(f"Response sent to {sender_number}")
+        deliver_reply(sender_number, incoming_msg)
         
         return jsonify({'status': 'success'})
         
@@ -152,11 +561,38 @@ Please describe your symptoms or health concern, and I'll provide guidance.
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    health = {
         'status': 'healthy',
-        'model_loaded': chatbot.model is not None,
-        'twilio_configured': twilio_client is not None
-    })
+        'model_loaded': chatbot.bundle is not None,
+        'model_engine': chatbot.model_engine,
+        'twilio_configured': TWILIO_CONFIGURED
+    }
+    if chatbot.bundle is not None:
+        health['model_source'] = chatbot.bundle.source
+        health['model_loaded_at'] = chatbot.bundle.loaded_at
+    if chatbot.llm_manager.is_available():
+        health['llm_providers'] = chatbot.llm_manager.health_snapshot()
+    if chatbot.response_cache is not None:
+        health['response_cache'] = chatbot.response_cache.snapshot()
+    if chatbot.semantic_cache is not None:
+        health['semantic_cache'] = chatbot.semantic_cache.snapshot()
+    health['routing'] = chatbot.router.snapshot()
+    if chatbot.conversations is not None:
+        health['conversations'] = chatbot.conversations.snapshot()
+    if chatbot.micro_batcher:
+        health['micro_batch'] = chatbot.micro_batcher.snapshot()
+    if reply_pool:
+        health['reply_queue'] = reply_pool.snapshot()
+    if rate_limiter:
+        health['rate_limit'] = rate_limiter.snapshot()
+    if coalescer:
+        health['coalescing'] = coalescer.snapshot()
+    return jsonify(health)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage, LLM attempt and request latency histograms for Prometheus (this worker process only)"""
+    return Response(render_metrics(), mimetype=None, content_type=CONTENT_TYPE)
 
 @app.route('/test', methods=['POST'])
 def test_chatbot():
@@ -175,6 +611,46 @@ def test_chatbot():
         logger.error(f"Error in test endpoint: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/batch', methods=['POST'])
+def batch_advice():
+    """Advice for a list of messages from the local model in one batched prediction"""
+    try:
+        data = request.get_json()
+        messages = data.get('messages', [])
+        
+        if not isinstance(messages, list) or not messages:
+            return jsonify({'error': 'A non-empty list of messages is required'}), 400
+        if len(messages) > BATCH_MAX_SIZE:
+            return jsonify({'error': f'At most {BATCH_MAX_SIZE} messages per batch'}), 400
+        
+        responses = chatbot.get_medical_advice_batch([str(message) for message in messages])
+        return jsonify({'responses': responses})
+        
+    except Exception as e:
+        logger.error(f"Error in batch endpoint: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Token for /admin endpoints; they are disabled when it is unset
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """Load new model files in the background and swap them in once they pass a smoke test"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled'}), 404
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(token, ADMIN_TOKEN):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true':
+        # Only this worker sees the request; the master reloads once and replaces every worker
+        os.kill(os.getppid(), signal.SIGHUP)
+        return jsonify({'status': 'reloading', 'scope': 'all workers'}), 202
+    
+    if not chatbot.reload_model_in_background():
+        return jsonify({'status': 'reload already in progress'}), 409
+    return jsonify({'status': 'reloading', 'scope': 'this process'}), 202
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file